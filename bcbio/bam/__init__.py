@@ -13,7 +13,7 @@ import toolz as tz
 from six.moves import zip_longest
 
 from bcbio import broad, utils
-from bcbio.bam import ref
+from bcbio.bam import ref, stats
 from bcbio.distributed import objectstore
 from bcbio.distributed.transaction import file_transaction
 from bcbio.log import logger
@@ -490,6 +490,9 @@ def estimate_read_length(bam_file, nreads=1000):
     """
     estimate median read length of a SAM/BAM file
     """
+    if is_bam(bam_file) and nreads <= stats.LENGTH_READS:
+        lengths = stats.get(bam_file, ["lengths"])["lengths"][:nreads]
+        return int(numpy.median(lengths))
     with open_samfile(bam_file) as bam_handle:
         reads = tz.itertoolz.take(nreads, bam_handle)
         lengths = [len(x.seq) for x in reads]
@@ -499,6 +502,9 @@ def estimate_fragment_size(bam_file, nreads=5000):
     """
     estimate median fragment size of a SAM/BAM file
     """
+    if is_bam(bam_file) and nreads == stats.FRAGMENT_READS:
+        lengths = stats.get(bam_file, ["fragments"])["fragments"]
+        return int(numpy.median(lengths)) if len(lengths) else 0
     with open_samfile(bam_file) as bam_handle:
         reads = tz.itertoolz.take(nreads, bam_handle)
         # it would be good to skip spliced paired reads.
@@ -9,9 +9,11 @@ Regions are split to try to maintain relative uniformity across the
 genome and avoid extremes of large blocks or large numbers of
 small blocks.
 """
+import bisect
 import collections
 from functools import reduce
 import os
+import struct
 
 import numpy
 import pybedtools
@@ -129,28 +131,169 @@ def _add_config_regions(nblock_regions, ref_regions, data):
         all_intervals = _combine_regions([all_intervals, remove_intervals], ref_regions)
     return all_intervals.merge()
 
+class DepthProfile:
+    """Expected reads along each chromosome, used to balance work in analysis blocks.
+
+    Built from BAM index linear offsets, which track compressed bytes of reads
+    in each 16kb window, or mosdepth region depths when no BAM index is available.
+    These measure work in different units, so each sample contributes its fraction
+    of work along the genome and the profile sums these over a batch.
+    """
+    def __init__(self):
+        self._by_chrom = collections.defaultdict(list)
+
+    def add_sample(self, by_chrom):
+        """Add work for a sample, as sorted (start, end, work) intervals by chromosome.
+
+        Returns False, without adding, for samples with no work.
+        """
+        total = float(sum(work for intervals in by_chrom.values() for _, _, work in intervals))
+        if total <= 0:
+            return False
+        for chrom, intervals in by_chrom.items():
+            self.add_intervals(chrom, intervals, scale=1.0 / total)
+        return True
+
+    def add_intervals(self, chrom, intervals, scale=1.0):
+        """Add sorted, non-overlapping (start, end, work) intervals for a chromosome.
+        """
+        starts, ends, cum, weights = [], [], [], []
+        total = 0.0
+        for start, end, work in intervals:
+            if end > start and work > 0:
+                work *= scale
+                total += work
+                starts.append(start)
+                ends.append(end)
+                weights.append(work)
+                cum.append(total)
+        if starts:
+            self._by_chrom[chrom].append((starts, ends, cum, weights))
+
+    def _cumulative(self, chrom, pos):
+        total = 0.0
+        for starts, ends, cum, weights in self._by_chrom.get(chrom, []):
+            i = bisect.bisect_right(ends, pos)
+            if i > 0:
+                total += cum[i - 1]
+            if i < len(starts) and starts[i] < pos:
+                total += weights[i] * float(pos - starts[i]) / (ends[i] - starts[i])
+        return total
+
+    def size(self, chrom, start, end):
+        return self._cumulative(chrom, end) - self._cumulative(chrom, start)
+
+    def total(self):
+        return sum(cum[-1] for xs in self._by_chrom.values() for (_, _, cum, _) in xs)
+
+def _bai_window_offsets(bai_file):
+    """Retrieve compressed file offsets for each 16kb window from a BAM index linear index.
+    """
+    out = []
+    with open(bai_file, "rb") as in_handle:
+        buf = in_handle.read()
+    if buf[:4] != b"BAI\1":
+        raise ValueError("Unexpected BAM index format: %s" % bai_file)
+    pos = 4
+    n_ref = struct.unpack_from("<i", buf, pos)[0]
+    pos += 4
+    for _ in range(n_ref):
+        n_bin = struct.unpack_from("<i", buf, pos)[0]
+        pos += 4
+        for _ in range(n_bin):
+            n_chunk = struct.unpack_from("<i", buf, pos + 4)[0]
+            pos += 8 + 16 * n_chunk
+        n_intv = struct.unpack_from("<i", buf, pos)[0]
+        pos += 4
+        offsets = struct.unpack_from("<%dQ" % n_intv, buf, pos)
+        pos += 8 * n_intv
+        out.append([x >> 16 for x in offsets])
+    return out
+
+def _bam_index_depth(bam_file):
+    """Expected work per 16kb window using compressed bytes between linear index entries.
+    """
+    bai_file = bam_file + ".bai"
+    if not utils.file_exists(bai_file):
+        bai_file = "%s.bai" % os.path.splitext(bam_file)[0]
+    if not utils.file_exists(bai_file):
+        return None
+    window = 16384
+    with pysam.AlignmentFile(bam_file, "rb") as bam_handle:
+        chroms = list(bam_handle.references)
+    by_chrom = collections.OrderedDict()
+    for chrom, offsets in zip(chroms, _bai_window_offsets(bai_file)):
+        diffs = [max(0, b - a) for a, b in zip(offsets, offsets[1:])]
+        # last window has no following offset, assume an average window
+        if diffs:
+            diffs.append(sum(diffs) // len(diffs))
+        by_chrom[chrom] = [(i * window, (i + 1) * window, d) for i, d in enumerate(diffs)]
+    return by_chrom
+
+def _mosdepth_depth(regions_file):
+    """Expected work from mosdepth region average depths.
+    """
+    by_chrom = collections.OrderedDict()
+    with utils.open_gzipsafe(regions_file) as in_handle:
+        for line in in_handle:
+            parts = line.rstrip().split("\t")
+            start, end = int(parts[1]), int(parts[2])
+            by_chrom.setdefault(parts[0], []).append((start, end, float(parts[-1]) * (end - start)))
+    for chrom in by_chrom:
+        by_chrom[chrom].sort()
+    return by_chrom
+
+def get_depth_profile(items):
+    """Retrieve expected reads along the genome for a batch of samples.
+
+    Returns None if depth information is not available for all samples, falling
+    back to splitting blocks by base pairs.
+    """
+    profile = DepthProfile()
+    for data in items:
+        bam_file = dd.get_work_bam(data) or dd.get_align_bam(data)
+        regions_file = tz.get_in(["depth", "variant_regions", "regions"], data)
+        try:
+            if bam_file and bam_file.endswith(".bam") and profile.add_sample(_bam_index_depth(bam_file) or {}):
+                continue
+        except (ValueError, struct.error, IOError) as e:
+            logger.debug("Could not read BAM index depth for %s: %s" % (bam_file, e))
+        if not regions_file or not utils.file_exists(regions_file) or not profile.add_sample(_mosdepth_depth(regions_file)):
+            return None
+    return profile if profile.total() > 0 else None
+
 class NBlockRegionPicker:
     """Choose nblock regions reasonably spaced across chromosomes.
 
     This avoids excessively large blocks and also large numbers of tiny blocks
     by splitting to a defined number of blocks.
 
+    With a DepthProfile, spacing is measured in expected reads instead of base
+    pairs, so blocks in high depth regions are smaller and carry similar work.
+
     Assumes to be iterating over an ordered input file and needs re-initiation
     with each new file processed as it keeps track of previous blocks to
     maintain the splitting.
     """
-    def __init__(self, ref_regions, config, min_n_size):
+    def __init__(self, ref_regions, config, min_n_size, profile=None):
         self._end_buffer = 250 if min_n_size > 50 else 0
         self._chr_last_blocks = {}
+        self._profile = profile
         target_blocks = int(config["algorithm"].get("nomap_split_targets", 200))
         self._target_size = self._get_target_size(target_blocks, ref_regions)
         self._ref_sizes = {x.chrom: x.stop for x in ref_regions}
 
+    def _size(self, chrom, start, end):
+        if self._profile:
+            return self._profile.size(chrom, start, end)
+        else:
+            return end - start
+
     def _get_target_size(self, target_blocks, ref_regions):
         size = 0
         for x in ref_regions:
-            size += (x.end - x.start)
-        return size // target_blocks
+            size += self._size(x.chrom, x.start, x.end)
+        return size / float(target_blocks) if self._profile else size // target_blocks
 
     def include_block(self, x):
         """Check for inclusion of block based on distance from previous.
@@ -160,9 +303,9 @@ class NBlockRegionPicker:
         if last_pos <= self._end_buffer and x.stop >= self._ref_sizes.get(x.chrom, 0) - self._end_buffer:
             return True
         # Do not split on smaller decoy and haplotype chromosomes
-        elif self._ref_sizes.get(x.chrom, 0) <= self._target_size:
+        elif self._size(x.chrom, 0, self._ref_sizes.get(x.chrom, 0)) <= self._target_size:
             return False
-        elif (x.start - last_pos) > self._target_size:
+        elif self._size(x.chrom, last_pos, x.start) > self._target_size:
             self._chr_last_blocks[x.chrom] = x.stop
             return True
         else:
@@ -334,7 +477,8 @@ def _combine_sample_regions_batch(batch, items):
                 ref_file = tz.get_in(["reference", "fasta", "base"], items[0])
                 ref_regions = get_ref_bedtool(ref_file, config)
                 min_n_size = int(config["algorithm"].get("nomap_split_size", 250))
-                block_filter = NBlockRegionPicker(ref_regions, config, min_n_size)
+                block_filter = NBlockRegionPicker(ref_regions, config, min_n_size,
+                                                  get_depth_profile(items))
                 final_nblock_regions = nblock_regions.filter(
                     block_filter.include_block).saveas().each(block_filter.expand_block).saveas(
                         "%s-nblockfinal%s" % utils.splitext_plus(tx_afile))
@@ -3,7 +3,7 @@
 
 import six
 from six.moves import zip
-from itertools import product
+from itertools import islice, product
 import os
 import random
 import sys
@@ -280,17 +280,15 @@ def downsample(f1, f2, N, quick=False):
 def estimate_read_length(fastq_file, quality_format="fastq-sanger", nreads=1000):
     """
     estimate average read length of a fastq file
+
+    Reads sequence lines directly, without parsing full records.
     """
     average = 0
     with open_fastq(fastq_file) as fastq_handle:
-        record_iterator = SeqIO.parse(fastq_handle, quality_format)
-        read = next(record_iterator)
-        average = len(read.seq)
-        for _ in range(nreads):
-            try:
-                average = (average + len(next(record_iterator).seq)) / 2
-            except StopIteration:
-                break
+        seq_lengths = (len(line.rstrip()) for line in islice(fastq_handle, 1, 4 * (nreads + 1), 4))
+        average = next(seq_lengths)
+        for cur_length in seq_lengths:
+            average = (average + cur_length) / 2
     return average
 
 def estimate_maximum_read_length(fastq_file, quality_format="fastq-sanger",
@@ -1,19 +1,98 @@
-"""Calculation of mapped reads by BAM counting, currently implemented with samtools.
+"""Calculation of mapped reads by BAM counting, currently implemented with hts_nim_tools.
+
+Counts and other per-sample summary statistics go to a single SQLite cache
+for the run, allowing indexed lookups and safe concurrent writes from
+parallel processes through SQLite locking. This uses the default rollback
+journal, since WAL mode requires shared memory unavailable on NFS and Lustre.
 """
-import contextlib
+import hashlib
 import json
 import os
+import sqlite3
 import time
 import toolz as tz
+from six.moves import urllib
 
 from bcbio import bam, utils
 from bcbio.bam import ref
+from bcbio.log import logger
 from bcbio.pipeline import datadict as dd
 from bcbio.provenance import do
 from bcbio.distributed.transaction import file_transaction
 
 pybedtools = utils.LazyImport("pybedtools")
 
+class StatsCache:
+    """Key value store of JSON serializable statistics, shared between processes.
+
+    Entries can be checked against the modification times of input files,
+    treating entries older than any input as missing. Databases without
+    write access, such as staged CWL inputs, are opened read-only for lookups.
+    """
+    def __init__(self, db_file):
+        self.db_file = db_file
+
+    def _is_read_only(self):
+        return (os.path.exists(self.db_file) and
+                not (os.access(self.db_file, os.W_OK) and
+                     os.access(os.path.dirname(os.path.abspath(self.db_file)), os.W_OK)))
+
+    def _connect(self):
+        if self._is_read_only():
+            uri = "file:%s?mode=ro&immutable=1" % urllib.parse.quote(os.path.abspath(self.db_file))
+            return sqlite3.connect(uri, uri=True)
+        is_new = not os.path.exists(self.db_file)
+        conn = sqlite3.connect(self.db_file, timeout=60)
+        conn.execute("CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value TEXT, updated REAL)")
+        if is_new:
+            self._import_text_cache(conn)
+        return conn
+
+    def _import_text_cache(self, conn):
+        """Back-compatible: load counts from tab separated caches of previous versions.
+        """
+        text_file = os.path.splitext(self.db_file)[0] + ".txt"
+        if utils.file_exists(text_file):
+            updated = os.path.getmtime(text_file)
+            with open(text_file) as in_handle:
+                rows = [(k, v, updated) for k, v in (l.rstrip("\n").split("\t") for l in in_handle if l.strip())]
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO stats VALUES (?, ?, ?)", rows)
+
+    def get_many(self, keys, cmp_files=None):
+        """Retrieve cached values for keys, skipping entries older than any of cmp_files.
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+        min_updated = max([os.path.getmtime(f) for f in cmp_files or [] if f and os.path.exists(f)] or [0])
+        try:
+            conn = self._connect()
+            rows = conn.execute("SELECT key, value, updated FROM stats WHERE key IN (%s)" %
+                                ", ".join("?" * len(keys)), keys).fetchall()
+            conn.close()
+        except sqlite3.Error as e:
+            logger.debug("Could not read statistics from %s: %s" % (self.db_file, e))
+            return {}
+        return dict((k, json.loads(v)) for k, v, updated in rows if updated >= min_updated)
+
+    def get(self, key, cmp_files=None):
+        return self.get_many([key], cmp_files).get(key)
+
+    def put_many(self, items):
+        updated = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO stats VALUES (?, ?, ?)",
+                                 [(k, json.dumps(v), updated) for k, v in items.items()])
+            conn.close()
+        except sqlite3.Error as e:
+            logger.debug("Could not write statistics to %s: %s" % (self.db_file, e))
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
 def _backcompatible_cache_file(query_flags, bed_file, target_name, data):
     """Back-compatible: retrieve cache file from previous location.
     """
@@ -32,18 +111,29 @@ def get_cache_file(data):
         return cache_file
     else:
         return os.path.join(utils.safe_makedir(os.path.join(dd.get_work_dir(data), "coverage")),
-                            "mapped_stats.txt")
+                            "mapped_stats.db")
+
+def get_cache(data):
+    """Retrieve the statistics cache for a run, shared by all samples.
+    """
+    cache_file = get_cache_file(data)
+    if not cache_file.endswith(".db"):
+        cache_file = os.path.splitext(cache_file)[0] + ".db"
+    return StatsCache(cache_file)
 
 def number_of_mapped_reads(data, bam_file, keep_dups=True, bed_file=None, target_name=None):
     """Count mapped reads, allow adjustment for duplicates and BED regions.
 
-    Since samtools view does not use indexes for BED files
-    (https://github.com/samtools/samtools/issues/88)
-    we loop over regions in a BED file and add the counts together.
-
     Uses a global cache file to store counts, making it possible to pass this single
-    file for CWL runs. For parallel processes it can have concurrent append writes,
-    so we have a simple file locking mechanism to avoid this.
+    file for CWL runs.
+    """
+    return mapped_reads_by_target(data, bam_file, [(bed_file, target_name)], keep_dups)[0]
+
+def mapped_reads_by_target(data, bam_file, targets, keep_dups=True):
+    """Count mapped reads in multiple BED files, counting all uncached targets in a single pass.
+
+    targets is a list of (bed_file, target_name), with a bed_file of None counting
+    reads across the whole genome. Returns counts in the order of targets.
     """
     # Flag explainer https://broadinstitute.github.io/picard/explain-flags.html
     callable_flags = ["not unmapped", "not mate_is_unmapped", "not secondary_alignment",
@@ -55,67 +145,89 @@ def number_of_mapped_reads(data, bam_file, keep_dups=True, bed_file=None, target
         query_flags = callable_flags + ["not duplicate"]
         flag = 1804  # as above plus not duplicate
 
+    counts = [None] * len(targets)
     # Back compatible cache
-    oldcache_file = _backcompatible_cache_file(query_flags, bed_file, target_name, data)
-    if oldcache_file:
-        with open(oldcache_file) as f:
-            return int(f.read().strip())
-
-    # New cache
-    key = json.dumps({"flags": sorted(query_flags),
-                      "region": os.path.basename(bed_file) if bed_file else "",
-                      "sample": dd.get_sample_name(data)},
-                     separators=(",", ":"), sort_keys=True)
-    cache_file = get_cache_file(data)
-    if utils.file_exists(cache_file):
-        with open(cache_file) as in_handle:
-            for cur_key, cur_val in (l.strip().split("\t") for l in in_handle):
-                if cur_key == key:
-                    return int(cur_val)
-
-    # Calculate stats
-    count_dir = utils.safe_makedir(os.path.join(dd.get_work_dir(data), "coverage",
-                                                dd.get_sample_name(data), "counts"))
-    if not bed_file:
-        bed_file = os.path.join(count_dir, "fullgenome.bed")
-        if not utils.file_exists(bed_file):
-            with file_transaction(data, bed_file) as tx_out_file:
+    for i, (bed_file, target_name) in enumerate(targets):
+        oldcache_file = _backcompatible_cache_file(query_flags, bed_file, target_name, data)
+        if oldcache_file:
+            with open(oldcache_file) as f:
+                counts[i] = int(f.read().strip())
+
+    keys = [json.dumps({"flags": sorted(query_flags),
+                        "region": os.path.basename(bed_file) if bed_file else "",
+                        "sample": dd.get_sample_name(data)},
+                       separators=(",", ":"), sort_keys=True)
+            for bed_file, _ in targets]
+    cache = get_cache(data)
+    cached = cache.get_many(set(k for k, c in zip(keys, counts) if c is None))
+    for i, key in enumerate(keys):
+        if counts[i] is None and key in cached:
+            counts[i] = int(cached[key])
+
+    to_count = [i for i, c in enumerate(counts) if c is None]
+    if to_count:
+        count_dir = utils.safe_makedir(os.path.join(dd.get_work_dir(data), "coverage",
+                                                    dd.get_sample_name(data), "counts"))
+        bed_files = [targets[i][0] or _fullgenome_bed(count_dir, data) for i in to_count]
+        new_counts = _count_reads(bed_files, bam_file, flag, count_dir, data)
+        for i, count in zip(to_count, new_counts):
+            counts[i] = count
+        cache.put_many(dict((keys[i], counts[i]) for i in to_count))
+    return counts
+
+def _fullgenome_bed(count_dir, data):
+    bed_file = os.path.join(count_dir, "fullgenome.bed")
+    if not utils.file_exists(bed_file):
+        with file_transaction(data, bed_file) as tx_out_file:
+            with open(tx_out_file, "w") as out_handle:
+                for c in ref.file_contigs(dd.get_ref_file(data), data["config"]):
+                    out_handle.write("%s\t%s\t%s\n" % (c.name, 0, c.size))
+    return bed_file
+
+def _read_regions(bed_file):
+    with utils.open_gzipsafe(bed_file) as in_handle:
+        for line in in_handle:
+            if line.strip() and not line.startswith(("#", "track", "browser")):
+                yield tuple(line.rstrip("\r\n").split("\t", 3)[:3])
+
+def _count_reads(bed_files, bam_file, flag, count_dir, data):
+    """Count reads in BED files with a single hts_nim_tools run over all regions.
+
+    Multiple BED files combine into a single file of unique regions, and region
+    counts add back to each target containing them.
+    """
+    if len(bed_files) == 1:
+        count_bed = bed_files[0]
+        name = os.path.splitext(os.path.basename(count_bed))[0]
+    else:
+        name = "targets-%s" % hashlib.md5("\n".join(os.path.abspath(f) for f in bed_files)
+                                          .encode("utf-8")).hexdigest()[:12]
+        count_bed = os.path.join(count_dir, "%s.bed" % name)
+        if not all(utils.file_uptodate(count_bed, f) for f in bed_files):
+            regions = set()
+            with file_transaction(data, count_bed) as tx_out_file:
                 with open(tx_out_file, "w") as out_handle:
-                    for c in ref.file_contigs(dd.get_ref_file(data), data["config"]):
-                        out_handle.write("%s\t%s\t%s\n" % (c.name, 0, c.size))
-    count_file = os.path.join(count_dir,
-                              "%s-%s-counts.txt" % (os.path.splitext(os.path.basename(bed_file))[0], flag))
+                    for bed_file in bed_files:
+                        for region in _read_regions(bed_file):
+                            if region not in regions:
+                                regions.add(region)
+                                out_handle.write("%s\n" % "\t".join(region))
+    count_file = os.path.join(count_dir, "%s-%s-counts.txt" % (name, flag))
     if not utils.file_exists(count_file):
         bam.index(bam_file, data["config"], check_timestamp=False)
         num_cores = dd.get_num_cores(data)
         with file_transaction(data, count_file) as tx_out_file:
-            cmd = ("hts_nim_tools count-reads -t {num_cores} -F {flag} {bed_file} {bam_file} > {tx_out_file}")
+            cmd = ("hts_nim_tools count-reads -t {num_cores} -F {flag} {count_bed} {bam_file} > {tx_out_file}")
             do.run(cmd.format(**locals()), "Count mapped reads: %s" % (dd.get_sample_name(data)))
-    count = 0
+    if len(bed_files) == 1:
+        count = 0
+        with open(count_file) as in_handle:
+            for line in in_handle:
+                count += int(line.rstrip().split()[-1])
+        return [count]
+    by_region = {}
     with open(count_file) as in_handle:
         for line in in_handle:
-            count += int(line.rstrip().split()[-1])
-
-    with _simple_lock(cache_file):
-        with open(cache_file, "a") as out_handle:
-            out_handle.write("%s\t%s\n" % (key, count))
-    return count
-
-@contextlib.contextmanager
-def _simple_lock(f):
-    """Simple file lock, times out after 20 second assuming lock is stale
-    """
-    lock_file = f + ".lock"
-    timeout = 20
-    curtime = 0
-    interval = 2
-    while os.path.exists(lock_file):
-        time.sleep(interval)
-        curtime += interval
-        if curtime > timeout:
-            os.remove(lock_file)
-    with open(lock_file, "w") as out_handle:
-        out_handle.write("locked")
-    yield
-    if os.path.exists(lock_file):
-        os.remove(lock_file)
+            parts = line.rstrip().split()
+            by_region[tuple(parts[:3])] = int(parts[-1])
+    return [sum(by_region.get(r, 0) for r in _read_regions(bed_file)) for bed_file in bed_files]
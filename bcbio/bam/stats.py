@@ -0,0 +1,574 @@
+"""Single pass read statistics for BAM files, cached in the work directory.
+
+Several QC and structural variant steps need summaries of reads in a BAM: read
+lengths, fragment and insert sizes, unique start sites by depth and UMI group
+sizes. Here one streaming pass computes every requested statistic, using integer
+encoded positions and numpy arrays. With a work directory, results go to a
+per-BAM npz file there, keyed on the BAM size and modification time, and later
+requests for the same BAM read the cached results. Passes stop early once
+bounded statistics are filled.
+
+Unique starts are counted exactly up to EXACT_STARTS mapped reads, then
+estimated with a HyperLogLog sketch, so memory stays bounded for full libraries.
+
+Alignment pipes also pass SAM output through a reservoir sampler, storing
+records sampled across the whole genome next to the BAM. Read length,
+fragment and insert size statistics come from these samples when present,
+without another pass through the BAM.
+"""
+import array
+import hashlib
+import math
+import os
+import sys
+
+import numpy as np
+import pysam
+
+from bcbio import utils
+from bcbio.log import logger
+
+# Reads used for estimates taken from the start of the file
+LENGTH_READS = 1000
+FRAGMENT_READS = 5000
+INSERT_READS = 1000000
+# Reads examined for proper pairs, so single end inputs do not need a full pass
+INSERT_SCAN_READS = 4 * INSERT_READS
+
+# Mapped reads to hold for exact unique start counts, before switching to a sketch
+EXACT_STARTS = 1 << 23
+# Relative standard error of sketched unique start counts
+STARTS_ERROR = 0.01
+# Expected reads for starts by depth bins, if not set and unavailable from the index
+DEFAULT_STARTS_SAMPLE = 10000000
+
+# Statistics needing a pass through the entire file
+FULL_PASS = set(["starts", "umi"])
+# Statistics from the first few thousand reads, added to any pass
+CHEAP = set(["lengths", "fragments"])
+ALL_SECTIONS = set(["lengths", "fragments", "inserts", "starts", "umi"])
+
+def cache_file(bam_file, work_dir):
+    """Statistics cache for a BAM file in the work directory, unique to the BAM path.
+    """
+    path_hash = hashlib.md5(os.path.abspath(bam_file).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(work_dir, "bamstats", "%s-%s.readstats.npz" %
+                        (utils.splitext_plus(os.path.basename(bam_file))[0], path_hash))
+
+def _bam_key(bam_file):
+    stat = os.stat(bam_file)
+    return np.array([stat.st_size, int(stat.st_mtime)], dtype=np.int64)
+
+def _read_cache(bam_file, work_dir):
+    """Retrieve cached statistics, or an empty dictionary if missing or outdated.
+    """
+    if not work_dir:
+        return {}
+    fname = cache_file(bam_file, work_dir)
+    if os.path.exists(fname) and os.path.getmtime(fname) >= os.path.getmtime(bam_file):
+        try:
+            with np.load(fname, allow_pickle=False) as in_handle:
+                if np.array_equal(in_handle["bam_key"], _bam_key(bam_file)):
+                    return {k: in_handle[k] for k in in_handle.files}
+        except (IOError, OSError, ValueError, KeyError) as e:
+            logger.debug("Ignoring unreadable BAM statistics cache %s: %s" % (fname, e))
+    return {}
+
+def _write_cache(bam_file, stats, work_dir):
+    """Store statistics in the work directory, skipping read only directories.
+    """
+    if not work_dir:
+        return
+    fname = cache_file(bam_file, work_dir)
+    tmp_file = "%s-%s.tmp.npz" % (os.path.splitext(fname)[0], os.getpid())
+    try:
+        utils.safe_makedir(os.path.dirname(fname))
+        np.savez(tmp_file, bam_key=_bam_key(bam_file), **stats)
+        os.rename(tmp_file, fname)
+    except (IOError, OSError) as e:
+        logger.debug("Could not cache BAM statistics in %s: %s" % (fname, e))
+
+def _sections(stats):
+    return set(str(x) for x in stats.get("sections", []))
+
+def get(bam_file, sections, starts_sample_size=None, starts_error=STARTS_ERROR, work_dir=None):
+    """Retrieve statistics for a BAM file, calculating and caching any not yet available.
+
+    sections -- statistics to retrieve: lengths, fragments, inserts, starts, umi
+    starts_sample_size -- expected reads, used to set the 100 bins of the starts curve
+    starts_error -- relative standard error for sketched unique starts, or None to
+                    always count exactly
+    work_dir -- directory for cached statistics. Without one, nothing is cached.
+    """
+    sections = set(sections)
+    assert sections <= ALL_SECTIONS, sections - ALL_SECTIONS
+    if sections <= STREAM_SECTIONS:
+        streamed = _from_stream(bam_file)
+        if streamed is not None:
+            return streamed
+    cached = _read_cache(bam_file, work_dir)
+    have = _sections(cached)
+    if "starts" in have:
+        if ((starts_sample_size and int(cached["starts_sample_size"]) != starts_sample_size) or
+                float(cached.get("starts_error", -1)) != (starts_error or 0)):
+            have.discard("starts")
+    if sections <= have:
+        return cached
+    # statistics from the start of the file are free to add to a pass, others are not
+    to_calc = sections | (CHEAP - have)
+    if "starts" in to_calc and not starts_sample_size and "starts_sample_size" in cached:
+        starts_sample_size = int(cached["starts_sample_size"])
+    stats = calculate(bam_file, to_calc, starts_sample_size, starts_error)
+    for k, v in cached.items():
+        if k not in stats and k != "bam_key":
+            section = k.split("_")[0]
+            if section in have and section not in to_calc:
+                stats[k] = v
+    stats["sections"] = np.array(sorted(to_calc | (have - to_calc)))
+    _write_cache(bam_file, stats, work_dir)
+    return stats
+
+def _mapped_reads(in_bam):
+    try:
+        return in_bam.mapped
+    except ValueError:
+        return None
+
+def calculate(bam_file, sections, starts_sample_size=None, starts_error=STARTS_ERROR):
+    """Calculate the requested statistics in one pass through a BAM file.
+    """
+    lengths = array.array("q")
+    fragments = array.array("q")
+    inserts = array.array("q")
+    umi = _UmiCounter() if "umi" in sections else None
+    need_lengths = "lengths" in sections
+    need_fragments = "fragments" in sections
+    need_inserts = "inserts" in sections
+    need_starts = "starts" in sections
+    full_pass = bool(sections & FULL_PASS)
+    with pysam.AlignmentFile(bam_file, "rb", check_sq=False) as in_bam:
+        if need_starts:
+            starts_sample_size = starts_sample_size or _mapped_reads(in_bam) or DEFAULT_STARTS_SAMPLE
+            starts = StartsCurve(starts_sample_size, starts_error)
+        for i, read in enumerate(in_bam):
+            if need_lengths:
+                if i < LENGTH_READS:
+                    lengths.append(len(read.query_sequence or ""))
+                else:
+                    need_lengths = False
+            if need_fragments:
+                if i < FRAGMENT_READS:
+                    if read.template_length > 0:
+                        fragments.append(read.template_length)
+                else:
+                    need_fragments = False
+            if need_inserts:
+                if read.is_proper_pair and read.is_read1:
+                    inserts.append(abs(read.template_length))
+                need_inserts = len(inserts) < INSERT_READS and i + 1 < INSERT_SCAN_READS
+            if need_starts and not read.is_unmapped:
+                starts.add((read.reference_id << 32) | read.reference_start)
+            if umi is not None:
+                umi.add(read)
+            if not full_pass and not (need_lengths or need_fragments or need_inserts):
+                break
+    out = {}
+    if "lengths" in sections:
+        out["lengths"] = np.frombuffer(lengths, dtype=np.int64).copy() if lengths else np.zeros(0, np.int64)
+    if "fragments" in sections:
+        out["fragments"] = np.frombuffer(fragments, dtype=np.int64).copy() if fragments else np.zeros(0, np.int64)
+    if "inserts" in sections:
+        out["inserts"] = np.frombuffer(inserts, dtype=np.int64).copy() if inserts else np.zeros(0, np.int64)
+    if "starts" in sections:
+        reads, unique = starts.finish()
+        out.update({"starts_reads": reads, "starts_unique": unique,
+                    "starts_sample_size": np.array(starts_sample_size),
+                    "starts_error": np.array(starts_error or 0.0)})
+    if umi is not None:
+        out.update(umi.summary())
+    return out
+
+def _unique_at(starts, bounds):
+    """Number of unique starts seen within the first reads of each bound.
+
+    The first occurrence of each start, from a single sort, gives the number of
+    unique starts seen before any read count.
+    """
+    if len(starts):
+        _, first = np.unique(starts, return_index=True)
+        first.sort()
+    else:
+        first = np.zeros(0, dtype=np.int64)
+    return np.searchsorted(first, np.asarray(bounds, dtype=np.int64), side="left")
+
+class StartsCurve:
+    """Number of unique start positions after each bin of mapped reads.
+
+    Bins are sample_size / 100 reads, rounded up, giving 100 points over sample_size
+    reads and a final point for all reads.
+    Starts are held as integers and counted exactly at the end, until more than
+    exact_limit reads are seen. With an error bound, counts for later bins come
+    from a HyperLogLog sketch updated once per bin, using memory for one bin of
+    starts plus the sketch registers.
+    """
+    def __init__(self, sample_size, error=STARTS_ERROR, exact_limit=EXACT_STARTS):
+        self._binstep = max(1, -(-int(sample_size) // 100))
+        self._next = self._binstep
+        self._error = error
+        self._exact_limit = exact_limit
+        self._starts = array.array("q")
+        self._sketch = None
+        self.counted = 0
+        self.reads = []
+        self.unique = []
+
+    def add(self, start):
+        self._starts.append(start)
+        self.counted += 1
+        if self.counted == self._next:
+            self._next += self._binstep
+            self.reads.append(self.counted)
+            if self._sketch is not None:
+                self._flush()
+                self.unique.append(self._sketch.count())
+            elif self._error and self.counted > self._exact_limit:
+                self._start_sketch()
+
+    def _flush(self):
+        self._sketch.add(np.frombuffer(self._starts, dtype=np.int64))
+        self._starts = array.array("q")
+
+    def _start_sketch(self):
+        self.unique = _unique_at(np.frombuffer(self._starts, dtype=np.int64), self.reads).tolist()
+        self._sketch = UniqueSketch(self._error)
+        self._flush()
+
+    def finish(self):
+        self.reads.append(self.counted)
+        if self._sketch is not None:
+            self._flush()
+            self.unique.append(self._sketch.count())
+        else:
+            self.unique = _unique_at(np.frombuffer(self._starts, dtype=np.int64), self.reads).tolist()
+        return np.array(self.reads, dtype=np.int64), np.array(self.unique, dtype=np.int64)
+
+def _hash64(values):
+    """splitmix64 finalizer, spreading integer encoded positions over 64 bits.
+    """
+    with np.errstate(over="ignore"):
+        x = values.astype(np.uint64)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return x ^ (x >> np.uint64(31))
+
+def _bit_length(values):
+    """Bit length of unsigned 64-bit integers, exact by splitting into 32-bit halves.
+    """
+    hi = (values >> np.uint64(32)).astype(np.float64)
+    lo = (values & np.uint64(0xffffffff)).astype(np.float64)
+    return np.where(hi > 0, np.frexp(hi)[1] + 32, np.frexp(lo)[1])
+
+class UniqueSketch:
+    """HyperLogLog estimate of the number of distinct 64-bit integers.
+
+    Uses enough registers for a relative standard error of 1.04 / sqrt(registers)
+    below the requested error.
+    """
+    def __init__(self, error=STARTS_ERROR):
+        self.p = min(18, max(4, int(math.ceil(math.log((1.04 / error) ** 2, 2)))))
+        self.registers = np.zeros(1 << self.p, dtype=np.uint8)
+
+    def add(self, values):
+        if len(values) == 0:
+            return
+        h = _hash64(values)
+        idx = (h >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = h & np.uint64((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - _bit_length(rest) + 1
+        np.maximum.at(self.registers, idx, rank.astype(np.uint8))
+
+    def count(self):
+        m = float(len(self.registers))
+        alpha = 0.7213 / (1.0 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+def get_umi_tag(rec):
+    """Handle UMI and duplex tag retrieval.
+    """
+    for tag in ["RX", "XC"]:
+        try:
+            return rec.get_tag(tag)
+        except KeyError:
+            pass
+
+class _UmiCounter:
+    """Count reads per UMI at each start position of a coordinate sorted BAM.
+    """
+    def __init__(self):
+        self.total = 0
+        self.mapped = 0
+        self.duplicates = 0
+        self.reductions = array.array("d")
+        self.umi_counts = {}
+        self._cur_key = None
+        self._cur_counts = {}
+
+    def add(self, rec):
+        self.total += 1
+        umi = get_umi_tag(rec)
+        if umi and not rec.is_unmapped:
+            self.mapped += 1
+            if rec.is_duplicate:
+                self.duplicates += 1
+            key = (rec.reference_id << 32) | rec.reference_start
+            if key != self._cur_key:
+                self._finish_position()
+                self._cur_key = key
+            self._cur_counts[umi] = self._cur_counts.get(umi, 0) + 1
+
+    def _finish_position(self):
+        if self._cur_counts:
+            for c in self._cur_counts.values():
+                self.umi_counts[c] = self.umi_counts.get(c, 0) + 1
+            self.reductions.append(float(sum(self._cur_counts.values())) / len(self._cur_counts))
+            self._cur_counts = {}
+
+    def summary(self):
+        self._finish_position()
+        reductions = np.frombuffer(self.reductions, dtype=np.float64) if self.reductions else np.zeros(1)
+        sizes = sorted(self.umi_counts.keys())
+        return {"umi_totals": np.array([self.total, self.mapped, self.duplicates], dtype=np.int64),
+                "umi_reduction": np.array([np.median(reductions), np.max(reductions)]),
+                "umi_count_sizes": np.array(sizes, dtype=np.int64),
+                "umi_count_positions": np.array([self.umi_counts[x] for x in sizes], dtype=np.int64)}
+
+# ## Sampling during alignment
+
+# Aligned records held in the reservoir of reads sampled while aligning
+STREAM_READS = 2 * INSERT_READS
+STREAM_SEED = 42
+STREAM_SECTIONS = set(["lengths", "fragments", "inserts"])
+_BLOCK_SIZE = 1 << 20
+
+def stream_file(bam_file):
+    return "%s.alignstats.npz" % os.path.splitext(bam_file)[0]
+
+def stream_cl(bam_file):
+    """Command line passing SAM records through unchanged, sampling them for a BAM output.
+
+    Placed in alignment pipes before sorting and de-duplication, storing
+    read lengths and insert sizes sampled across the genome next to the BAM.
+    Samples are only used once bound to the finished BAM with bind_stream.
+    """
+    return ("%s -c 'from bcbio.bam import stats; stats.sample_stream(\"%s\")'" %
+            (sys.executable, stream_file(bam_file)))
+
+def reset_stream(bam_file):
+    """Remove samples from previous alignments, before creating a new BAM.
+    """
+    if os.path.exists(stream_file(bam_file)):
+        os.remove(stream_file(bam_file))
+
+class StreamSampler:
+    """Reproducible reservoir sample of SAM records, keeping flags, lengths and template lengths.
+
+    Uses Algorithm L (Li, 1994), which skips directly between sampled records
+    once the reservoir is full, so most records are never parsed.
+    """
+    def __init__(self, size=STREAM_READS, seed=STREAM_SEED):
+        self.size = size
+        self.n = 0
+        self.flags = array.array("l")
+        self.lengths = array.array("l")
+        self.tlens = array.array("l")
+        self._rs = np.random.RandomState(seed)
+        self._w = math.exp(math.log(self._random()) / size)
+        self._next = size + self._skip()
+
+    def _random(self):
+        return 1.0 - self._rs.random_sample()
+
+    def _skip(self):
+        return int(math.floor(math.log(self._random()) / math.log(1.0 - self._w))) if self._w < 1.0 else 0
+
+    def _parse(self, line):
+        parts = line.split(b"\t", 10)
+        seq = parts[9]
+        return int(parts[1]), (len(seq) if seq != b"*" else 0), int(parts[8])
+
+    def add_lines(self, lines):
+        """Add SAM lines, skipping headers.
+        """
+        i = 0
+        while self.n < self.size and i < len(lines):
+            line = lines[i]
+            i += 1
+            if line and not line.startswith(b"@"):
+                flag, length, tlen = self._parse(line)
+                self.flags.append(flag)
+                self.lengths.append(length)
+                self.tlens.append(tlen)
+                self.n += 1
+        # reservoir is full: jump between sampled records
+        start = self.n - i
+        end = start + len(lines)
+        while self._next < end:
+            line = lines[self._next - start]
+            if line and not line.startswith(b"@"):
+                j = self._rs.randint(self.size)
+                self.flags[j], self.lengths[j], self.tlens[j] = self._parse(line)
+            self._w *= math.exp(math.log(self._random()) / self.size)
+            self._next += self._skip() + 1
+        self.n = max(self.n, end)
+
+    def add_block(self, data):
+        """Add complete SAM lines in a block of data, returning any trailing partial line.
+
+        Blocks without sampled records only need counting once the reservoir is full.
+        """
+        end = data.rfind(b"\n") + 1
+        if self.n >= self.size:
+            nlines = data.count(b"\n", 0, end)
+            if self._next >= self.n + nlines:
+                self.n += nlines
+                return data[end:]
+        self.add_lines(data[:end].split(b"\n")[:-1])
+        return data[end:]
+
+    def finish(self):
+        order = self._rs.permutation(len(self.flags))
+        return {"stream_n": np.array([self.n], dtype=np.int64),
+                "stream_flags": np.array(self.flags, dtype=np.int32)[order],
+                "stream_lengths": np.array(self.lengths, dtype=np.int32)[order],
+                "stream_tlens": np.array(self.tlens, dtype=np.int64)[order]}
+
+def _write_stream(out_file, sample):
+    tmp_file = "%s-%s.tmp.npz" % (os.path.splitext(out_file)[0], os.getpid())
+    np.savez(tmp_file, **sample)
+    os.rename(tmp_file, out_file)
+
+def sample_stream(out_file, in_handle=None, out_handle=None, size=STREAM_READS):
+    """Pass SAM from input to output unchanged, writing a sample of records to out_file.
+    """
+    in_handle = in_handle or sys.stdin.buffer
+    out_handle = out_handle or sys.stdout.buffer
+    sampler = StreamSampler(size)
+    rest = b""
+    while True:
+        block = in_handle.read(_BLOCK_SIZE)
+        if not block:
+            break
+        out_handle.write(block)
+        rest = sampler.add_block(rest + block)
+    if rest:
+        sampler.add_lines([rest])
+    out_handle.flush()
+    _write_stream(out_file, sampler.finish())
+
+def merge_streams(in_bams, out_bam, size=STREAM_READS, seed=STREAM_SEED):
+    """Combine samples from alignments of parts of a sample, weighted by their records.
+
+    Only writes samples for out_bam when all inputs have them.
+    """
+    reset_stream(out_bam)
+    samples = [_load_bound_stream(x) for x in in_bams]
+    if not samples or any(x is None for x in samples):
+        return None
+    totals = np.array([int(x["stream_n"][0]) for x in samples], dtype=np.float64)
+    held = np.array([len(x["stream_flags"]) for x in samples])
+    rs = np.random.RandomState(seed)
+    counts = rs.multinomial(min(size, int(held.sum())), totals / totals.sum()) if totals.sum() else held
+    counts = np.minimum(counts, held)
+    out = {"stream_n": np.array([int(totals.sum())], dtype=np.int64)}
+    for key in ["stream_flags", "stream_lengths", "stream_tlens"]:
+        out[key] = np.concatenate([x[key][:c] for x, c in zip(samples, counts)])
+    _write_stream(stream_file(out_bam), out)
+    return stream_file(out_bam)
+
+def _load_stream(fname):
+    if not os.path.exists(fname):
+        return None
+    try:
+        with np.load(fname, allow_pickle=False) as in_handle:
+            sample = {k: in_handle[k] for k in in_handle.files}
+    except (IOError, OSError, ValueError) as e:
+        logger.debug("Ignoring unreadable alignment samples %s: %s" % (fname, e))
+        return None
+    if not all(k in sample for k in ["stream_n", "stream_flags", "stream_lengths", "stream_tlens"]):
+        return None
+    return sample
+
+def bind_stream(bam_file):
+    """Tie records sampled while aligning to the finished BAM, by its size and modification time.
+
+    The alignment pipe writes samples before the BAM moves into place, so
+    these are bound once the BAM is final. Returns False if there is no sample
+    or it belongs to a different version of the BAM, like after realignment.
+    """
+    fname = stream_file(bam_file)
+    sample = _load_stream(fname)
+    if sample is None or not os.path.exists(bam_file):
+        return False
+    if "bam_key" in sample:
+        return bool(np.array_equal(sample["bam_key"], _bam_key(bam_file)))
+    sample["bam_key"] = _bam_key(bam_file)
+    _write_stream(fname, sample)
+    return True
+
+def _load_bound_stream(bam_file):
+    """Retrieve samples for a BAM, or None if missing or not bound to the current BAM.
+    """
+    sample = _load_stream(stream_file(bam_file))
+    if (sample is None or "bam_key" not in sample or not os.path.exists(bam_file)
+            or not np.array_equal(sample["bam_key"], _bam_key(bam_file))):
+        return None
+    return sample
+
+def _from_stream(bam_file):
+    """Retrieve statistics from records sampled while aligning a BAM, or None if unavailable.
+    """
+    sample = _load_bound_stream(bam_file)
+    if sample is None:
+        return None
+    flags, lengths, tlens = [sample[k] for k in ["stream_flags", "stream_lengths", "stream_tlens"]]
+    primary = (flags & 0x900) == 0
+    proper_read1 = primary & ((flags & 0x42) == 0x42)
+    return {"lengths": lengths[primary & (lengths > 0)].astype(np.int64),
+            "fragments": tlens[primary & (tlens > 0)],
+            "inserts": np.abs(tlens[proper_read1])[:INSERT_READS],
+            "sections": np.array(sorted(STREAM_SECTIONS))}
+
+def insert_stats(dists):
+    """Calcualtes mean/median and MAD from distances, avoiding outliers.
+
+    MAD is the Median Absolute Deviation: http://en.wikipedia.org/wiki/Median_absolute_deviation
+    """
+    dists = np.asarray(dists)
+    med = np.median(dists)
+    filter_dists = dists[dists < med + 10 * med]
+    median = np.median(filter_dists)
+    return {"mean": float(np.mean(filter_dists)), "std": float(np.std(filter_dists)),
+            "median": float(median),
+            "mad": float(np.median(np.abs(filter_dists - median)))}
+
+def stream_summary(bam_file):
+    """Summarize read lengths and insert sizes sampled during alignment, for the sample record.
+
+    Called once the BAM is final, binding new samples to it.
+    """
+    bind_stream(bam_file)
+    stats = _from_stream(bam_file)
+    if stats is None:
+        return None
+    out = {}
+    if len(stats["lengths"]):
+        out["read_length"] = int(np.median(stats["lengths"]))
+    if len(stats["fragments"]):
+        out["fragment_size"] = int(np.median(stats["fragments"]))
+    if len(stats["inserts"]):
+        out["insert_size"] = insert_stats(stats["inserts"])
+    return out
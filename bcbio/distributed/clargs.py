@@ -14,7 +14,10 @@ def to_parallel(args, module="bcbio.distributed"):
                 "resources": args.resources, "timeout": args.timeout,
                 "retries": args.retries,
                 "run_local": args.queue == "localrun",
-                "local_controller": local_controller}
+                "local_controller": local_controller,
+                "pipelined": getattr(args, "pipelined", False),
+                "task_cache": getattr(args, "task_cache", False),
+                "measured_memory": getattr(args, "measured_memory", False)}
     return parallel
 
 def _get_cores_and_type(numcores, paralleltype, scheduler):
@@ -0,0 +1,215 @@
+"""Run pipeline steps as a dependency graph, overlapping stages across samples.
+
+Standard pipelines run each step over every sample before starting the next
+step, so the slowest sample idles the remaining workers at every barrier. Here
+each step for a sample is a task with explicit dependencies, and starts as soon
+as the tasks it depends on finish.
+"""
+import collections
+import random
+import time
+
+from concurrent import futures
+
+from bcbio.log import logger
+from bcbio.pipeline import datadict as dd
+from bcbio.provenance import telemetry
+
+class Task:
+    """A unit of work in the graph.
+
+    name -- Unique identifier for the task.
+    fn -- Function to run, called with the results of each dependency in order.
+    deps -- Names of tasks that must finish before this one starts.
+    cost -- Relative expected run time, used to prioritize the critical path.
+    """
+    def __init__(self, name, fn, deps=None, cost=1.0):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps or [])
+        self.cost = float(cost)
+
+    def __repr__(self):
+        return "Task(%s)" % self.name
+
+def _toposort(tasks):
+    """Order tasks so dependencies always come before the tasks that use them.
+    """
+    by_name = collections.OrderedDict((t.name, t) for t in tasks)
+    if len(by_name) != len(tasks):
+        raise ValueError("Duplicate task names in dependency graph")
+    for t in tasks:
+        for d in t.deps:
+            if d not in by_name:
+                raise ValueError("Task %s depends on unknown task %s" % (t.name, d))
+    indegree = {name: len(t.deps) for name, t in by_name.items()}
+    children = collections.defaultdict(list)
+    for t in tasks:
+        for d in t.deps:
+            children[d].append(t.name)
+    ready = collections.deque(name for name, n in indegree.items() if n == 0)
+    out = []
+    while ready:
+        name = ready.popleft()
+        out.append(by_name[name])
+        for c in children[name]:
+            indegree[c] -= 1
+            if indegree[c] == 0:
+                ready.append(c)
+    if len(out) != len(tasks):
+        raise ValueError("Cycle in dependency graph: %s" %
+                         sorted(n for n, d in indegree.items() if d > 0))
+    return out, children
+
+def _critical_path(ordered, children):
+    """Longest remaining cost from each task to the end of the graph.
+    """
+    rank = {}
+    for t in reversed(ordered):
+        rank[t.name] = t.cost + max([rank[c] for c in children[t.name]] or [0.0])
+    return rank
+
+def run(tasks, num_workers):
+    """Run a set of Tasks with at most num_workers running at once.
+
+    When more tasks are ready than free workers, starts the tasks with the
+    longest remaining path through the graph first. Returns a dictionary of
+    task names to results. On failure, waits for running tasks to finish
+    and re-raises the first error without starting new tasks.
+    """
+    ordered, children = _toposort(tasks)
+    rank = _critical_path(ordered, children)
+    waiting = {t.name: set(t.deps) for t in ordered}
+    by_name = {t.name: t for t in ordered}
+    results = {}
+    running = {}
+    error = None
+    with futures.ThreadPoolExecutor(max(1, int(num_workers))) as executor:
+        while waiting or running:
+            if error is None:
+                ready = sorted((n for n, deps in waiting.items() if not deps),
+                               key=lambda n: rank[n], reverse=True)
+                for name in ready[:max(0, num_workers - len(running))]:
+                    t = by_name[name]
+                    del waiting[name]
+                    running[executor.submit(telemetry.propagate(t.fn), *[results[d] for d in t.deps])] = name
+            if not running:
+                break
+            done, _ = futures.wait(list(running.keys()), return_when=futures.FIRST_COMPLETED)
+            for f in done:
+                name = running.pop(f)
+                if f.exception() is not None:
+                    if error is None:
+                        logger.info("Stopping dependency graph run after failure in %s" % name)
+                        error = f.exception()
+                    continue
+                results[name] = f.result()
+                for c in children[name]:
+                    if c in waiting:
+                        waiting[c].discard(name)
+    if error is not None:
+        raise error
+    return results
+
+# ## Per-sample pipelines
+
+def sample_tasks(samples, steps, cost_fn=None):
+    """Build chains of tasks running a list of steps over each sample independently.
+
+    samples -- Standard list of [data] items, grouped by sample name so split
+               inputs for a sample travel together.
+    steps -- List of (step_name, fn) where fn takes and returns a list of [data] items.
+    cost_fn -- Optional function estimating relative run time for a sample's items.
+
+    Returns the tasks and the name of the final task for every sample.
+    """
+    by_sample = collections.OrderedDict()
+    for xs in samples:
+        by_sample.setdefault(dd.get_sample_name(xs[0]), []).append(xs)
+    tasks = []
+    finals = []
+    for sample_name, items in by_sample.items():
+        cost = cost_fn(items) if cost_fn else float(len(items))
+        prev = None
+        for step_name, fn in steps:
+            name = "%s:%s" % (sample_name, step_name)
+            if prev is None:
+                tasks.append(Task(name, _bind_items(fn, items), cost=cost))
+            else:
+                tasks.append(Task(name, fn, [prev], cost=cost))
+            prev = name
+        finals.append(prev)
+    return tasks, finals
+
+def _bind_items(fn, items):
+    def run_first():
+        return fn(items)
+    return run_first
+
+def run_samples(samples, steps, num_workers, cost_fn=None):
+    """Run steps over each sample independently, returning the combined items.
+
+    Samples move through steps at their own pace, so fast samples start later
+    steps while slow ones are still processing earlier ones.
+    """
+    tasks, finals = sample_tasks(samples, steps, cost_fn)
+    logger.info("Running %s steps over %s samples as a dependency graph" % (len(steps), len(finals)))
+    results = run(tasks, num_workers)
+    out = []
+    for name in finals:
+        out.extend(results[name])
+    return out
+
+def num_workers(run_parallel):
+    """Number of concurrent tasks to run, or None if graph running is not supported.
+
+    Requires a requested pipelined run on local multiple cores, where step calls
+    from multiple threads share a single pool of worker processes.
+    """
+    parallel = getattr(run_parallel, "parallel", {})
+    if (parallel.get("pipelined") and parallel.get("type") == "local"
+          and parallel.get("num_jobs", 1) > 1):
+        return parallel["num_jobs"]
+
+# ## Benchmarking
+
+def _sleep_for(duration):
+    def run_step(*args):
+        time.sleep(duration)
+        return duration
+    return run_step
+
+def _skewed_durations(num_samples, num_steps, seed):
+    rand = random.Random(seed)
+    sizes = [rand.lognormvariate(0.0, 0.8) for _ in range(num_samples)]
+    return [[size * rand.uniform(0.5, 1.5) for _ in range(num_steps)] for size in sizes]
+
+def benchmark(num_samples=40, num_steps=3, num_workers=8, scale=0.02, seed=42):
+    """Compare makespan of barrier and dependency graph runs on synthetic tasks.
+
+    Sample sizes follow a log-normal distribution, so a few large samples
+    dominate each step. Durations are in units of scale seconds.
+    """
+    durations = _skewed_durations(num_samples, num_steps, seed)
+    start = time.time()
+    for step in range(num_steps):
+        with futures.ThreadPoolExecutor(num_workers) as executor:
+            list(executor.map(lambda d: _sleep_for(d[step] * scale)(), durations))
+    barrier_time = time.time() - start
+    tasks = []
+    for i, sample_durations in enumerate(durations):
+        for step, duration in enumerate(sample_durations):
+            deps = ["%s:%s" % (i, step - 1)] if step > 0 else []
+            tasks.append(Task("%s:%s" % (i, step), _sleep_for(duration * scale), deps,
+                              cost=duration))
+    start = time.time()
+    run(tasks, num_workers)
+    dag_time = time.time() - start
+    return {"barrier": barrier_time, "dag": dag_time,
+            "reduction": 1.0 - dag_time / barrier_time}
+
+if __name__ == "__main__":
+    out = benchmark()
+    print("Barrier makespan: %.2fs" % out["barrier"])
+    print("Dependency graph makespan: %.2fs" % out["dag"])
+    print("Reduction: %.1f%%" % (out["reduction"] * 100.0))
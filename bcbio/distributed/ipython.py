@@ -9,22 +9,21 @@ Cluster implementation from ipython-cluster-helper:
 https://github.com/roryk/ipython-cluster-helper
 """
 import collections
+import hashlib
 import math
 import os
+import pickle
+import shutil
 import time
 
 try:
-    import ipyparallel
-    # msgpack not working with IPython 4.0 ipyparallel
-    msgpack = None
+    import zstandard
 except ImportError:
-    try:
-        import msgpack
-    except ImportError:
-        msgpack = None
+    zstandard = None
 
 from bcbio import utils, setpath
 from bcbio.log import logger, get_log_dir
+from bcbio.distributed import taskcache
 from bcbio.pipeline import config_utils
 from bcbio.provenance import diagnostics
 
@@ -100,21 +99,149 @@ def _get_ipython_fn(fn_name, parallel):
                               fromlist=["ipythontasks"]),
                    import_fn_name)
 
-def zip_args(args, config=None):
-    """Compress arguments using msgpack.
+# Sub-dictionaries of sample data shared by many tasks, sent once and referenced by hash
+SHARED_ARG_PATHS = [("config", "algorithm"), ("config", "resources"), ("reference",),
+                    ("genome_resources",)]
+# Minimum size of packed task arguments to compress
+COMPRESS_MIN_BYTES = 4096
+
+_ARGS_MAGIC = b"bcbio-args1"
+_SHARED_REF = "__bcbio_shared_arg__"
+# Shared argument values already read by this engine, by hash
+_shared_cache = {}
+_SHARED_CACHE_MAX = 256
+
+class ArgStore:
+    """Shared argument values for a run, written once by hash to the shared filesystem.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self._written = set()
+
+    def put(self, value, memo):
+        """Store a shared value, returning a reference to it.
+
+        memo avoids re-serializing the same object within a set of tasks, and
+        keeps the object alive so its id is not reused.
+        """
+        if id(value) not in memo:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            digest = hashlib.sha1(blob).hexdigest()
+            if digest not in self._written:
+                out_file = os.path.join(self.store_dir, "%s.pkl" % digest)
+                if not os.path.exists(out_file):
+                    utils.safe_makedir(self.store_dir)
+                    tmp_file = "%s.%s.tmp" % (out_file, os.getpid())
+                    with open(tmp_file, "wb") as out_handle:
+                        out_handle.write(blob)
+                    os.rename(tmp_file, out_file)
+                self._written.add(digest)
+            memo[id(value)] = (digest, value)
+        return {_SHARED_REF: memo[id(value)][0]}
+
+def _load_shared(store_dir, digest):
+    """Retrieve a shared value, reading from the store once per engine.
+
+    Returns a fresh copy for every task, so tasks can modify their arguments.
+    """
+    if digest not in _shared_cache:
+        if len(_shared_cache) >= _SHARED_CACHE_MAX:
+            _shared_cache.clear()
+        with open(os.path.join(store_dir, "%s.pkl" % digest), "rb") as in_handle:
+            _shared_cache[digest] = in_handle.read()
+    return pickle.loads(_shared_cache[digest])
+
+def _replace_path(d, path, fn):
+    """Copy of d with the dictionary at path replaced by fn(value), leaving d unchanged.
+    """
+    key = path[0]
+    if not isinstance(d.get(key), dict):
+        return d
+    new = dict(d)
+    new[key] = fn(d[key]) if len(path) == 1 else _replace_path(d[key], path[1:], fn)
+    return new
+
+def _map_data(args, fn):
+    """Apply fn to sample data dictionaries in task arguments, including lists of samples.
+    """
+    out = []
+    for arg in args:
+        if config_utils.is_nested_config_arg(arg):
+            arg = fn(arg)
+        elif isinstance(arg, (list, tuple)) and len(arg) > 0 and config_utils.is_nested_config_arg(arg[0]):
+            arg = type(arg)(fn(x) if config_utils.is_nested_config_arg(x) else x for x in arg)
+        out.append(arg)
+    return out
+
+def _share_data(data, store, memo):
+    for path in SHARED_ARG_PATHS:
+        data = _replace_path(data, path, lambda x: store.put(x, memo) if x and _SHARED_REF not in x else x)
+    return data
+
+def _unshare_data(data, store_dir):
+    """Restore shared values, including per-task keys added next to the reference.
     """
-    if msgpack:
-        return [msgpack.packb(x, use_single_float=True, use_bin_type=True) for x in args]
-    else:
+    def load(x):
+        if _SHARED_REF not in x:
+            return x
+        value = _load_shared(store_dir, x[_SHARED_REF])
+        value.update((k, v) for k, v in x.items() if k != _SHARED_REF)
+        return value
+    for path in SHARED_ARG_PATHS:
+        data = _replace_path(data, path, load)
+    return data
+
+def share_args(args, store, memo=None):
+    """Replace shared sub-dictionaries of sample data in task arguments with references.
+
+    Running this before adding per-task configuration, like the number of
+    cores, stores each shared dictionary once. Keys added to a reference
+    afterwards are restored on top of the shared value.
+    """
+    memo = {} if memo is None else memo
+    return [_map_data(x, lambda d: _share_data(d, store, memo)) for x in args]
+
+def zip_args(args, store=None):
+    """Pack arguments for a set of tasks into compact messages for engines.
+
+    Shared sub-dictionaries of sample data go to the store once and travel as
+    references to their hash, so only per-sample values are serialized per task.
+    Large messages are compressed when zstandard is available. Without a store,
+    arguments pass through unchanged.
+    """
+    if store is None:
         return args
+    out = []
+    for x in share_args(args, store):
+        blob = pickle.dumps((store.store_dir, x), protocol=pickle.HIGHEST_PROTOCOL)
+        if zstandard and len(blob) >= COMPRESS_MIN_BYTES:
+            out.append(_ARGS_MAGIC + b"z" + zstandard.ZstdCompressor().compress(blob))
+        else:
+            out.append(_ARGS_MAGIC + b"p" + blob)
+    return out
+
+def _unzip_arg(x):
+    if not isinstance(x, bytes) or not x.startswith(_ARGS_MAGIC):
+        return x
+    start = len(_ARGS_MAGIC) + 1
+    blob = x[start:]
+    if x[start - 1:start] == b"z":
+        blob = zstandard.ZstdDecompressor().decompress(blob)
+    store_dir, args = pickle.loads(blob)
+    return _map_data(args, lambda d: _unshare_data(d, store_dir))
 
 def unzip_args(args):
-    """Uncompress arguments using msgpack.
+    """Unpack arguments packed with zip_args, passing through other values.
     """
-    if msgpack:
-        return [msgpack.unpackb(x) for x in args]
-    else:
-        return args
+    return [_unzip_arg(x) for x in args]
+
+def get_store_dir(dirs, config):
+    return os.path.join(dirs["work"], get_log_dir(config), "ipython", "args")
+
+def cleanup(dirs, config):
+    """Remove shared arguments stored for engines once a cluster finishes.
+    """
+    shutil.rmtree(get_store_dir(dirs, config), ignore_errors=True)
 
 def runner(view, parallel, dirs, config):
     """Run a task on an ipython parallel cluster, allowing alternative queue types.
@@ -128,14 +255,22 @@ def runner(view, parallel, dirs, config):
         items = [x for x in items if x is not None]
         items = diagnostics.track_parallel(items, fn_name)
         logger.info("ipython: %s" % fn_name)
-        if len(items) > 0:
+        # external task modules and wrappers unpack their own arguments
+        store = (ArgStore(get_store_dir(dirs, config))
+                 if parallel["module"] == "bcbio.distributed" and "wrapper" not in parallel else None)
+        def run_items(items):
+            # Share before adding cores, which copies the configuration of every item
+            if store is not None:
+                items = share_args(items, store)
             items = [config_utils.add_cores_to_config(x, parallel["cores_per_job"], parallel) for x in items]
             if "wrapper" in parallel:
                 wrap_parallel = {k: v for k, v in parallel.items() if k in set(["fresources"])}
                 items = [[fn_name] + parallel.get("wrapper_args", []) + [wrap_parallel] + list(x) for x in items]
-            items = zip_args([args for args in items])
-            for data in view.map_sync(fn, items, track=False):
+            items = zip_args(items, store)
+            return [unzip_args(data) if data else data for data in view.map_sync(fn, items, track=False)]
+        if len(items) > 0:
+            for data in taskcache.run(parallel.get("task_cache_dir"), fn_name, items, run_items):
                 if data:
-                    out.extend(unzip_args(data))
+                    out.extend(data)
         return out
     return run
@@ -1,6 +1,7 @@
 """Ipython parallel ready entry points for parallel execution
 """
 import contextlib
+import functools
 import os
 
 try:
@@ -20,7 +21,7 @@ from bcbio.chipseq import peaks
 from bcbio.wgbsseq import cpg_caller, deduplication, trimming
 from bcbio.pipeline import (archive, config_utils, disambiguate, sample,
                             qcsummary, shared, variation, run_info, rnaseq)
-from bcbio.provenance import system
+from bcbio.provenance import system, telemetry
 from bcbio.qc import multiqc, qsignature
 from bcbio.structural import regions
 from bcbio.variation import (bamprep, genotype, ensemble, joint,
@@ -74,12 +75,22 @@ def apply(object, args=None, kwargs=None):
     """Python3 apply replacement for double unpacking of inputs during apply.
 
     Thanks to: https://github.com/stefanholek/apply
+
+    Records resource usage of the task for later summarization.
     """
     if args is None:
         args = ()
     if kwargs is None:
         kwargs = {}
-    return object(*args, **kwargs)
+    fn = functools.partial(object, **kwargs) if kwargs else object
+    block = None
+    for arg in args:
+        if isinstance(arg, (list, tuple)) and len(arg) > 0:
+            arg = arg[0]
+        if config_utils.is_nested_config_arg(arg):
+            block = arg["config"].get("parallel", {}).get("block")
+            break
+    return telemetry.timed_task(fn, getattr(object, "__name__", str(object)), block, *args)
 
 require(sample)
 def prepare_sample(*args):
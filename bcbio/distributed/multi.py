@@ -1,19 +1,25 @@
 """Run tasks in parallel on a single machine using multiple cores.
 """
 import functools
+import multiprocessing
+import threading
 
 try:
     import joblib
 except ImportError:
     joblib = False
 
-from bcbio.distributed import resources
+from bcbio import utils
+from bcbio.distributed import resources, taskcache
 from bcbio.log import logger, setup_local_logging
 from bcbio.pipeline import config_utils
-from bcbio.provenance import diagnostics, system
+from bcbio.provenance import diagnostics, system, telemetry
 
-def runner(parallel, config):
+def runner(parallel, config, pool=None):
     """Run functions, provided by string name, on multiple cores on the current machine.
+
+    pool -- An optional WorkerPool, shared across calls, to avoid re-spawning
+    worker processes for every function run.
     """
     def run_parallel(fn_name, items):
         items = [x for x in items if x is not None]
@@ -22,10 +28,17 @@ def runner(parallel, config):
         items = diagnostics.track_parallel(items, fn_name)
         fn, fn_name = (fn_name, fn_name.__name__) if callable(fn_name) else (get_fn(fn_name, parallel), fn_name)
         logger.info("multiprocessing: %s" % fn_name)
-        if "wrapper" in parallel:
-            wrap_parallel = {k: v for k, v in parallel.items() if k in set(["fresources", "checkpointed"])}
-            items = [[fn_name] + parallel.get("wrapper_args", []) + [wrap_parallel] + list(x) for x in items]
-        return run_multicore(fn, items, config, parallel=parallel)
+        def run_items(items):
+            if "wrapper" in parallel:
+                wrap_parallel = {k: v for k, v in parallel.items() if k in set(["fresources", "checkpointed"])}
+                items = [[fn_name] + parallel.get("wrapper_args", []) + [wrap_parallel] + list(x) for x in items]
+            return _run_multicore_items(fn, items, config, parallel, pool)
+        out = []
+        for data in taskcache.run(parallel.get("task_cache_dir"), fn_name, items, run_items):
+            if data:
+                out.extend(data)
+        return out
+    run_parallel.parallel = parallel
     return run_parallel
 
 def get_fn(fn_name, parallel):
@@ -67,8 +80,78 @@ def zeromq_aware_logging(f):
         return out
     return wrapper
 
-def run_multicore(fn, items, config, parallel=None):
+def _warm_worker():
+    """Pre-import parallel entry points so pooled workers start ready to run.
+    """
+    get_fn("run_main", {})
+
+def _apply_args(fn_args):
+    fn, args = fn_args
+    return fn(*args)
+
+class WorkerPool:
+    """Long-lived set of local worker processes reused across run_parallel calls.
+
+    Workers import bcbio entry points once at startup. The pool is re-created
+    when the number of requested jobs changes between calls. Safe to share
+    between threads submitting work at the same time.
+    """
+    def __init__(self):
+        self._pool = None
+        self._lock = threading.Lock()
+        self.num_jobs = None
+
+    def _resize(self, num_jobs):
+        if self._pool is not None and self.num_jobs == num_jobs:
+            return
+        self.close()
+        logger.debug("Starting pool of %s local worker processes" % num_jobs)
+        self._pool = multiprocessing.Pool(num_jobs, initializer=_warm_worker)
+        self.num_jobs = num_jobs
+
+    def map(self, fn, items, num_jobs):
+        """Run fn over argument lists in items, returning results in input order.
+        """
+        with self._lock:
+            self._resize(num_jobs)
+            return self._pool.imap(_apply_args, [(fn, x) for x in items], chunksize=1)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            self.num_jobs = None
+
+    def terminate(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self.num_jobs = None
+
+def run_multicore(fn, items, config, parallel=None, pool=None):
     """Run the function using multiple cores on the given items to process.
+
+    Uses the provided WorkerPool when available, otherwise runs with a
+    temporary joblib pool.
+    """
+    out = []
+    for data in _run_multicore_items(fn, items, config, parallel, pool):
+        if data:
+            out.extend(data)
+    return out
+
+def _own_args(args):
+    """Copy sample data for a task run in this process.
+
+    Split tasks share nested values of sample data (utils.shared_copy), which
+    other processes receive as independent pickled copies.
+    """
+    return [utils.deepish_copy(x) if config_utils.is_nested_config_arg(x) else x for x in args]
+
+def _run_multicore_items(fn, items, config, parallel=None, pool=None):
+    """Run the function on multiple cores, returning the output of each item in order.
     """
     if len(items) == 0:
         return []
@@ -80,10 +163,13 @@ def run_multicore(fn, items, config, parallel=None):
                                        parallel.get("multiplier", 1),
                                        max_multicore=int(parallel.get("max_multicore", sysinfo["cores"])))
     items = [config_utils.add_cores_to_config(x, parallel["cores_per_job"]) for x in items]
-    if joblib is None:
-        raise ImportError("Need joblib for multiprocessing parallelization")
-    out = []
-    for data in joblib.Parallel(parallel["num_jobs"], batch_size=1, backend="multiprocessing")(joblib.delayed(fn)(*x) for x in items):
-        if data:
-            out.extend(data)
-    return out
+    fn = functools.partial(telemetry.timed_task, fn, getattr(fn, "__name__", str(fn)), parallel.get("block"))
+    if parallel["num_jobs"] == 1:
+        items = (_own_args(x) for x in items)
+    if pool is not None and parallel["num_jobs"] > 1:
+        return list(pool.map(fn, items, parallel["num_jobs"]))
+    else:
+        if not joblib:
+            raise ImportError("Need joblib for multiprocessing parallelization")
+        return joblib.Parallel(parallel["num_jobs"], batch_size=1,
+                               backend="multiprocessing")(joblib.delayed(fn)(*x) for x in items)
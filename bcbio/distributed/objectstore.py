@@ -23,6 +23,9 @@ SUPPORTED_REMOTES = ("s3://",)
 BIODATA_INFO = {"s3": "s3://biodata/prepped/{build}/{build}-{target}.tar.gz"}
 REGIONS_NEWPERMS = {"s3": ["eu-central-1"]}
 
+# Background stager for remote inputs, set by staging.prefetch
+_stager = None
+
 @six.add_metaclass(abc.ABCMeta)
 class FileHandle(object):
 
@@ -669,8 +672,26 @@ def connect(filename):
     return manager.connect(filename)
 
 
+def set_stager(stager):
+    """Set the background stager for remote inputs, returning the previous one.
+    """
+    global _stager
+    prev, _stager = _stager, stager
+    return prev
+
+
 def download(fname, input_dir, dl_dir=None):
-    """Download the resource from the storage."""
+    """Download the resource from the storage.
+
+    Waits for the transfer of files already being staged in the background.
+    """
+    if _stager is not None and not dl_dir and _stager.has(fname, input_dir):
+        return _stager.result(fname)
+    return download_direct(fname, input_dir, dl_dir)
+
+
+def download_direct(fname, input_dir, dl_dir=None):
+    """Download the resource from the storage, ignoring background staging."""
     try:
         manager = _get_storage_manager(fname)
     except ValueError:
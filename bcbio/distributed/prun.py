@@ -5,8 +5,8 @@ import os
 
 from bcbio import utils
 from bcbio.log import logger
-from bcbio.provenance import system
-from bcbio.distributed import multi, resources
+from bcbio.provenance import system, telemetry
+from bcbio.distributed import multi, resources, taskcache
 
 @contextlib.contextmanager
 def start(parallel, items, config, dirs=None, name=None, multiplier=1,
@@ -23,6 +23,13 @@ def start(parallel, items, config, dirs=None, name=None, multiplier=1,
     A checkpoint directory keeps track of finished tasks, avoiding spinning up
     clusters for sections that have been previous processed.
 
+    Local runs share a single pool of worker processes across all functions
+    run inside the context, avoiding process startup costs for each call.
+
+    With task caching enabled, calls matching inputs from previous runs reuse
+    stored results instead of re-running. With measured memory enabled, memory
+    per core comes from peak usage recorded for this section in previous runs.
+
     multiplier - Number of expected jobs per initial input item. Used to avoid
     underscheduling cores when an item is split during processing.
     max_multicore -- The maximum number of cores to use for each process. Can be
@@ -38,9 +45,18 @@ def start(parallel, items, config, dirs=None, name=None, multiplier=1,
     sysinfo = system.get_info(dirs, parallel, config.get("resources", {}))
     items = [x for x in items if x is not None] if items else []
     max_multicore = int(max_multicore or sysinfo.get("cores", 1))
+    measured = None
+    if name:
+        parallel = dict(parallel, block=name)
+        if parallel.get("measured_memory") and dirs and dirs.get("work"):
+            measured = telemetry.block_memory(telemetry.get_db(dirs["work"]), name)
     parallel = resources.calculate(parallel, items, sysinfo, config,
                                    multiplier=multiplier,
-                                   max_multicore=max_multicore)
+                                   max_multicore=max_multicore,
+                                   measured=measured)
+    if parallel.get("task_cache") and dirs and dirs.get("work"):
+        parallel["task_cache_dir"] = taskcache.get_cache_dir(dirs["work"])
+    pool = None
     try:
         view = None
         if parallel["type"] == "ipython":
@@ -52,16 +68,24 @@ def start(parallel, items, config, dirs=None, name=None, multiplier=1,
                 yield multi.runner(parallel, config)
             else:
                 from bcbio.distributed import ipython
-                with ipython.create(parallel, dirs, config) as view:
-                    yield ipython.runner(view, parallel, dirs, config)
+                try:
+                    with ipython.create(parallel, dirs, config) as view:
+                        yield ipython.runner(view, parallel, dirs, config)
+                finally:
+                    ipython.cleanup(dirs, config)
         else:
-            yield multi.runner(parallel, config)
+            pool = multi.WorkerPool()
+            yield multi.runner(parallel, config, pool=pool)
     except:
         if view is not None:
             from bcbio.distributed import ipython
             ipython.stop(view)
+        if pool is not None:
+            pool.terminate()
         raise
     else:
+        if pool is not None:
+            pool.close()
         for x in ["cores_per_job", "num_jobs", "mem"]:
             parallel.pop(x, None)
         if checkpoint_file:
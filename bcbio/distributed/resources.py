@@ -80,21 +80,32 @@ def _str_memory_to_gb(memory):
         assert units.lower() == "g", "Unexpected memory units: %s" % memory
     return val
 
-def _get_prog_memory(resources, cores_per_job):
-    """Get expected memory usage, in Gb per core, for a program from resource specification.
+def _per_core_memory(out, resources, cores_per_job):
+    """Scale memory for programs requesting a single core when run on multiple cores.
+    """
+    prog_cores = resources.get("cores")
+    # if a single core with memory is requested for the job
+    # and we run multiple cores, scale down to avoid overscheduling
+    if out and prog_cores and int(prog_cores) == 1 and cores_per_job > int(prog_cores):
+        out = out / float(cores_per_job)
+    return out
+
+def _get_jvm_memory(resources, cores_per_job):
+    """Get the configured JVM maximum heap, in Gb per core, for a program.
     """
     out = None
     for jvm_opt in resources.get("jvm_opts", []):
         if jvm_opt.startswith("-Xmx"):
             out = _str_memory_to_gb(jvm_opt[4:])
+    return _per_core_memory(out, resources, cores_per_job)
+
+def _get_prog_memory(resources, cores_per_job):
+    """Get expected memory usage, in Gb per core, for a program from resource specification.
+    """
+    out = _get_jvm_memory(resources, cores_per_job)
     memory = resources.get("memory")
     if memory:
-        out = _str_memory_to_gb(memory)
-    prog_cores = resources.get("cores")
-    # if a single core with memory is requested for the job
-    # and we run multiple cores, scale down to avoid overscheduling
-    if out and prog_cores and int(prog_cores) == 1 and cores_per_job > int(prog_cores):
-        out = out / float(cores_per_job)
+        out = _per_core_memory(_str_memory_to_gb(memory), resources, cores_per_job)
     return out
 
 def _scale_cores_to_memory(cores, mem_per_core, sysinfo, system_memory):
@@ -156,8 +167,32 @@ def cpu_and_memory(programs, items):
     memory_per_core = max(all_memory)
     return cores_per_job, memory_per_core
 
+# Safety margin over measured peak memory, and lowest memory per core to schedule
+MEASURED_MEMORY_MARGIN = 0.25
+MEASURED_MEMORY_MIN = 0.5
+
+def _measured_memory_per_core(measured, memory_per_core, block, jvm_memory=None):
+    """Replace configured memory per core with measured peak usage from previous runs.
+
+    measured is a tuple of peak memory per core in Gb and the number of tasks
+    it came from. Adds a safety margin, falling back to the configured value
+    without any history. Java programs reserve their maximum heap up front
+    and fail if it is not available, so never goes below the largest
+    configured JVM memory per core.
+    """
+    peak, num_tasks = measured
+    if not peak:
+        logger.info("Memory for %s: no measured history, using configured %.2fg per core"
+                    % (block, memory_per_core))
+        return memory_per_core
+    out = max(peak * (1.0 + MEASURED_MEMORY_MARGIN), MEASURED_MEMORY_MIN, jvm_memory or 0)
+    logger.info("Memory for %s: measured peak of %.2fg per core over %s tasks, with %d%% margin "
+                "using %.2fg per core instead of configured %.2fg"
+                % (block, peak, num_tasks, MEASURED_MEMORY_MARGIN * 100, out, memory_per_core))
+    return out
+
 def calculate(parallel, items, sysinfo, config, multiplier=1,
-              max_multicore=None):
+              max_multicore=None, measured=None):
     """Determine cores and workers to use for this stage based on used programs.
     multiplier specifies the number of regions items will be split into during
     processing.
@@ -165,6 +200,8 @@ def calculate(parallel, items, sysinfo, config, multiplier=1,
     force single core processing during specific tasks.
     sysinfo specifies cores and memory on processing nodes, allowing us to tailor
     jobs for available resources.
+    measured optionally provides peak memory per core and number of tasks
+    measured in previous runs, used instead of configured program memory.
     """
     assert len(items) > 0, "Finding job resources but no items to process"
     all_cores = []
@@ -199,6 +236,12 @@ def calculate(parallel, items, sysinfo, config, multiplier=1,
     if len(all_memory) == 0:
         all_memory.append(1)
     memory_per_core = max(all_memory)
+    if measured:
+        jvm_memory = [_get_jvm_memory(config_utils.get_resources(prog, config), cores_per_job)
+                      for prog in progs]
+        memory_per_core = _measured_memory_per_core(measured, memory_per_core,
+                                                    parallel.get("block", "parallel tasks"),
+                                                    max([x for x in jvm_memory if x] or [0]))
 
     logger.debug("Resource requests: {progs}; memory: {memory}; cores: {cores}".format(
         progs=", ".join(progs), memory=", ".join("%.2f" % x for x in all_memory),
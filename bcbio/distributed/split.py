@@ -18,7 +18,7 @@ from bcbio import utils
 def grouped_parallel_split_combine(args, split_fn, group_fn, parallel_fn,
                                    parallel_name, combine_name,
                                    file_key, combine_arg_keys,
-                                   split_outfile_i=-1):
+                                   split_outfile_i=-1, cost_fn=None):
     """Parallel split runner that allows grouping of samples during processing.
 
     This builds on parallel_split_combine to provide the additional ability to
@@ -28,10 +28,14 @@ def grouped_parallel_split_combine(args, split_fn, group_fn, parallel_fn,
 
     group_fn: A function that groups samples together given their configuration
       details.
+    cost_fn: An optional function estimating run time from the arguments for
+      a split task. Tasks across all groups start in order of decreasing cost.
     """
     grouped_args = group_fn(args)
     split_args, combine_map, finished_out, extras = _get_split_tasks(grouped_args, split_fn, file_key,
                                                                      split_outfile_i)
+    if cost_fn:
+        split_args.sort(key=cost_fn, reverse=True)
     final_output = parallel_fn(parallel_name, split_args)
     combine_args, final_args = _organize_output(final_output, combine_map,
                                                 file_key, combine_arg_keys)
@@ -128,7 +132,7 @@ def _get_split_tasks(args, split_fn, file_key, outfile_i=-1):
     for data in args:
         out_final, out_parts = split_fn(data)
         for parts in out_parts:
-            split_args.append([utils.deepish_copy(data)] + list(parts))
+            split_args.append([utils.shared_copy(data)] + list(parts))
         for part_file in [x[outfile_i] for x in out_parts]:
             combine_map[part_file] = out_final
         if len(out_parts) == 0:
@@ -0,0 +1,237 @@
+"""Stage remote inputs from object stores concurrently.
+
+Remote inputs of a run download one file at a time when first referenced.
+Staging submits all remote inputs up front to a bounded pool of download
+threads, so transfers run concurrently and in the background while the run
+continues preparing samples; objectstore.download then waits on in-flight
+files instead of starting its own transfer.
+
+Large S3 objects download as concurrent ranged GETs into a partial file
+next to the output when boto3 is available. Finished parts are recorded so
+interrupted downloads resume, and completed files are checked against the
+object size and, for single part uploads, the MD5 ETag. Set AWS_ENDPOINT_URL
+to stage from S3 compatible stores.
+"""
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import threading
+
+import six
+
+from bcbio import utils
+from bcbio.distributed import objectstore
+from bcbio.log import logger
+
+# Concurrent file downloads
+MAX_WORKERS = 8
+# Concurrent ranged requests within a single large file
+PART_WORKERS = 4
+PART_SIZE = 64 * 1024 * 1024
+# Files smaller than this download with the standard object store tools
+RANGED_MIN_SIZE = 2 * PART_SIZE
+
+class DownloadError(Exception):
+    pass
+
+# ## Ranged downloads
+
+class S3Source:
+    """Ranged access to an S3 object through a boto3 style client.
+    """
+    def __init__(self, client, bucket, key):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        head = client.head_object(Bucket=bucket, Key=key)
+        self.size = int(head["ContentLength"])
+        # ETags of objects encrypted with KMS or customer keys are not MD5s of the content
+        if head.get("ServerSideEncryption") == "aws:kms" or head.get("SSECustomerAlgorithm"):
+            self.etag = ""
+        else:
+            self.etag = head.get("ETag", "").strip('"')
+
+    def get_range(self, start, end):
+        """Retrieve bytes from start to end, inclusive.
+        """
+        resp = self.client.get_object(Bucket=self.bucket, Key=self.key,
+                                      Range="bytes=%s-%s" % (start, end))
+        return resp["Body"].read()
+
+def _s3_client(region):
+    try:
+        import boto3
+    except ImportError:
+        return None
+    return boto3.client("s3", region_name=region, endpoint_url=os.environ.get("AWS_ENDPOINT_URL"))
+
+def _read_done(parts_file):
+    done = set()
+    if os.path.exists(parts_file):
+        with open(parts_file) as in_handle:
+            for line in in_handle:
+                if line.strip():
+                    done.add(int(line))
+    return done
+
+def _check_download(source, fname):
+    size = os.path.getsize(fname)
+    if size != source.size:
+        raise DownloadError("Size mismatch for %s: expected %s, found %s" % (fname, source.size, size))
+    # Multipart upload ETags depend on the upload part sizes, so only check plain MD5s
+    if source.etag and "-" not in source.etag:
+        md5 = hashlib.md5()
+        with open(fname, "rb") as in_handle:
+            for chunk in iter(lambda: in_handle.read(1024 * 1024), b""):
+                md5.update(chunk)
+        if md5.hexdigest() != source.etag:
+            raise DownloadError("Checksum mismatch for %s: expected %s, found %s" %
+                                (fname, source.etag, md5.hexdigest()))
+
+def ranged_download(source, out_file, part_size=PART_SIZE, workers=PART_WORKERS):
+    """Download an object with concurrent ranged requests, resuming previous partial downloads.
+    """
+    partial_file = "%s.partial" % out_file
+    parts_file = "%s.parts" % out_file
+    nparts = max(1, (source.size + part_size - 1) // part_size)
+    done = _read_done(parts_file) if os.path.exists(partial_file) else set()
+    if not done:
+        with open(partial_file, "wb") as out_handle:
+            out_handle.truncate(source.size)
+        utils.remove_safe(parts_file)
+    lock = threading.Lock()
+    fd = os.open(partial_file, os.O_WRONLY)
+    try:
+        def _get_part(i):
+            start = i * part_size
+            end = min(source.size, start + part_size) - 1
+            data = source.get_range(start, end)
+            if len(data) != end - start + 1:
+                raise DownloadError("Short read for %s bytes %s-%s" % (out_file, start, end))
+            os.pwrite(fd, data, start)
+            with lock:
+                with open(parts_file, "a") as out_handle:
+                    out_handle.write("%s\n" % i)
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            list(pool.map(_get_part, [i for i in range(nparts) if i not in done]))
+    finally:
+        os.close(fd)
+    try:
+        _check_download(source, partial_file)
+    except DownloadError:
+        utils.remove_safe(partial_file)
+        utils.remove_safe(parts_file)
+        raise
+    os.rename(partial_file, out_file)
+    utils.remove_safe(parts_file)
+    return out_file
+
+def _s3_ranged_source(fname):
+    """Retrieve a ranged source for large S3 objects, or None to use standard downloads.
+    """
+    if not fname.startswith("s3://"):
+        return None
+    file_info = objectstore.AmazonS3.parse_remote(fname)
+    client = _s3_client(objectstore.AmazonS3.get_region(fname))
+    if client is None:
+        return None
+    try:
+        source = S3Source(client, file_info.bucket, file_info.key)
+    except Exception as e:
+        logger.debug("Using standard download for %s: %s" % (fname, e))
+        return None
+    return source if source.size >= RANGED_MIN_SIZE else None
+
+def download_file(fname, input_dir):
+    """Download a remote file into the inputs directory, matching objectstore.download outputs.
+    """
+    source = _s3_ranged_source(fname)
+    if source:
+        file_info = objectstore.AmazonS3.parse_remote(fname)
+        dl_dir = utils.safe_makedir(os.path.join(input_dir, file_info.bucket,
+                                                 os.path.dirname(file_info.key)))
+        out_file = os.path.join(dl_dir, os.path.basename(file_info.key))
+        if not utils.file_exists(out_file):
+            ranged_download(source, out_file)
+        return out_file
+    return objectstore.download_direct(fname, input_dir)
+
+# ## Staging
+
+class Stager:
+    """Download remote files with a bounded pool of concurrent transfers.
+    """
+    def __init__(self, input_dir, max_workers=MAX_WORKERS):
+        self.input_dir = input_dir
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self._futures = {}
+        self.prev = None
+
+    def submit(self, fnames):
+        for fname in fnames:
+            if fname not in self._futures:
+                self._futures[fname] = self._pool.submit(download_file, fname, self.input_dir)
+
+    def has(self, fname, input_dir):
+        return fname in self._futures and os.path.abspath(input_dir) == os.path.abspath(self.input_dir)
+
+    def result(self, fname):
+        return self._futures[fname].result()
+
+    def close(self, cancel=False):
+        """Wait for downloads to finish, or cancel downloads not yet started.
+        """
+        if cancel:
+            for f in self._futures.values():
+                f.cancel()
+        self._pool.shutdown(wait=not cancel)
+
+def remote_files(xs):
+    """Retrieve remote files referenced in nested inputs.
+    """
+    out = []
+    if isinstance(xs, dict):
+        for v in xs.values():
+            out.extend(remote_files(v))
+    elif isinstance(xs, (list, tuple)):
+        for v in xs:
+            out.extend(remote_files(v))
+    elif isinstance(xs, six.string_types) and objectstore.is_remote(xs):
+        out.append(xs)
+    return out
+
+def start(fnames, input_dir, max_workers=MAX_WORKERS):
+    """Start downloading remote files in the background, returning the stager or None.
+
+    Calls to objectstore.download for these files wait for their transfer.
+    """
+    fnames = [x for x in fnames if objectstore.is_remote(x)]
+    if not fnames:
+        return None
+    stager = Stager(input_dir, max_workers)
+    stager.submit(fnames)
+    logger.info("Staging %s remote inputs with %s concurrent downloads" % (len(set(fnames)), max_workers))
+    stager.prev = objectstore.set_stager(stager)
+    return stager
+
+def finish(stager, cancel=False):
+    """Wait for all downloads of a stager to finish, or cancel pending ones.
+    """
+    if stager is not None:
+        objectstore.set_stager(stager.prev)
+        stager.close(cancel)
+
+@contextlib.contextmanager
+def prefetch(fnames, input_dir, max_workers=MAX_WORKERS):
+    """Download remote files in the background while running the enclosed code.
+
+    On errors, cancels downloads not yet started instead of waiting for them.
+    """
+    stager = start(fnames, input_dir, max_workers)
+    try:
+        yield stager
+    except BaseException:
+        finish(stager, cancel=True)
+        raise
+    finish(stager)
@@ -0,0 +1,167 @@
+"""Cache results of parallel tasks across runs, keyed on their inputs.
+
+Re-running a project re-enters every parallel step. With caching enabled, each
+call to a multitasks entry point is keyed on a hash of the function name, the
+input arguments, the size and modification time of input files and the program
+versions used in the run. Matching calls return stored output data without
+dispatching work. Results are only reused when all files they reference still
+exist.
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+
+from bcbio import utils
+from bcbio.log import logger
+
+# Keys that change between runs without affecting task outputs
+IGNORE_KEYS = set(["provenance", "parallel", "num_cores"])
+
+def get_cache_dir(work_dir):
+    return os.path.join(work_dir, "provenance", "taskcache")
+
+def _strip_volatile(x):
+    if isinstance(x, dict):
+        return {str(k): _strip_volatile(v) for k, v in x.items() if k not in IGNORE_KEYS}
+    elif isinstance(x, (list, tuple)):
+        return [_strip_volatile(v) for v in x]
+    else:
+        return x
+
+def _file_fingerprints(x, out):
+    """Collect size and modification time of existing files referenced in arguments.
+    """
+    if isinstance(x, dict):
+        for v in x.values():
+            _file_fingerprints(v, out)
+    elif isinstance(x, (list, tuple)):
+        for v in x:
+            _file_fingerprints(v, out)
+    elif isinstance(x, str) and os.path.isabs(x) and os.path.isfile(x):
+        stat = os.stat(x)
+        out[x] = [stat.st_size, int(stat.st_mtime)]
+    return out
+
+def _program_versions(cache_dir):
+    programs_file = os.path.join(os.path.dirname(cache_dir), "programs.txt")
+    if utils.file_exists(programs_file):
+        with open(programs_file) as in_handle:
+            return in_handle.read()
+    return ""
+
+def task_key(fn_name, args, versions=""):
+    """Hash uniquely identifying a task from its function, arguments, input files and programs.
+    """
+    args = _strip_volatile(args)
+    ident = {"fn": fn_name, "args": args, "files": _file_fingerprints(args, {}),
+             "versions": versions}
+    return hashlib.sha256(json.dumps(ident, sort_keys=True, default=str).encode()).hexdigest()
+
+def _outputs_exist(x):
+    if isinstance(x, dict):
+        return all(_outputs_exist(v) for v in x.values())
+    elif isinstance(x, (list, tuple)):
+        return all(_outputs_exist(v) for v in x)
+    elif isinstance(x, str) and os.path.isabs(x) and os.path.splitext(x)[-1]:
+        return os.path.exists(x)
+    return True
+
+def _cache_file(cache_dir, fn_name, key):
+    return os.path.join(cache_dir, fn_name, "%s.pkl" % key)
+
+def _get(cache_file):
+    if utils.file_exists(cache_file):
+        try:
+            with open(cache_file, "rb") as in_handle:
+                out = pickle.load(in_handle)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            logger.debug("Ignoring unreadable task cache %s: %s" % (cache_file, e))
+            return None
+        if _outputs_exist(out):
+            os.utime(cache_file, None)
+            return out
+    return None
+
+def _put(cache_file, result):
+    utils.safe_makedir(os.path.dirname(cache_file))
+    tmp_file = "%s.%s.tmp" % (cache_file, os.getpid())
+    with open(tmp_file, "wb") as out_handle:
+        pickle.dump(result, out_handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_file, cache_file)
+
+def run(cache_dir, fn_name, items, run_items):
+    """Run items through run_items, reusing cached results for previously seen inputs.
+
+    run_items takes a list of argument lists and returns a list with the output
+    of each. Returns outputs in the original item order.
+    """
+    if not cache_dir:
+        return run_items(items)
+    versions = _program_versions(cache_dir)
+    cache_files = [_cache_file(cache_dir, fn_name, task_key(fn_name, x, versions)) for x in items]
+    out = [_get(f) for f in cache_files]
+    to_run = [i for i, x in enumerate(out) if x is None]
+    if len(to_run) < len(items):
+        logger.info("Task cache: reusing %s of %s results for %s" %
+                    (len(items) - len(to_run), len(items), fn_name))
+    if to_run:
+        for i, result in zip(to_run, run_items([items[i] for i in to_run])):
+            out[i] = result
+            _put(cache_files[i], result)
+    return out
+
+def evict(cache_dir, fn_name=None, max_age_days=None, max_size_gb=None):
+    """Remove cached results, by function, age since last use or to fit a total size.
+
+    Without limits, removes all cached results for the given function or
+    the entire cache. Returns the number of removed results.
+    """
+    base_dir = os.path.join(cache_dir, fn_name) if fn_name else cache_dir
+    if not os.path.exists(base_dir):
+        return 0
+    if max_age_days is None and max_size_gb is None:
+        count = sum(len(files) for _, _, files in os.walk(base_dir))
+        shutil.rmtree(base_dir)
+        return count
+    entries = []
+    for root, _, files in os.walk(base_dir):
+        for f in files:
+            fname = os.path.join(root, f)
+            stat = os.stat(fname)
+            entries.append((stat.st_mtime, stat.st_size, fname))
+    entries.sort(reverse=True)
+    to_remove = []
+    if max_age_days is not None:
+        cutoff = time.time() - max_age_days * 24 * 60 * 60
+        to_remove.extend(e for e in entries if e[0] < cutoff)
+        entries = [e for e in entries if e[0] >= cutoff]
+    if max_size_gb is not None:
+        total = 0
+        for e in entries:
+            total += e[1]
+            if total > max_size_gb * 1024 * 1024 * 1024:
+                to_remove.append(e)
+    for _, _, fname in to_remove:
+        os.remove(fname)
+    return len(to_remove)
+
+# ## Command line
+
+def add_subparser(subparsers):
+    parser = subparsers.add_parser("taskcache", help="Inspect and invalidate cached parallel task results")
+    parser.add_argument("--workdir", default=os.getcwd(),
+                        help="Directory of the bcbio run. Defaults to current working directory")
+    parser.add_argument("--fn", help="Only remove results for this parallel function")
+    parser.add_argument("--max-age", type=float, dest="max_age",
+                        help="Remove results not used in this many days")
+    parser.add_argument("--max-size", type=float, dest="max_size",
+                        help="Remove least recently used results to fit the cache in this many Gb")
+    return parser
+
+def process(args):
+    cache_dir = get_cache_dir(os.path.abspath(args.workdir))
+    removed = evict(cache_dir, args.fn, args.max_age, args.max_size)
+    print("Removed %s cached task results from %s" % (removed, cache_dir))
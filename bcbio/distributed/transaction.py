@@ -4,6 +4,14 @@ To handle interrupts,this defines output files written to temporary
 locations during processing and copied to the final location when finished.
 This ensures output files will be complete independent of method of
 interruption.
+
+Transactional files on the same filesystem as their final location move
+with an atomic rename. Without a configured temporary directory, transactions
+use a temporary directory on the destination filesystem, avoiding copies of
+large outputs between mounts. Remaining cross filesystem moves copy in the
+kernel with copy_file_range, allowing server side copies on network
+filesystems. Counts of renamed and copied bytes are available from
+move_stats for resource usage reports.
 """
 import contextlib
 import os
@@ -18,6 +26,15 @@ from bcbio.log import logger
 
 DEFAULT_TMP = 'bcbiotx'
 
+# Files and bytes moved by rename or copy in this process
+_move_stats = {"renamed_files": 0, "renamed_bytes": 0, "copied_files": 0, "copied_bytes": 0}
+
+
+def move_stats():
+    """Retrieve counts of files and bytes renamed or copied into final locations.
+    """
+    return dict(_move_stats)
+
 
 @contextlib.contextmanager
 def tx_tmpdir(data=None, base_dir=None, remove=True):
@@ -35,7 +52,12 @@ def tx_tmpdir(data=None, base_dir=None, remove=True):
     base_dir = base_dir or os.getcwd()
     tmpdir_base = utils.get_abspath(_get_base_tmpdir(data, base_dir))
     utils.safe_makedir(tmpdir_base)
-    tmp_dir = tempfile.mkdtemp(dir=tmpdir_base)
+    try:
+        tmp_dir = tempfile.mkdtemp(dir=tmpdir_base)
+    # base directory removed by a finishing transaction on another filesystem
+    except FileNotFoundError:
+        utils.safe_makedir(tmpdir_base)
+        tmp_dir = tempfile.mkdtemp(dir=tmpdir_base)
     #logger.debug("Created tmp dir %s " % tmp_dir)
     try:
         yield tmp_dir
@@ -45,10 +67,14 @@ def tx_tmpdir(data=None, base_dir=None, remove=True):
 
 
 def _get_base_tmpdir(data, fallback_base_dir):
+    return _configured_tmpdir(data) or os.path.join(fallback_base_dir, DEFAULT_TMP)
+
+
+def _configured_tmpdir(data):
     config_tmpdir = tz.get_in(("config", "resources", "tmp", "dir"), data)
     if not config_tmpdir:
         config_tmpdir = tz.get_in(("resources", "tmp", "dir"), data)
-    return config_tmpdir or os.path.join(fallback_base_dir, DEFAULT_TMP)
+    return config_tmpdir
 
 
 @contextlib.contextmanager
@@ -99,23 +125,76 @@ def _move_tmp_files(safe, orig):
             _move_file_with_sizecheck(safe_idx, orig + check_idx)
 
 
+def _device(path):
+    """Retrieve the device of the filesystem holding a path, or its nearest existing parent.
+    """
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+
+def _file_device(fname):
+    try:
+        return os.stat(fname).st_dev
+    except OSError:
+        return None
+
+
+def _copy_file_range(tx_file, final_file):
+    """Copy a file in the kernel, then remove the original, like shutil.move.
+    """
+    with open(tx_file, "rb") as in_handle, open(final_file, "wb") as out_handle:
+        remaining = os.fstat(in_handle.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(in_handle.fileno(), out_handle.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+    shutil.copystat(tx_file, final_file)
+    os.remove(tx_file)
+
+
 def _move_file_with_sizecheck(tx_file, final_file):
     """Move transaction file to final location,
        with size checks avoiding failed transfers.
 
-       Creates an empty file with '.bcbiotmp' extention in the destination
+       Uses an atomic rename when both are on the same filesystem. Otherwise
+       creates an empty file with '.bcbiotmp' extention in the destination
        location, which serves as a flag. If a file like that is present,
        it means that transaction didn't finish successfully.
     """
 
     #logger.debug("Moving %s to %s" % (tx_file, final_file))
 
+    tx_device = _file_device(tx_file)
+    if tx_device is not None and tx_device == _device(os.path.dirname(final_file)):
+        want_size = utils.get_size(tx_file)
+        os.rename(tx_file, final_file)
+        _move_stats["renamed_files"] += 1
+        _move_stats["renamed_bytes"] += want_size
+        return
+
     tmp_file = final_file + ".bcbiotmp"
     open(tmp_file, 'wb').close()
 
     want_size = utils.get_size(tx_file)
-    shutil.move(tx_file, final_file)
+    if tx_device is not None and os.path.isfile(tx_file) and hasattr(os, "copy_file_range"):
+        try:
+            _copy_file_range(tx_file, final_file)
+        except OSError as e:
+            logger.debug("Falling back to standard copy for %s: %s" % (final_file, e))
+            shutil.move(tx_file, final_file)
+    else:
+        shutil.move(tx_file, final_file)
     transfer_size = utils.get_size(final_file)
+    _move_stats["copied_files"] += 1
+    _move_stats["copied_bytes"] += transfer_size
 
     assert want_size == transfer_size, (
         'distributed.transaction.file_transaction: File copy error: '
@@ -132,10 +211,39 @@ def _flatten_plus_safe(data_and_files):
     """Flatten names of files and create temporary file names.
     """
     data, rollback_files = _normalize_args(data_and_files)
-    with tx_tmpdir(data) as tmpdir:
-        tx_files = [os.path.join(tmpdir, os.path.basename(f))
-                    for f in rollback_files]
-        yield tx_files, rollback_files
+    base_dir = _destination_base_dir(data, rollback_files)
+    try:
+        with (tx_tmpdir(data, base_dir) if base_dir else tx_tmpdir(data)) as tmpdir:
+            tx_files = [os.path.join(tmpdir, os.path.basename(f))
+                        for f in rollback_files]
+            yield tx_files, rollback_files
+    finally:
+        if base_dir:
+            _remove_empty_dir(os.path.join(base_dir, DEFAULT_TMP))
+
+
+def _remove_empty_dir(dirname):
+    """Remove a transaction directory in an output directory, unless still in use.
+    """
+    try:
+        os.rmdir(dirname)
+    except OSError:
+        pass
+
+
+def _destination_base_dir(data, rollback_files):
+    """Directory for transactions on the destination filesystem, if the default is elsewhere.
+
+    Respects configured temporary directories, which are often fast local scratch.
+    The bcbiotx directory created in the output directory is removed once no
+    transactions use it.
+    """
+    if not rollback_files or _configured_tmpdir(data):
+        return None
+    out_dir = os.path.dirname(os.path.abspath(rollback_files[0]))
+    if _device(os.getcwd()) != _device(out_dir):
+        return out_dir
+    return None
 
 
 def _normalize_args(data_and_files):
@@ -1,312 +1,236 @@
+"""Parse raw collectl files into typed columns for resource usage graphs.
+
+Raw files are decompressed and split into lines as a stream, skipping samples
+outside the requested time window before splitting fields. Values go directly
+into per-column numeric arrays, emitted in chunks, so memory use follows the
+size of the parsed columns rather than nested dictionaries of strings. Parsed
+columns are cached next to the raw files, keyed on raw file size and
+modification time, so re-graphing skips parsing.
+"""
+import array
 import calendar
 import glob
-import gzip
+import json
 import math
 import os.path
-import re
+import zlib
 
+import numpy as np
 import pandas as pd
 
-def _parse_raw(fp, start_tstamp, end_tstamp):
-    import progressbar
-    widgets = [
-        os.path.basename(fp.name), ': ',
-        progressbar.Bar(marker='-', left='[', right=']'), ' ',
-        progressbar.Percentage(), ' ', progressbar.ETA(),
-    ]
-    # We don't know what the file's uncompressed size will wind up being,
-    # so take an educated guess and ignore the AssertionError later on
-    # if it winds up being bigger than we guess.
-    bar = progressbar.ProgressBar(
-        widgets=widgets, maxval=os.path.getsize(fp.name) * 15)
-    bar.start()
-    bar.update(0)
+CPU_FIELDS = ['user', 'nice', 'sys', 'idle', 'wait', 'irq', 'soft', 'steal']
+DISK_FIELDS = ['num_reads', 'reads_merged', 'sectors_read', 'msec_spent_reading',
+               'num_writes', 'writes_merged', 'sectors_written', 'msec_spent_writing',
+               'iops_in_progress', 'msec_spent_on_iops', 'weighted_msec_spent_on_iops']
+MEM_FIELDS = {'MemTotal:': 'total', 'MemFree:': 'free', 'Buffers:': 'buffers', 'Cached:': 'cached'}
+NET_FIELDS = ['rbyte', 'rpkt', 'rerr', 'rdrop', 'rfifo', 'rframe', 'rcomp', 'rmulti',
+              'tbyte', 'tpkt', 'terr', 'tdrop', 'tfifo', 'tcoll', 'tcarrier', 'tcomp']
 
-    tstamp = 0
+CHUNK_SIZE = 10000
+
+def _iter_lines(path, read_size=1024 * 1024):
+    """Stream decoded lines from a gzipped collectl file.
+
+    collectl writes data to its files incrementally, and doesn't add a CRC to
+    the end until it rotates the log. Decompress without verifying the end of
+    the stream, so truncated files return all complete lines.
+    """
+    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    remainder = b''
+    with open(path, 'rb') as in_handle:
+        while True:
+            block = in_handle.read(read_size)
+            if not block:
+                break
+            try:
+                buf = decomp.decompress(block)
+            except zlib.error:
+                break
+            # Concatenated gzip members start a new stream
+            while decomp.eof and decomp.unused_data:
+                unused = decomp.unused_data
+                decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                buf += decomp.decompress(unused)
+            lines = (remainder + buf).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line.decode('utf-8', 'replace')
+    if remainder:
+        yield remainder.decode('utf-8', 'replace')
+
+class _Columns:
+    """Accumulate samples as typed columns, filling columns missing from a sample with 0.
+    """
+    def __init__(self):
+        self.tstamps = array.array('q')
+        self.cols = {}
+        self.order = []
+
+    def __len__(self):
+        return len(self.tstamps)
+
+    def add(self, tstamp, values):
+        n = len(self.tstamps)
+        for col, val in values.items():
+            if col not in self.cols:
+                self.cols[col] = array.array('d', [0.0]) * n
+                self.order.append(col)
+        for col in self.order:
+            self.cols[col].append(values.get(col, 0.0))
+        self.tstamps.append(tstamp)
+
+    def emit(self):
+        """Retrieve the current chunk as numpy arrays and start a new chunk.
+        """
+        out = {'tstamp': np.frombuffer(self.tstamps, dtype=np.int64).copy()}
+        for col in self.order:
+            out[col] = np.frombuffer(self.cols[col], dtype=np.float64).copy()
+        self.tstamps = array.array('q')
+        self.cols = {col: array.array('d') for col in self.order}
+        return out
+
+def _complete(sample):
+    """Skip incomplete samples; there might be a truncated sample on the end of the file.
+    """
+    return 'cpu_user' in sample and all('mem_%s' % x in sample for x in MEM_FIELDS.values())
+
+def _parse_line(line, sample):
+    if line.startswith('cpu '):
+        # Don't know what the last two fields are, but they always seem to be 0,
+        # and collectl doesn't parse them in formatit::dataAnalyze().
+        for field, val in zip(CPU_FIELDS, line.split()[1:9]):
+            sample['cpu_%s' % field] = float(val)
+    elif line.startswith('disk '):
+        parts = line.split()
+        node = parts[3]
+        for field, val in zip(DISK_FIELDS, parts[4:]):
+            sample['%s_%s' % (node, field)] = float(val)
+    elif line.startswith('Net '):
+        # Older kernel versions don't have whitespace after the interface colon:
+        #   Net   eth0:70627391
+        # unlike newer kernels:
+        #   Net   eth0: 415699541
+        iface, rest = line[4:].split(':', 1)
+        for field, val in zip(NET_FIELDS, rest.split()):
+            sample['%s_%s' % (iface.strip(), field)] = float(val)
+    else:
+        for prefix, field in MEM_FIELDS.items():
+            if line.startswith(prefix):
+                sample['mem_%s' % field] = float(line.split()[1])
+                break
+
+def iter_chunks(path, start_tstamp, end_tstamp, chunk_size=CHUNK_SIZE):
+    """Parse a raw collectl file, yielding hardware information and chunks of columns.
+
+    Each chunk is a dictionary of column names to numpy arrays, with
+    timestamps in seconds as the tstamp column. Lines for samples outside
+    of the time window are skipped without parsing.
+    """
     hardware = {}
-    data = {}
-    for line in fp:
-        matches = re.search(r'^>>> (\d+).\d+ <<<', line)
-        if matches:
+    cols = _Columns()
+    tstamp = None
+    sample = None
+    for line in _iter_lines(path):
+        if line.startswith('>>> '):
+            if sample is not None and _complete(sample):
+                cols.add(tstamp, sample)
+                if len(cols) >= chunk_size:
+                    yield hardware, cols.emit()
+            tstamp = int(line[4:].split('.')[0].split()[0])
+            sample = {} if start_tstamp <= tstamp <= end_tstamp else None
+        elif sample is not None:
             try:
-                bar.update(fp.tell())
-            except AssertionError:
+                _parse_line(line, sample)
+            except (ValueError, IndexError):
                 pass
-
-            tstamp = int(matches.group(1))
-            if (tstamp >= start_tstamp) or (tstamp <= end_tstamp):
-                data[tstamp] = {
-                    'disk': {},
-                    'mem': {},
-                    'net': {},
-                    'proc': {},
-                }
-            continue
-
-        if line.startswith('# SubSys: '):
-            matches = re.search(r'\sNumCPUs: (\d+)\s+', line)
-            if matches:
-                hardware['num_cpus'] = int(matches.group(1))
-            continue
-        if line.startswith('# Kernel: '):
-            matches = re.search(r'\sMemory: (\d+)\s+kB', line)
-            if matches:
-                hardware['memory'] = int(math.ceil(float(matches.group(1)) / math.pow(1024.0, 2.0)))
-            continue
-
-        if (tstamp < start_tstamp) or (tstamp > end_tstamp):
-            continue
-
-        if line.startswith('cpu '):
-            # Don't know what the last two fields are, but they
-            # always seem to be 0, and collectl doesn't parse them
-            # in formatit::dataAnalyze().
-            (title, user, nice, sys, idle, wait, irq,
-             soft, steal) = line.split()[:9]
-            data[tstamp]['cpu'] = {
-                 'user': user,
-                 'nice': nice,
-                 'sys': sys,
-                 'idle': idle,
-                 'wait': wait,
-                 'irq': irq,
-                 'soft': soft,
-                 'steal': steal,
-            }
-        elif line.startswith('disk '):
-            (title, major, minor, node,
-             num_reads, reads_merged, sectors_read, msec_spent_reading,
-             num_writes, writes_merged, sectors_written, msec_spent_writing,
-             iops_in_progress, msec_spent_on_iops,
-             weighted_msec_spent_on_iops) = line.split()
-            data[tstamp]['disk'][node] = {
-                'num_reads': num_reads,
-                'reads_merged': reads_merged,
-                'sectors_read': sectors_read,
-                'msec_spent_reading': msec_spent_reading,
-                'num_writes': num_writes,
-                'writes_merged': writes_merged,
-                'sectors_written': sectors_written,
-                'msec_spent_writing': msec_spent_writing,
-                'iops_in_progress': iops_in_progress,
-                'msec_spent_on_iops': msec_spent_on_iops,
-                'weighted_msec_spent_on_iops': weighted_msec_spent_on_iops,
-            }
-        elif line.startswith('Net '):
-            # Older kernel versions don't have whitespace after
-            # the interface colon:
-            #
-            #   Net   eth0:70627391
-            #
-            # unlike newer kernels:
-            #
-            #   Net   eth0: 415699541
-            line = re.sub(r'^(Net\s+[^:]+):', r'\1: ', line)
-
-            (title, iface,
-             rbyte, rpkt, rerr, rdrop, rfifo,
-             rframe, rcomp, rmulti,
-             tbyte, tpkt, terr, tdrop, tfifo,
-             tcoll, tcarrier, tcomp) = line.split()
-            iface = iface.replace(':', '')
-            data[tstamp]['net'][iface] = {
-                 'rbyte': rbyte,
-                 'rpkt': rpkt,
-                 'rerr': rerr,
-                 'rdrop': rdrop,
-                 'rfifo': rfifo,
-                 'rframe': rframe,
-                 'rcomp': rcomp,
-                 'rmulti': rmulti,
-                 'tbyte': tbyte,
-                 'tpkt': tpkt,
-                 'terr': terr,
-                 'tdrop': tdrop,
-                 'tfifo': tfifo,
-                 'tcoll': tcoll,
-                 'tcarrier': tcarrier,
-                 'tcomp': tcomp,
-            }
-        elif line.startswith('MemTotal:'):
-            title, amount, unit = line.split()
-            data[tstamp]['mem']['total'] = amount
-        elif line.startswith('MemFree:'):
-            title, amount, unit = line.split()
-            data[tstamp]['mem']['free'] = amount
-        elif line.startswith('Buffers:'):
-            title, amount, unit = line.split()
-            data[tstamp]['mem']['buffers'] = amount
-        elif line.startswith('Cached:'):
-            title, amount, unit = line.split()
-            data[tstamp]['mem']['cached'] = amount
-        # We don't currently do anything with process data,
-        # so don't bother parsing it.
-        elif False and line.startswith('proc:'):
-            title_pid, rest = line.split(None, 1)
-            title, pid = title_pid.split(':')
-
-            if pid not in data[tstamp]['proc']:
-                data[tstamp]['proc'][pid] = {}
-
-            if rest.startswith('cmd '):
-                title, cmd = rest.split(None, 1)
-                data[tstamp]['proc'][pid]['cmd'] = cmd
-            elif rest.startswith('io read_bytes: '):
-                value = rest.split(':')[1].strip()
-                data[tstamp]['proc'][pid]['read_bytes'] = value
-            elif rest.startswith('io write_bytes: '):
-                value = rest.split(':')[1].strip()
-                data[tstamp]['proc'][pid]['write_bytes'] = value
-
-    bar.finish()
-    return hardware, data
-
-
-class _CollectlGunzip(gzip.GzipFile):
-    """collectl writes data to its files incrementally, and doesn't
-    add a CRC to the end until it rotates the log. Ignore the CRC
-    errors; they're innocuous in this case.
+        elif line.startswith('# SubSys: '):
+            parts = line.split('NumCPUs: ')
+            if len(parts) > 1:
+                hardware['num_cpus'] = int(parts[1].split()[0])
+        elif line.startswith('# Kernel: '):
+            parts = line.split('Memory: ')
+            if len(parts) > 1 and parts[1].split()[1:2] == ['kB']:
+                hardware['memory'] = int(math.ceil(float(parts[1].split()[0]) / math.pow(1024.0, 2.0)))
+    if sample is not None and _complete(sample):
+        cols.add(tstamp, sample)
+    if len(cols) > 0:
+        yield hardware, cols.emit()
+    else:
+        yield hardware, None
+
+def to_frame(chunks):
+    frames = [pd.DataFrame(x) for x in chunks if x is not None]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=['tstamp'])
+    df = pd.concat(frames, ignore_index=True).fillna(0.0)
+    df['tstamp'] = pd.to_datetime(df['tstamp'], unit='s', utc=True)
+    df.set_index('tstamp', inplace=True)
+    return df
+
+# ## Cache of parsed columns
+
+def _cache_file(path, cache_dir, start_tstamp, end_tstamp):
+    stat = os.stat(path)
+    return os.path.join(cache_dir, '%s-%s-%s-%s-%s.npz' % (os.path.basename(path), stat.st_size,
+                                                         int(stat.st_mtime), start_tstamp, end_tstamp))
+
+def _read_cache(cache_file):
+    if os.path.exists(cache_file):
+        with np.load(cache_file, allow_pickle=False) as in_handle:
+            hardware = json.loads(str(in_handle['__hardware__']))
+            cols = {k: in_handle[k] for k in in_handle.files if k != '__hardware__'}
+        return hardware, cols or None
+
+def _write_cache(cache_file, hardware, cols):
+    if not os.path.exists(os.path.dirname(cache_file)):
+        os.makedirs(os.path.dirname(cache_file))
+    tmp_file = '%s.%s.tmp.npz' % (cache_file[:-4], os.getpid())
+    np.savez(tmp_file, __hardware__=np.array(json.dumps(hardware)), **(cols or {}))
+    os.rename(tmp_file, cache_file)
+
+def _concat_chunks(chunks):
+    """Combine chunks into single arrays per column, filling columns missing in earlier chunks.
     """
-
-    def _read_eof(self):
-        return
-
-
-def load_collectl(pattern, start_time, end_time):
+    chunks = [x for x in chunks if x is not None]
+    if not chunks:
+        return None
+    order = []
+    for chunk in chunks:
+        order.extend(k for k in chunk if k not in order)
+    return {k: np.concatenate([c[k] if k in c else np.zeros(len(c['tstamp'])) for c in chunks])
+            for k in order}
+
+def parse_file(path, start_tstamp, end_tstamp, cache_dir=None):
+    """Retrieve hardware information and columns for a raw collectl file, using cached results.
+    """
+    cache_file = _cache_file(path, cache_dir, start_tstamp, end_tstamp) if cache_dir else None
+    if cache_file:
+        cached = _read_cache(cache_file)
+        if cached:
+            return cached
+    hardware = {}
+    chunks = []
+    for hardware, chunk in iter_chunks(path, start_tstamp, end_tstamp):
+        chunks.append(chunk)
+    cols = _concat_chunks(chunks)
+    if cache_file:
+        _write_cache(cache_file, hardware, cols)
+    return hardware, cols
+
+def load_collectl(pattern, start_time, end_time, cache_dir=None):
     """Read data from collectl data files into a pandas DataFrame.
         :pattern: Absolute path to raw collectl files
+        :cache_dir: Optional directory to cache parsed columns
     """
     start_tstamp = calendar.timegm(start_time.utctimetuple())
     end_tstamp = calendar.timegm(end_time.utctimetuple())
-
-    cols = []
-    rows = []
-
-    for path in glob.glob(pattern):
-        hardware, raw = _parse_raw(
-            _CollectlGunzip(path, 'r'), start_tstamp, end_tstamp)
-
-        if not cols:
-            instances = {
-                'disk': set(),
-                'net': set(),
-                'proc': set(),
-            }
-            for tstamp, sample in raw.items():
-                for group, items in sample.items():
-                    if group == 'disk':
-                        instances['disk'] = instances['disk'].union(
-                            items.keys())
-                    elif group == 'net':
-                        instances['net'] = instances['net'].union(
-                            items.keys())
-                    elif group == 'proc':
-                        instances['proc'] = instances['proc'].union(
-                            items.keys())
-
-            cols = ['tstamp']
-            cols.extend([
-                'cpu_{}'.format(var)
-                for var
-                 in ['user', 'nice', 'sys', 'idle', 'wait',
-                     'irq', 'soft', 'steal']
-                 ])
-            for node in instances['disk']:
-                cols.extend([
-                    '{}_{}'.format(node, var)
-                    for var
-                     in ['num_reads', 'reads_merged',
-                         'sectors_read', 'msec_spent_reading',
-                         'num_writes', 'writes_merged',
-                         'sectors_written', 'msec_spent_writing',
-                         'iops_in_progress', 'msec_spent_on_iops',
-                         'weighted_msec_spent_on_iops']
-                     ])
-            cols.extend([
-                'mem_{}'.format(var)
-                for var
-                 in ['total', 'free', 'buffers', 'cached']
-                 ])
-            for iface in instances['net']:
-                cols.extend([
-                    '{}_{}'.format(iface, var)
-                    for var
-                     in ['rbyte', 'rpkt', 'rerr', 'rdrop',
-                         'rfifo', 'rframe', 'rcomp', 'rmulti',
-                         'tbyte', 'tpkt', 'terr', 'tdrop',
-                         'tfifo', 'tcoll', 'tcarrier', 'tcomp']
-                     ])
-            for pid in instances['proc']:
-                cols.extend([
-                    '{}_{}'.format(pid, var)
-                    for var
-                     in ['name', 'read_bytes', 'write_bytes']
-                     ])
-
-        for tstamp, sample in raw.items():
-            if ('cpu' not in sample or
-                'disk' not in sample or
-                'mem' not in sample):
-                # Skip incomplete samples; there might be a truncated
-                # sample on the end of the file.
-                continue
-
-            values = [tstamp]
-            values.extend([
-                sample['cpu']['user'], sample['cpu']['nice'],
-                sample['cpu']['sys'], sample['cpu']['idle'],
-                sample['cpu']['wait'], sample['cpu']['irq'],
-                sample['cpu']['soft'], sample['cpu']['steal'],
-            ])
-            for node in instances['disk']:
-                data = sample['disk'].get(node, {})
-                values.extend([
-                    data.get('num_reads', 0),
-                    data.get('reads_merged', 0),
-                    data.get('sectors_read', 0),
-                    data.get('msec_spent_reading', 0),
-                    data.get('num_writes', 0),
-                    data.get('writes_merged', 0),
-                    data.get('sectors_written', 0),
-                    data.get('msec_spent_writing', 0),
-                    data.get('iops_in_progress', 0),
-                    data.get('msec_spent_on_iops', 0),
-                    data.get('weighted_msec_spent_on_iops', 0),
-                ])
-            values.extend([
-                sample['mem']['total'], sample['mem']['free'],
-                sample['mem']['buffers'], sample['mem']['cached'],
-            ])
-            for iface in instances['net']:
-                data = sample['net'].get(iface, {})
-                values.extend([
-                    data.get('rbyte', 0), data.get('rpkt', 0),
-                    data.get('rerr', 0), data.get('rdrop', 0),
-                    data.get('rfifo', 0), data.get('rframe', 0),
-                    data.get('rcomp', 0), data.get('rmulti', 0),
-                    data.get('tbyte', 0), data.get('tpkt', 0),
-                    data.get('terr', 0), data.get('tdrop', 0),
-                    data.get('tfifo', 0), data.get('tcoll', 0),
-                    data.get('tcarrier', 0), data.get('tcomp', 0),
-                ])
-            if 'proc' in sample:
-                for pid in instances['proc']:
-                    data = sample['proc'].get(pid, {})
-                    values.extend([
-                        data.get('cmd', ''),
-                        data.get('read_bytes', 0),
-                        data.get('write_bytes', 0),
-                    ])
-
-            rows.append(values)
-
-    if len(rows) == 0:
-        return pd.DataFrame(columns=cols), {}
-
-    df = pd.DataFrame(rows, columns=cols)
-    df = df.convert_objects(convert_numeric=True)
-    df['tstamp'] = df['tstamp'].astype('datetime64[s]')
-    df.set_index('tstamp', inplace=True)
-    df = df.tz_localize('UTC')
-
+    hardware = {}
+    chunks = []
+    for path in sorted(glob.glob(pattern)):
+        cur_hardware, cols = parse_file(path, start_tstamp, end_tstamp, cache_dir)
+        hardware = hardware or cur_hardware
+        chunks.append(cols)
+    df = to_frame(chunks)
+    if len(df) == 0:
+        return df, {}
     return df, hardware
@@ -1,6 +1,8 @@
 from __future__ import print_function
 
+from concurrent import futures
 from datetime import datetime
+import calendar
 import collections
 import functools
 import os
@@ -9,11 +11,10 @@ import pytz
 import re
 import socket
 
-import pandas as pd
 import pickle
 
 from bcbio import utils
-from bcbio.graph.collectl import load_collectl
+from bcbio.graph import collectl
 
 mpl = utils.LazyImport("matplotlib")
 plt = utils.LazyImport("matplotlib.pyplot")
@@ -316,7 +317,7 @@ def rawfile_within_timeframe(rawfile, timeframe):
     return ftime.date() >= timeframe[0].date() and ftime.date() <= timeframe[1].date()
 
 
-def resource_usage(bcbio_log, cluster, rawdir, verbose):
+def resource_usage(bcbio_log, cluster, rawdir, verbose, cores=1, cache_dir=None):
     """Generate system statistics from bcbio runs.
 
     Parse the obtained files and put the information in
@@ -326,6 +327,9 @@ def resource_usage(bcbio_log, cluster, rawdir, verbose):
     :param cluster:
     :param rawdir:      directory to put raw data files
     :param verbose:     increase verbosity
+    :param cores:       number of raw files to parse in parallel
+    :param cache_dir:   directory to cache parsed raw files, defaults to
+                        a parsed subdirectory of rawdir
 
     :return: a tuple with three dictionaries, the first one contains
              an instance of :pandas.DataFrame: for each host, the second one
@@ -336,31 +340,41 @@ def resource_usage(bcbio_log, cluster, rawdir, verbose):
     data_frames = {}
     hardware_info = {}
     time_frame = log_time_frame(bcbio_log)
-
-    for collectl_file in sorted(os.listdir(rawdir)):
-        if not collectl_file.endswith('.raw.gz'):
+    start_tstamp = calendar.timegm(time_frame.start.utctimetuple())
+    end_tstamp = calendar.timegm(time_frame.end.utctimetuple())
+    if cache_dir is None:
+        cache_dir = os.path.join(rawdir, "parsed")
+
+    # Only load filenames within sampling timerange (gathered from bcbio_log time_frame)
+    collectl_files = [x for x in sorted(os.listdir(rawdir))
+                      if x.endswith('.raw.gz') and rawfile_within_timeframe(x, time_frame)]
+    parse_fn = functools.partial(_parse_collectl_file, rawdir=rawdir, start_tstamp=start_tstamp,
+                                 end_tstamp=end_tstamp, cache_dir=cache_dir)
+    if cores > 1 and len(collectl_files) > 1:
+        with futures.ProcessPoolExecutor(cores) as executor:
+            parsed = list(executor.map(parse_fn, collectl_files))
+    else:
+        parsed = [parse_fn(x) for x in collectl_files]
+
+    by_host = collections.OrderedDict()
+    for collectl_file, (hardware, cols) in zip(collectl_files, parsed):
+        if cols is None:
+            # No data present in collectl file, mismatch in timestamps between raw collectl and log file
+            if verbose:
+                print("No data within run time frame in {}".format(collectl_file))
             continue
-
-        # Only load filenames within sampling timerange (gathered from bcbio_log time_frame)
-        if rawfile_within_timeframe(collectl_file, time_frame):
-
-            collectl_path = os.path.join(rawdir, collectl_file)
-            data, hardware = load_collectl(
-                collectl_path, time_frame.start, time_frame.end)
-
-            if len(data) == 0:
-                #raise ValueError("No data present in collectl file %s, mismatch in timestamps between raw collectl and log file?", collectl_path)
-                continue
-
-            host = re.sub(r'-\d{8}-\d{6}\.raw\.gz$', '', collectl_file)
-            hardware_info[host] = hardware
-            if host not in data_frames:
-                data_frames[host] = data
-            else:
-                data_frames[host] = pd.concat([data_frames[host], data])
+        host = re.sub(r'-\d{8}-\d{6}\.raw\.gz$', '', collectl_file)
+        hardware_info[host] = hardware
+        by_host.setdefault(host, []).append(cols)
+    for host, chunks in by_host.items():
+        data_frames[host] = collectl.to_frame(chunks)
 
     return (data_frames, hardware_info, time_frame.steps)
 
+def _parse_collectl_file(collectl_file, rawdir, start_tstamp, end_tstamp, cache_dir):
+    return collectl.parse_file(os.path.join(rawdir, collectl_file), start_tstamp, end_tstamp,
+                               cache_dir)
+
 
 def generate_graphs(data_frames, hardware_info, steps, outdir,
                     verbose=False):
@@ -434,6 +448,16 @@ def serialize_plot_data(collectl_info, pre_graph_info, outdir, fname="collectl_i
         with gzip.open(collectl_pickle, "wb") as f:
             pickle.dump((collectl_info, pre_graph_info), f)
 
+def bootstrap(args):
+    """Parse collectl data from a bcbio run and generate resource usage graphs.
+    """
+    rawdir = os.path.abspath(args.rawdir)
+    outdir = utils.safe_makedir(os.path.abspath(args.outdir))
+    data_frames, hardware_info, steps = resource_usage(args.log, None, rawdir, args.verbose,
+                                                       cores=args.cores)
+    collectl_info = generate_graphs(data_frames, hardware_info, steps, outdir, verbose=args.verbose)
+    serialize_plot_data(collectl_info, (data_frames, hardware_info, steps), outdir)
+
 def add_subparser(subparsers):
     parser = subparsers.add_parser(
         "graph",
@@ -448,6 +472,9 @@ def add_subparser(subparsers):
     parser.add_argument(
         "-r", "--rawdir", default="monitoring/collectl", required=True,
         help="Directory to put raw collectl data files.")
+    parser.add_argument(
+        "-n", "--cores", type=int, default=1,
+        help="Number of raw collectl files to parse in parallel.")
     parser.add_argument(
         "-v", "--verbose", action="store_true", default=False,
         help="Emit verbose output")
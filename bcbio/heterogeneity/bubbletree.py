@@ -21,7 +21,7 @@ from bcbio.pipeline import datadict as dd
 from bcbio.provenance import do
 from bcbio.heterogeneity import chromhacks
 from bcbio.structural import shared
-from bcbio.variation import bedutils
+from bcbio.variation import bedutils, vcfarrays
 
 population_keys = ['AC_AFR', 'AC_AMR', 'AC_EAS', 'AC_FIN', 'AC_NFE', 'AC_OTH', 'AC_SAS']
 PARAMS = {"min_freq": 0.2,
@@ -140,16 +140,19 @@ def prep_vrn_file(in_file, vcaller, work_dir, somatic_info, writer_class, seg_fi
             sub_file = _create_subset_file(in_file, ready_bed, work_dir, data)
         else:
             sub_file = in_file
-        max_depth = max_normal_germline_depth(sub_file, params, somatic_info)
+        calls, freqs = _load_tumor_normal(sub_file, somatic_info)
+        is_loh = _possible_loh(calls, freqs, params)
+        max_depth = _max_normal_depth(freqs, is_loh)
+        if max_depth:
+            is_loh &= ~(freqs["normal"]["depth"] > max_depth)
+        is_loh &= _is_autosomal(calls)
+        idx = np.flatnonzero(is_loh)
         with file_transaction(data, out_file) as tx_out_file:
             with open(tx_out_file, "w") as out_handle:
                 writer = writer_class(out_handle)
                 writer.write_header()
-                bcf_in = pysam.VariantFile(sub_file)
-                for rec in bcf_in:
-                    stats = _is_possible_loh(rec, bcf_in, params, somatic_info, max_normal_depth=max_depth)
-                    if chromhacks.is_autosomal(rec.chrom) and stats is not None:
-                        writer.write_row(rec, stats)
+                for i, rec in zip(idx, vcfarrays.sites(calls, idx)):
+                    writer.write_row(rec, _stats_at(freqs, i))
     return out_file
 
 
@@ -162,13 +165,13 @@ NORMAL_FILTER_PARAMS = {"min_depth_percent": 0.5, "max_depth_percent": 1.5,
 def max_normal_germline_depth(in_file, params, somatic_info):
     """Calculate threshold for excluding potential heterozygotes based on normal depth.
     """
-    bcf_in = pysam.VariantFile(in_file)
-    depths = []
-    for rec in bcf_in:
-        stats = _is_possible_loh(rec, bcf_in, params, somatic_info)
-        if tz.get_in(["normal", "depth"], stats):
-            depths.append(tz.get_in(["normal", "depth"], stats))
-    if depths:
+    calls, freqs = _load_tumor_normal(in_file, somatic_info)
+    return _max_normal_depth(freqs, _possible_loh(calls, freqs, params))
+
+def _max_normal_depth(freqs, is_loh):
+    depths = freqs["normal"]["depth"][is_loh]
+    depths = depths[~np.isnan(depths) & (depths != 0)]
+    if len(depths) > 0:
         return np.median(depths) * NORMAL_FILTER_PARAMS["max_depth_percent"]
 
 def _identify_heterogeneity_blocks_seg(in_file, seg_file, params, work_dir, somatic_info):
@@ -248,26 +251,18 @@ def _predict_states(freqs):
 def _freqs_by_chromosome(in_file, params, somatic_info):
     """Retrieve frequencies across each chromosome as inputs to HMM.
     """
-    freqs = []
-    coords = []
-    cur_chrom = None
-    with pysam.VariantFile(in_file) as bcf_in:
-        for rec in bcf_in:
-            if _is_biallelic_snp(rec) and _passes_plus_germline(rec) and chromhacks.is_autosomal(rec.chrom):
-                if cur_chrom is None or rec.chrom != cur_chrom:
-                    if cur_chrom and len(freqs) > 0:
-                        yield cur_chrom, freqs, coords
-                    cur_chrom = rec.chrom
-                    freqs = []
-                    coords = []
-                stats = _tumor_normal_stats(rec, somatic_info)
-                if tz.get_in(["tumor", "depth"], stats, 0) > params["min_depth"]:
-                    # not a ref only call
-                    if len(rec.samples) == 0 or sum(rec.samples[somatic_info.tumor_name].allele_indices) > 0:
-                        freqs.append(tz.get_in(["tumor", "freq"], stats))
-                        coords.append(rec.start)
-        if cur_chrom and len(freqs) > 0:
-            yield cur_chrom, freqs, coords
+    calls, freqs = _load_tumor_normal(in_file, somatic_info)
+    keep = (vcfarrays.is_biallelic_snp(calls) & _passes_plus_germline_arrays(calls) & _is_autosomal(calls) &
+            (freqs["tumor"]["depth"] > params["min_depth"]))
+    # not a ref only call
+    gt_col = "%s:GT" % somatic_info.tumor_name
+    if calls.attrs["has_samples"]:
+        keep &= calls[gt_col].str.contains("[1-9]").eq(True).values if gt_col in calls else False
+    calls = calls[keep]
+    tumor_freqs = freqs["tumor"]["freq"][keep]
+    for chrom in calls["CHROM"].unique():
+        cur = (calls["CHROM"] == chrom).values
+        yield chrom, tumor_freqs[cur].tolist(), (calls["POS"].values[cur] - 1).tolist()
 
 def _create_subset_file(in_file, het_region_bed, work_dir, data):
     """Subset the VCF to a set of pre-calculated smaller regions.
@@ -325,6 +320,75 @@ def _is_snp(rec):
     else:
         return max([len(x) for x in rec.alleles]) == 1
 
+def _load_tumor_normal(in_file, somatic_info):
+    """Load calls with depths and frequencies of tumor and normal samples as arrays.
+
+    Frequencies mirror _tumor_normal_stats: missing normal values are NaN, and
+    missing tumor values have an alt count and depth of 0 and NaN frequency.
+    """
+    data = somatic_info.tumor_data
+    calls = vcfarrays.load(in_file, info=["DP", "AF"] + population_keys, formats=["AD", "AO", "RO", "GT"],
+                           samples=[somatic_info.tumor_name, somatic_info.normal_name],
+                           cores=dd.get_num_cores(data), config=data["config"])
+    with pysam.VariantFile(in_file) as bcf_in:
+        calls.attrs["has_samples"] = len(bcf_in.header.samples) > 0
+        calls.attrs["has_population"] = _has_population_germline(bcf_in)
+    freqs = {"normal": {}, "tumor": {}}
+    for key, name in [("normal", somatic_info.normal_name), ("tumor", somatic_info.tumor_name)]:
+        if name in calls.attrs["samples"] or (key == "tumor" and not calls.attrs["has_samples"]):
+            alt, depth, freq = vcfarrays.alt_and_depth(calls, name)
+        else:
+            alt, depth, freq = [np.full(len(calls), np.nan) for _ in range(3)]
+        has_stats = ~np.isnan(depth) & ~np.isnan(freq)
+        missing = 0 if key == "tumor" else np.nan
+        freqs[key] = {"alt": np.where(has_stats, alt, missing), "depth": np.where(has_stats, depth, missing),
+                      "freq": np.where(has_stats, freq, np.nan)}
+    return calls, freqs
+
+def _stats_at(freqs, i):
+    """Retrieve tumor and normal statistics for a single record, matching _tumor_normal_stats.
+    """
+    out = {}
+    for key in ["normal", "tumor"]:
+        alt, depth, freq = [freqs[key][x][i] for x in ["alt", "depth", "freq"]]
+        out[key] = {"alt": None if np.isnan(alt) else int(alt),
+                    "depth": None if np.isnan(depth) else int(depth),
+                    "freq": None if np.isnan(freq) else float(freq)}
+    return out
+
+def _is_autosomal(calls):
+    autosomal = dict((c, chromhacks.is_autosomal(c)) for c in calls["CHROM"].unique())
+    return calls["CHROM"].map(autosomal).eq(True).values
+
+def _passes_plus_germline_arrays(calls):
+    return vcfarrays.passes_filters(calls, ["PASS", "REJECT"])
+
+def _possible_loh(calls, freqs, params):
+    """Identify records that are hets in the normal with sufficient support.
+
+    Vectorized version of _is_possible_loh, without germline status checks.
+    """
+    normal, tumor = freqs["normal"], freqs["tumor"]
+    out = vcfarrays.is_biallelic_snp(calls) & _passes_plus_germline_arrays(calls)
+    out &= (np.isnan(normal["depth"]) | (normal["depth"] > params["min_depth"])) & (tumor["depth"] > params["min_depth"])
+    has_normal = ~np.isnan(normal["freq"])
+    normal_ok = has_normal & (normal["freq"] >= params["min_freq"]) & (normal["freq"] <= params["max_freq"])
+    tumor_ok = (~has_normal & (tumor["freq"] >= params["tumor_only"]["min_freq"]) &
+                (tumor["freq"] <= params["tumor_only"]["max_freq"]))
+    if calls.attrs["has_population"]:
+        tumor_ok &= _is_population_germline_arrays(calls)
+    return out & (normal_ok | tumor_ok)
+
+def _is_population_germline_arrays(calls):
+    min_count = 50
+    out = np.zeros(len(calls), dtype=bool)
+    for k in population_keys:
+        if k in calls:
+            counts = vcfarrays.values(calls[k])
+            with np.errstate(invalid="ignore"):
+                out |= np.nanmax(np.where(np.isnan(counts), -np.inf, counts), axis=1) > min_count
+    return out
+
 def _tumor_normal_stats(rec, somatic_info, vcf_rec):
     """Retrieve depth and frequency of tumor and normal samples.
     """
@@ -6,11 +6,12 @@ import csv
 import collections
 import os
 import decimal
+import re
 import uuid
 
+import dateutil.parser
 import pandas as pd
 import six
-from six import StringIO
 import toolz as tz
 import yaml
 
@@ -171,264 +172,185 @@ def are_overlapping(r, s):
     return r[1] >= s[0] and s[1] >= r[0]
 
 # ## EDN parser
-# Thanks to https://github.com/sunng87/pyclj
-# Slightly adapter to avoid external dependencies
+# Reads validation and bcbio.variation outputs without external dependencies.
+# Buffered blocks of input split into tokens with a regular expression scanner,
+# and an explicit stack builds collections so deeply nested forms do not hit
+# recursion limits. Supports the EDN used by bcbio: collections, namespaced
+# maps, keywords (returned as strings without the leading colon), strings,
+# characters, numbers, booleans, nil, comments and #inst, #uuid and #_ tags.
+
+EDN_BLOCKSIZE = 1024 * 1024
+# Characters past a token needed to be sure it is complete, as in \newline
+_EDN_LOOKAHEAD = 16
+
+# Whitespace, commas and comments followed by a single token: atoms (numbers,
+# keywords, symbols, nil, true, false), collection openers and closers,
+# strings, tags, characters, or an error token. Strings, tags and tokens cut
+# by the end of input match up to the end, and an empty token marks the end.
+_EDN_TOKEN_RE = re.compile(r"""
+    ([\s,]*(?:;[^\n]*[\s,]*)*)
+    ([^\s,()\[\]{}"\;\#][^\s,()\[\]{}";]*
+     |[\[({\])}]
+     |"(?:[^"\\]|\\.)*(?:"|\\?\Z)
+     |\#(?::[^\s,{]*)?\{|\#[^\s,()\[\]{}"]*
+     |\\(?:newline|space|tab|return|u[0-9a-fA-F]{4}|.)
+     |[^\s,;]|\Z)""", re.VERBOSE | re.DOTALL)
+_EDN_ESCAPE_RE = re.compile(r"\\(u[0-9a-fA-F]{4}|.)", re.DOTALL)
+_EDN_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+_EDN_CHARS = {"newline": "\n", "space": " ", "tab": "\t", "return": "\r"}
+_EDN_CONSTANTS = {"nil": None, "true": True, "false": False}
+_EDN_CLOSERS = {"(": ")", "[": "]"}
+
+def _edn_token_blocks(fp, blocksize=EDN_BLOCKSIZE):
+    """Split EDN input into lists of tokens, scanning blocks of blocksize characters.
+
+    Every position of the input starts a match, so matches are contiguous and
+    tokens near the end of a block, which may continue in the next block, are
+    held back by length.
+    """
+    buf = ""
+    eof = False
+    while not eof:
+        block = fp.read(blocksize)
+        eof = not block
+        buf += block
+        matches = _EDN_TOKEN_RE.findall(buf)
+        n = len(matches)
+        held = 0
+        if not eof:
+            while n > 0 and held < _EDN_LOOKAHEAD:
+                n -= 1
+                held += len(matches[n][0]) + len(matches[n][1])
+        tokens = [tok for _, tok in matches[:n]]
+        while tokens and not tokens[-1]:
+            tokens.pop()
+        yield tokens
+        buf = buf[len(buf) - held:] if held else ""
+
+def _edn_unescape(m):
+    c = m.group(1)
+    if c.startswith("u") and len(c) == 5:
+        return six.unichr(int(c[1:], 16))
+    return _EDN_ESCAPES.get(c, c)
+
+def _edn_atom(tok):
+    c = tok[0]
+    if c == '"':
+        if len(tok) < 2 or tok[-1] != '"' or (len(tok) - len(tok[:-1].rstrip("\\"))) % 2 == 0:
+            raise ValueError("Unexpected EOF in string: %s" % tok[:50])
+        return _EDN_ESCAPE_RE.sub(_edn_unescape, tok[1:-1]) if "\\" in tok else tok[1:-1]
+    elif c == "\\":
+        c = tok[1:]
+        if not c:
+            raise ValueError("Unexpected EOF in character")
+        elif c in _EDN_CHARS:
+            return _EDN_CHARS[c]
+        return six.unichr(int(c[1:], 16)) if len(c) == 5 and c.startswith("u") else c
+    elif tok in _EDN_CONSTANTS:
+        return _EDN_CONSTANTS[tok]
+    elif c.isdigit() or (len(tok) > 1 and c in "-+" and tok[1].isdigit()):
+        return _number(tok)
+    return tok
+
+def _edn_collection(opener, items, closer):
+    if _EDN_CLOSERS.get(opener, "}") != closer:
+        raise ValueError("Unexpected %s closing %s" % (closer, opener))
+    if opener in _EDN_CLOSERS:
+        return items
+    elif opener == "#{":
+        try:
+            return set(items)
+        except TypeError:
+            return tuple(items)
+    if len(items) % 2:
+        raise ValueError("Map with an odd number of forms: %s" % items[:10])
+    namespace = opener[2:-1] if opener.startswith("#:") else None
+    keys = ["%s/%s" % (namespace, k) for k in items[::2]] if namespace else items[::2]
+    return dict(zip(keys, items[1::2]))
+
+def _edn_tagged(tag, v):
+    if tag == "#inst":
+        return dateutil.parser.isoparse(v)
+    elif tag == "#uuid":
+        return uuid.UUID(v)
+    return v
+
+def _edn_forms(token_blocks):
+    """Build top level forms from lists of tokens.
+    """
+    # Open collections as (opener, items) and pending tags as (tag, None), with
+    # cur the items of the innermost collection unless a tag is pending
+    stack = []
+    cur = None
+    for tokens in token_blocks:
+        for tok in tokens:
+            c = tok[0]
+            if c == ":":
+                v = tok[1:]
+            elif c in "[({":
+                cur = []
+                stack.append((tok, cur))
+                continue
+            elif c in ")]}":
+                if cur is None:
+                    raise ValueError("Unexpected %s" % tok)
+                opener, items = stack.pop()
+                v = _edn_collection(opener, items, tok)
+                cur = stack[-1][1] if stack else None
+            elif c == "#":
+                if tok[-1] == "{":
+                    cur = []
+                elif len(tok) > 1 and tok[1] != ":":
+                    cur = None
+                else:
+                    raise ValueError("Unexpected EDN input: %s" % tok)
+                stack.append((tok, cur))
+                continue
+            else:
+                v = _edn_atom(tok)
+            if cur is not None:
+                cur.append(v)
+                continue
+            discard = False
+            while stack and stack[-1][1] is None:
+                tag = stack.pop()[0]
+                if tag == "#_":
+                    discard = True
+                    break
+                v = _edn_tagged(tag, v)
+            cur = stack[-1][1] if stack else None
+            if not discard:
+                if cur is not None:
+                    cur.append(v)
+                else:
+                    yield v
+    if stack:
+        raise ValueError("Unexpected EOF")
+
+def _edn_first(forms):
+    for v in forms:
+        return v
+    raise ValueError("Unexpected EOF")
+
+def edn_iter(fp, blocksize=EDN_BLOCKSIZE):
+    """Stream top level EDN forms from a file handle.
+    """
+    return _edn_forms(_edn_token_blocks(fp, blocksize))
 
 def edn_load(fp):
-    decoder = CljDecoder(fp)
-    return decoder.decode()
+    """Read the first EDN form from a file handle.
+    """
+    return _edn_first(edn_iter(fp))
 
 def edn_loads(s):
-    buf = StringIO(s)
-    result = edn_load(buf)
-    buf.close()
-    return result
+    return _edn_first(_edn_forms([[tok for _, tok in _EDN_TOKEN_RE.findall(s) if tok]]))
 
 def _number(v):
     if v.endswith('M'):
         out = decimal.Decimal(v[:-1])
     else:
         try:
-            out = int(v)
+            out = int(v[:-1] if v.endswith('N') else v)
         except ValueError as e:
             out = float(v)
     return out
-
-
-_STOP_CHARS = [" ", ",", "\n", "\r", "\t"]
-_COLL_OPEN_CHARS = ["#", "[", "{", "("]
-_COLL_CLOSE_CHARS = ["]", "}", ")"]
-_EXTRA_NUM_CHARS = ["-", "+", ".", "e", "E", "M"]
-
-class CljDecoder(object):
-    def __init__(self, fd):
-        self.fd = fd
-        self.cur_line = 1
-        self.cur_pos = 1
-        self.value_stack = []
-        self.terminator = None ## for collection type
-
-    def decode(self):
-        while True:
-            v = self.__read_token()
-            if len(self.value_stack) == 0:
-                return v
-
-    def __seek_back(self, size):
-        self.fd.seek(self.fd.tell()-size, 0)
-
-    def __read_and_back(self, size):
-        s = self.fd.read(size)
-        self.__seek_back(size)
-        return s
-
-    def __get_type_from_char(self, c):
-        """return a tuple of type information
-        * type name
-        * a flag to indicate if it's a collection
-        """
-        if c.isdigit() or c =='-':
-            return ("number", False, None)
-        elif c == 't' or c == 'f': ## true/false
-            return ("boolean", False, None)
-        elif c == 'n': ## nil
-            return ("nil", False, None)
-        elif c == '\\' :
-            return ("char", False, None)
-        elif c == ':':
-            return ("keyword", False, None)
-        elif c == '"':
-            return ("string", False, None)
-        elif c == '#':
-            if self.__read_and_back(1) == '{':
-                return ("set", True, "}")
-            if self.__read_and_back(1) == ':':
-                return ("namespaced_dict", True, "}")
-            if self.__read_and_back(4) == 'inst':
-                return ("datetime", False, None)
-            if self.__read_and_back(4) == 'uuid':
-                return ("uuid", False, None)
-        elif c == '{':
-            return ("dict", True, "}")
-        elif c == '(':
-            return ("list", True, ")")
-        elif c == '[':
-            return ('list', True, "]")
-
-        return (None, False, None)
-
-    def __read_fd(self, size):
-        if size == 1:
-            c = self.fd.read(size)
-            if  c == '\n':
-                self.cur_pos = 0
-                self.cur_line = self.cur_line + 1
-            return c
-        else:
-            self.cur_pos = self.cur_pos + size
-            cs = self.fd.read(size)
-            return cs
-
-    def __read_token(self):
-        c = self.__read_fd(1)
-
-        ## skip all stop chars if necessary
-        while c in _STOP_CHARS:
-            c = self.__read_fd(1)
-
-        ## raise exception when unexpected EOF found
-        if c == '':
-            raise ValueError("Unexpected EOF")
-
-        t, coll, term = self.__get_type_from_char(c)
-        if coll:
-            ## move cursor
-            if t == "set":
-                ## skip {
-                self.__read_fd(1)
-            namespace = None
-            if t == "namespaced_dict":
-                ## skip :
-                self.__read_fd(1)
-                ## get namespace
-                buf = []
-                while c != '{':
-                    c = self.__read_fd(1)
-                    buf.append(c)
-                namespace = ''.join(buf[:-1])
-
-            self.terminator = term
-
-            self.value_stack.append(([], self.terminator, t, namespace))
-            return None
-        else:
-            v = None ## token value
-            e = None ## end char
-            r = True ## the token contains data or not
-
-            if t == "boolean":
-                if c == 't':
-                    chars = self.__read_fd(4)
-                    if chars[:3] != 'rue':
-                        raise ValueError('Expect true, got t%s at line %d, col %d' % (chars[:3], self.cur_line, self.cur_pos))
-                    e = chars[-1]
-                    v = True
-                else:
-                    chars = self.__read_fd(5)
-                    if chars[:4] != 'alse':
-                        raise ValueError('Expect true, got t%s at line %d, col %d' % (chars[:3], self.cur_line, self.cur_pos))
-                    e = chars[-1]
-                    v = False
-
-            elif t == "char":
-                buf = []
-                while c is not self.terminator and c != "" and c not in _STOP_CHARS:
-                    c = self.__read_fd(1)
-                    buf.append(c)
-
-                e = c
-                v = ''.join(buf[:-1])
-
-            elif t == "nil":
-                chars = self.__read_fd(3)
-                if chars[:2] != 'il':
-                    raise ValueError('Expect nil, got n%s at line %d, col %d' % (chars[:2], self.cur_line, self.cur_pos))
-                e = chars[-1]
-                v = None
-
-            elif t == "number":
-                buf = []
-                while c.isdigit() or (c in _EXTRA_NUM_CHARS):
-                    buf.append(c)
-                    c = self.__read_fd(1)
-                e = c
-                numstr = ''.join(buf)
-                v = _number(numstr)
-
-                ## special case for
-                ## [23[12]]
-                ## this is a valid clojure form
-                if e in _COLL_OPEN_CHARS:
-                    self.__seek_back(1)
-
-            elif t == "keyword":
-                buf = []    ##skip the leading ":"
-                while c is not self.terminator and c != "" and c not in _STOP_CHARS:
-                    c = self.__read_fd(1)
-                    buf.append(c)
-
-                e = c
-                v = ''.join(buf[:-1])
-
-            elif t == "string":
-                buf = []
-                cp = c = self.__read_fd(1) ## to check escaping character \
-
-                while not(c == '"' and cp != '\\'):
-                    buf.append(c)
-                    cp = c
-                    c = self.__read_fd(1)
-                e = c
-                v = unicode(''.join(buf).decode('unicode-escape'))
-
-            elif t == "datetime":
-                ## skip "inst"
-                self.__read_fd(4)
-
-                ## read next value as string
-                s = self.__read_token()
-                if not isinstance(s, six.string_types):
-                    raise ValueError('Str expected, but got %s' % str(s))
-
-                ## remove read string from the value_stack
-                if len(self.value_stack) > 0:
-                    self.value_stack[-1][0].pop()
-                e = '"'
-                v = pyrfc3339.parse(s)
-
-            elif t == "uuid":
-                ## skip "uuid"
-                self.__read_fd(4)
-
-                ## read next value as string
-                s = self.__read_token()
-                if not isinstance(s, six.string_types):
-                    raise ValueError('Str expected, but got %s' % str(s))
-
-                ## remove read string from the value_stack
-                if len(self.value_stack) > 0:
-                    self.value_stack[-1][0].pop()
-                e = '"'
-                v = uuid.UUID(s)
-
-            else:
-                if c not in _COLL_CLOSE_CHARS:
-                    raise ValueError('Unexpected char: "%s" at line %d, col %d' % (c, self.cur_line, self.cur_pos))
-                r = False
-                e = c
-
-            if e == self.terminator:
-                current_scope, _, container, namespace = self.value_stack.pop()
-
-                if r:
-                    current_scope.append(v)
-
-                if container == "set":
-                    try:
-                        v = set(current_scope)
-                    except TypeError:
-                        v = tuple(current_scope)
-                elif container == "list":
-                    v = current_scope
-                elif container in ["dict", "namespaced_dict"]:
-                    v = {}
-                    for i in range(0, len(current_scope), 2):
-                        key = '%s/%s' % (namespace, current_scope[i]) if namespace else current_scope[i]
-                        v[key] = current_scope[i+1]
-                r = True
-
-            if r and len(self.value_stack) > 0:
-                self.value_stack[-1][0].append(v)
-                self.terminator = self.value_stack[-1][1]
-
-            return v
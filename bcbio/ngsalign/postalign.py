@@ -14,6 +14,7 @@ import toolz as tz
 
 from bcbio import bam, broad, utils
 from bcbio.bam import ref
+from bcbio.bam import stats as bamstats
 from bcbio.distributed.transaction import file_transaction, tx_tmpdir
 from bcbio.log import logger
 from bcbio.pipeline import config_utils
@@ -33,23 +34,28 @@ def tobam_cl(data, out_file, is_paired=False):
     - If no deduplication, sort and prepare a BAM file.
     - If paired, then use samblaster and prepare discordant outputs.
     - If unpaired, use biobambam's bammarkduplicates
+
+    When used downstream, all approaches first sample aligned reads for read length
+    and insert size statistics.
     """
     do_dedup = _check_dedup(data)
     umi_consensus = dd.get_umi_consensus(data)
+    bamstats.reset_stream(out_file)
+    sample_cl = bamstats.stream_cl(out_file) + " | " if _need_align_stats(data) else ""
     with file_transaction(data, out_file) as tx_out_file:
         if not do_dedup:
-            yield (sam_to_sortbam_cl(data, tx_out_file), tx_out_file)
+            yield (sample_cl + sam_to_sortbam_cl(data, tx_out_file), tx_out_file)
         elif umi_consensus:
-            yield (_sam_to_grouped_umi_cl(data, umi_consensus, tx_out_file), tx_out_file)
+            yield (sample_cl + _sam_to_grouped_umi_cl(data, umi_consensus, tx_out_file), tx_out_file)
         elif is_paired and _need_sr_disc_reads(data) and not _too_many_contigs(dd.get_ref_file(data)):
             sr_file = "%s-sr.bam" % os.path.splitext(out_file)[0]
             disc_file = "%s-disc.bam" % os.path.splitext(out_file)[0]
             with file_transaction(data, sr_file) as tx_sr_file:
                 with file_transaction(data, disc_file) as tx_disc_file:
-                    yield (samblaster_dedup_sort(data, tx_out_file, tx_sr_file, tx_disc_file),
+                    yield (sample_cl + samblaster_dedup_sort(data, tx_out_file, tx_sr_file, tx_disc_file),
                            tx_out_file)
         else:
-            yield (_biobambam_dedup_sort(data, tx_out_file), tx_out_file)
+            yield (sample_cl + _biobambam_dedup_sort(data, tx_out_file), tx_out_file)
 
 def _too_many_contigs(ref_file):
     """Check for more contigs than the maximum samblaster deduplication supports.
@@ -66,6 +72,15 @@ def _need_sr_disc_reads(data):
     from bcbio import structural
     return "lumpy" in structural.get_svcallers(data)
 
+def _need_align_stats(data):
+    """Check if we need read length and insert size statistics sampled during alignment.
+
+    Structural variant callers use insert sizes. Without them, we avoid adding a
+    Python sampling step to every alignment pipe.
+    """
+    from bcbio import structural
+    return len(structural.get_svcallers(data)) > 0
+
 def _get_cores_memory(data, downscale=2):
     """Retrieve cores and memory, using samtools as baseline.
 
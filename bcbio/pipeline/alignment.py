@@ -10,6 +10,7 @@ import toolz as tz
 
 from bcbio import bam, utils
 from bcbio.bam import cram
+from bcbio.bam import stats as bamstats
 from bcbio.ngsalign import (bbmap, bowtie, bwa, tophat, bowtie2, minimap2,
                             novoalign, snap, star, hisat2, bismark, bsmap)
 from bcbio.pipeline import datadict as dd
@@ -98,6 +99,7 @@ def align_to_sort_bam(fastq1, fastq2, aligner, data):
             extra_bam = utils.append_stem(data['work_bam'], extra)
             if utils.file_exists(extra_bam):
                 bam.index(extra_bam, data["config"])
+        data = dd.set_align_stats(data, bamstats.stream_summary(data["work_bam"]))
     return data
 
 def get_aligner_with_aliases(aligner, data):
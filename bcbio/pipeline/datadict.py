@@ -216,6 +216,7 @@ LOOKUPS = {
     "work_bam": {"keys": ["work_bam"]},
     "deduped_bam": {"keys": ["deduped_bam"]},
     "align_bam": {"keys": ["align_bam"]},
+    "align_stats": {"keys": ["align_stats"]},
     "disc_bam": {"keys": ["work_bam_plus", "disc"]},
     "sr_bam": {"keys": ["work_bam_plus", "sr"]},
     "peddy_report": {"keys": ["peddy_report"]},
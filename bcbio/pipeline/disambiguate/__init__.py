@@ -154,8 +154,9 @@ def _run_python(work_bam_a, work_bam_b, out_dir, aligner, prefix, items):
     """Run python version of disambiguation
     """
     Args = collections.namedtuple("Args", "A B output_dir intermediate_dir "
-                                    "no_sort prefix aligner")
-    args = Args(work_bam_a, work_bam_b, out_dir, out_dir, True, "", aligner)
+                                    "no_sort prefix aligner cores")
+    args = Args(work_bam_a, work_bam_b, out_dir, out_dir, True, "", aligner,
+                dd.get_num_cores(items[0]))
     disambiguate_main(args)
 
 def _run_cplusplus(work_bam_a, work_bam_b, out_dir, aligner, prefix, items):
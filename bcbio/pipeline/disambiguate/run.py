@@ -27,53 +27,69 @@ Included in bcbio-nextgen from: https://github.com/mjafin/disambiguate
 
 from __future__ import print_function
 import sys, re, pysam
+import contextlib
+import json
+import os
+import struct
+import subprocess
+import zlib
+from concurrent import futures
 from array import array
 from os import path, makedirs
 from argparse import ArgumentParser, RawTextHelpFormatter
 
+_NUM_RE = re.compile('([0-9]+)')
+
+def _natural_key(qname):
+    """Piecewise strings and numbers of a read name, for natural ordering.
+    """
+    return [int(c) if c.isdigit() else c for c in _NUM_RE.split(qname)]
+
 # "natural comparison" for strings
 def nat_cmp(a, b):
-    convert = lambda text: int(text) if text.isdigit() else text # lambda function to convert text to int if number present
-    alphanum_key = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ] # split string to piecewise strings and string numbers
-    #return cmp(alphanum_key(a), alphanum_key(b)) # use internal cmp to compare piecewise strings and numbers
-    return (alphanum_key(a) > alphanum_key(b))-(alphanum_key(a) < alphanum_key(b))
+    ka, kb = _natural_key(a), _natural_key(b)
+    return (ka > kb) - (ka < kb)
 
 # read reads into a list object for as long as the read qname is constant (sorted file). Return the first read with new qname or None
 def read_next_reads(fileobject, listobject):
-    qnamediff = False
-    while not qnamediff:
-        try:
-            myRead=next(fileobject)
-        except StopIteration:
-            #print("5")
-            return None # return None as the name of the new reads (i.e. no more new reads)
-        if nat_cmp(myRead.qname, listobject[0].qname)==0:
+    key = _natural_key(listobject[0].qname)
+    for myRead in fileobject:
+        if myRead.qname == listobject[-1].qname or _natural_key(myRead.qname) == key:
             listobject.append(myRead)
         else:
-            qnamediff = True
-    return myRead # this is the first read with a new qname
+            return myRead # this is the first read with a new qname
+    return None # return None as the name of the new reads (i.e. no more new reads)
 
-# disambiguate between two lists of reads
-def disambiguate(humanlist, mouselist, disambalgo):
+# ## Scoring
+
+def _read_scores(reads, disambalgo):
+    """Extract the tags used for scoring once per mapped read.
+
+    Returns tuples of read direction (0 for _1, 1 for _2) and tag values.
+    """
+    out = []
+    if disambalgo in ['tophat', 'hisat2']:
+        for read in reads:
+            if not read.is_unmapped:
+                out.append((0 if read.is_read1 else 1,
+                            read.get_tag('XO') + read.get_tag('NM') + read.get_tag('NH')))
+    else:
+        for read in reads:
+            if not read.is_unmapped:
+                tags = dict(read.get_tags())
+                out.append((0 if read.is_read1 else 1, tags.get('AS'), tags.get('NM'), tags.get('nM')))
+    return out
+
+def _score(humanscores, mousescores, disambalgo):
+    """Compare extracted scores for two species: 1 for human, -1 for mouse, 0 for ambiguous.
+    """
     if disambalgo in ['tophat','hisat2']:
         dv = 2**13 # a high quality score to replace missing quality scores (no real quality score should be this high)
         sa = array('i',(dv for i in range(0,4))) # score array, with [human_1_QS, human_2_QS, mouse_1_QS, mouse_2_QS]
-        for read in humanlist:
-            if read.is_unmapped:
-                continue
-            QScore = read.opt('XO') + read.opt('NM') + read.opt('NH')
-           # directionality (_1 or _2)
-            d12 = 0 if read.is_read1 else 1
-            if sa[d12]>QScore:
-                sa[d12]=QScore # update to lowest (i.e. 'best') quality score
-        for read in mouselist:
-            if read.is_unmapped:
-                continue
-            QScore = read.opt('XO') + read.opt('NM') + read.opt('NH')
-           # directionality (_1 or _2)
-            d12 = 2 if read.is_read1 else 3
-            if sa[d12]>QScore:
-                sa[d12]=QScore # update to lowest (i.e. 'best') quality score
+        for offset, scores in ((0, humanscores), (2, mousescores)):
+            for d12, QScore in scores:
+                if sa[d12 + offset]>QScore:
+                    sa[d12 + offset]=QScore # update to lowest (i.e. 'best') quality score
         if min(sa[0:2])==min(sa[2:4]) and max(sa[0:2])==max(sa[2:4]): # ambiguous
             return 0
         elif min(sa[0:2]) < min(sa[2:4]) or min(sa[0:2]) == min(sa[2:4]) and max(sa[0:2]) < max(sa[2:4]):
@@ -86,46 +102,26 @@ def disambiguate(humanlist, mouselist, disambalgo):
         dv = -2^13 # default value, low
         bwatags = ['AS', 'NM']# ,'XS'] # in order of importance (compared sequentially, not as a sum as for tophat)
         bwatagsigns = [1, -1]#,1] # for AS and XS higher is better. for NM lower is better, thus multiply by -1
+        tagindex = {'AS': 1, 'NM': 2, 'nM': 3}
         AS = list()
         for x in range(0, len(bwatagsigns)):
             AS.append(array('i',(dv for i in range(0,4)))) # alignment score array, with [human_1_Score, human_2_Score, mouse_1_Score, mouse_2_Score]
-        #
-        for read in humanlist:
-            if read.is_unmapped:
-                continue
-            # directionality (_1 or _2)
-            d12 = 0 if read.is_read1 else 1
-            for x in range(0, len(bwatagsigns)):
-                try:
-                    QScore = bwatagsigns[x]*read.opt(bwatags[x])
-                except KeyError:
-                    if bwatags[x] == 'NM':
-                        bwatags[x] = 'nM' # oddity of STAR
-                    elif bwatags[x] == 'AS':
-                        continue # this can happen for e.g. hg38 ALT-alignments (missing AS)
-                    QScore = bwatagsigns[x]*read.opt(bwatags[x])
-                    
-                if AS[x][d12]<QScore:
-                    AS[x][d12]=QScore # update to highest (i.e. 'best') quality score
-        #
-        for read in mouselist:
-            if read.is_unmapped:
-                continue
-           # directionality (_1 or _2)
-            d12 = 2 if read.is_read1 else 3
-            for x in range(0, len(bwatagsigns)):
-                try:
-                    QScore = bwatagsigns[x]*read.opt(bwatags[x])
-                except KeyError:
-                    if bwatags[x] == 'NM':
-                        bwatags[x] = 'nM' # oddity of STAR
-                    elif bwatags[x] == 'AS':
-                        continue # this can happen for e.g. hg38 ALT-alignments (missing AS)
-                    QScore = bwatagsigns[x]*read.opt(bwatags[x])
-                
-                if AS[x][d12]<QScore:
-                    AS[x][d12]=QScore # update to highest (i.e. 'best') quality score
-        #
+        for offset, scores in ((0, humanscores), (2, mousescores)):
+            for score in scores:
+                d12 = score[0] + offset
+                for x in range(0, len(bwatagsigns)):
+                    val = score[tagindex[bwatags[x]]]
+                    if val is None:
+                        if bwatags[x] == 'NM':
+                            bwatags[x] = 'nM' # oddity of STAR
+                        elif bwatags[x] == 'AS':
+                            continue # this can happen for e.g. hg38 ALT-alignments (missing AS)
+                        val = score[tagindex[bwatags[x]]]
+                        if val is None:
+                            raise KeyError("tag '%s' not present" % bwatags[x])
+                    QScore = bwatagsigns[x]*val
+                    if AS[x][d12]<QScore:
+                        AS[x][d12]=QScore # update to highest (i.e. 'best') quality score
         for x in range(0, len(bwatagsigns)):
             if max(AS[x][0:2]) > max(AS[x][2:4]) or max(AS[x][0:2]) == max(AS[x][2:4]) and min(AS[x][0:2]) > min(AS[x][2:4]):
                 # assign to human
@@ -138,10 +134,356 @@ def disambiguate(humanlist, mouselist, disambalgo):
         print("Not implemented yet")
         sys.exit(2)
 
+# disambiguate between two lists of reads
+def disambiguate(humanlist, mouselist, disambalgo):
+    return _score(_read_scores(humanlist, disambalgo), _read_scores(mouselist, disambalgo),
+                  disambalgo)
+
+# ## Streaming engine
+
+def _iter_groups(samfile, end_key=None):
+    """Group consecutive reads with the same natural read name.
+
+    Natural keys are computed once per new read name. Yields the key, reads
+    and number of read name changes in the group, used for counting, stopping
+    at the first group at or past end_key.
+    """
+    key = reads = last = None
+    changes = 0
+    for read in samfile:
+        qname = read.query_name
+        if reads is not None:
+            if qname == last:
+                reads.append(read)
+                continue
+            new_key = _natural_key(qname)
+            if new_key == key:
+                reads.append(read)
+                changes += 1
+                last = qname
+                continue
+            yield key, reads, changes
+            key = new_key
+        else:
+            key = _natural_key(qname)
+        if end_key is not None and key >= end_key:
+            return
+        reads, last, changes = [read], qname, 1
+    if reads is not None:
+        yield key, reads, changes
+
+def _next(groups):
+    return next(groups, None)
+
+def _disambiguate_files(humanfile, mousefile, outfiles, disambalgo, end_key=None):
+    """Disambiguate name sorted reads from two open BAM files, merging on natural read names.
+
+    outfiles are open human unique, human ambiguous, mouse unique and mouse
+    ambiguous BAMs. Returns counts of human, mouse and ambiguous read pairs.
+    """
+    humanunique, humanambiguous, mouseunique, mouseambiguous = outfiles
+    numhum = nummou = numamb = 0
+    humgroups = _iter_groups(humanfile, end_key)
+    mougroups = _iter_groups(mousefile, end_key)
+    hum = _next(humgroups)
+    mou = _next(mougroups)
+    while hum is not None and mou is not None:
+        if hum[0] < mou[0]: # mouse is "ahead" of human, output to human disambiguous
+            for myRead in hum[1]:
+                humanunique.write(myRead)
+            numhum += hum[2]
+            hum = _next(humgroups)
+        elif hum[0] > mou[0]: # human is "ahead" of mouse, output to mouse disambiguous
+            for myRead in mou[1]:
+                mouseunique.write(myRead)
+            nummou += mou[2]
+            mou = _next(mougroups)
+        else:
+            # perform comparison to check mouse, human or ambiguous
+            myAmbiguousness = disambiguate(hum[1], mou[1], disambalgo)
+            if myAmbiguousness < 0: # mouse
+                nummou += 1
+                for myRead in mou[1]:
+                    mouseunique.write(myRead)
+            elif myAmbiguousness > 0: # human
+                numhum += 1
+                for myRead in hum[1]:
+                    humanunique.write(myRead)
+            else: # ambiguous
+                numamb += 1
+                for myRead in mou[1]:
+                    mouseambiguous.write(myRead)
+                for myRead in hum[1]:
+                    humanambiguous.write(myRead)
+            hum = _next(humgroups)
+            mou = _next(mougroups)
+    #flush the rest of the reads
+    while hum is not None:
+        for myRead in hum[1]:
+            humanunique.write(myRead)
+        numhum += hum[2]
+        hum = _next(humgroups)
+    while mou is not None:
+        for myRead in mou[1]:
+            mouseunique.write(myRead)
+        nummou += mou[2]
+        mou = _next(mougroups)
+    return numhum, nummou, numamb
+
+# ## Partitioning across cores
+
+# Blocks decompressed past a candidate record start, to check the records that follow
+_CHECK_BLOCKS = 2
+_CHECK_RECORDS = 3
+
+def _bgzf_block(handle, coffset):
+    """Read the BGZF block starting at a compressed offset, returning its size and data.
+    """
+    handle.seek(coffset)
+    header = handle.read(18)
+    if len(header) < 18 or header[:4] != b"\x1f\x8b\x08\x04" or header[12:14] != b"BC":
+        return None
+    bsize = struct.unpack("<H", header[16:18])[0] + 1
+    cdata = handle.read(bsize - 18)
+    try:
+        data = zlib.decompress(cdata[:-8], -15)
+    except zlib.error:
+        return None
+    if struct.unpack("<I", cdata[-4:])[0] != len(data):
+        return None
+    return bsize, data
+
+def _next_block(handle, coffset, end):
+    """Find the next BGZF block at or after a compressed offset, by scanning for its header.
+    """
+    while coffset < end:
+        handle.seek(coffset)
+        buf = handle.read(65536 + 18)
+        i = buf.find(b"\x1f\x8b\x08\x04")
+        while i >= 0:
+            block = _bgzf_block(handle, coffset + i)
+            if block is not None:
+                return coffset + i, block
+            i = buf.find(b"\x1f\x8b\x08\x04", i + 1)
+        coffset += 65536
+    return None
+
+def _is_record(buf, u, nref):
+    """Check if uncompressed BAM data has a plausible alignment record at an offset.
+    """
+    if u + 36 > len(buf):
+        return False
+    (block_size, ref_id, pos, l_read_name, _, _, n_cigar, _, l_seq,
+     next_ref_id, next_pos, _) = struct.unpack("<iiiBBHHHiiii", buf[u:u + 36])
+    if not (-1 <= ref_id < nref and -1 <= next_ref_id < nref and pos >= -1 and next_pos >= -1
+            and l_read_name >= 2 and l_seq >= 0):
+        return False
+    if 32 + l_read_name + 4 * n_cigar + (l_seq + 1) // 2 + l_seq > block_size:
+        return False
+    name = buf[u + 36:u + 36 + l_read_name]
+    if len(name) == l_read_name:
+        return name[-1:] == b"\0" and all(33 <= c <= 126 for c in bytearray(name[:-1]))
+    return True
+
+def _find_record(buf, limit, nref):
+    """Find the first offset before limit starting a chain of plausible records.
+    """
+    for u in range(limit):
+        cur = u
+        for _ in range(_CHECK_RECORDS):
+            if cur + 4 > len(buf):
+                break
+            if not _is_record(buf, cur, nref):
+                cur = None
+                break
+            cur += 4 + struct.unpack("<i", buf[cur:cur + 4])[0]
+        if cur is not None:
+            return u
+    return None
+
+class _NameSortedBam:
+    """Random access to read name groups of a name sorted BAM file, without an index.
+
+    Finds record starts in BGZF blocks at arbitrary compressed offsets, so split
+    points only need to decode reads near each offset.
+    """
+    def __init__(self, filename):
+        self._raw = open(filename, "rb")
+        self._bam = pysam.AlignmentFile(filename, "rb")
+        self._nref = self._bam.nreferences
+        self._first = self._bam.tell()
+        self.start = self._first >> 16
+        self.end = path.getsize(filename)
+
+    def close(self):
+        self._raw.close()
+        self._bam.close()
+
+    def _record_at(self, coffset):
+        """Virtual offset of the first record starting in a block at or after coffset.
+        """
+        while True:
+            found = _next_block(self._raw, max(coffset, self.start), self.end)
+            if found is None:
+                return None
+            coffset, (bsize, data) = found
+            buf = data
+            next_coffset = coffset + bsize
+            for _ in range(_CHECK_BLOCKS):
+                block = _bgzf_block(self._raw, next_coffset)
+                if block is None:
+                    break
+                buf += block[1]
+                next_coffset += block[0]
+            u = _find_record(buf, len(data), self._nref)
+            if u is not None:
+                return (coffset << 16) | u
+            coffset += bsize
+
+    def _reads_from(self, voffset):
+        """Iterate over (virtual offset, natural key) of reads starting at a virtual offset.
+        """
+        self._bam.seek(voffset)
+        last = None
+        while True:
+            offset = self._bam.tell()
+            read = next(self._bam, None)
+            if read is None:
+                return
+            if read.query_name != last:
+                last = read.query_name
+                yield offset, _natural_key(last)
+
+    def group_at(self, coffset):
+        """First complete read name group starting at or after a compressed offset.
+
+        Returns the virtual offset of its first read and its natural key.
+        """
+        voffset = self._record_at(coffset)
+        if voffset is None:
+            return None
+        first = None
+        for offset, key in self._reads_from(voffset):
+            if first is None:
+                first = key
+            elif key != first:
+                return offset, key
+        return None
+
+    def offset_of(self, key):
+        """Virtual offset of the first read with a natural key at or past key, or None.
+
+        Bisects on compressed offsets, then reads forward from the last group before key.
+        """
+        lo, hi = self.start, self.end
+        lo_offset = None
+        while hi - lo > 65536:
+            mid = (lo + hi) // 2
+            found = self.group_at(mid)
+            if found is None or found[1] >= key:
+                hi = mid
+            else:
+                lo, lo_offset = mid, found[0]
+        for offset, cur in self._reads_from(lo_offset if lo_offset is not None else self._first):
+            if cur >= key:
+                return offset
+        return None
+
+def _split_points(humanfilename, mousefilename, numparts):
+    """Find natural read name keys splitting both files into ranges of similar size.
+
+    Split keys come from the first complete read name group at even fractions
+    of the human file's compressed size. Returns keys and, for each file, the
+    virtual file offset of the first read at or past each key.
+    """
+    keys = []
+    humoffsets = []
+    human = _NameSortedBam(humanfilename)
+    try:
+        for i in range(1, numparts):
+            found = human.group_at(human.start + (human.end - human.start) * i // numparts)
+            if found is not None and (not keys or found[1] > keys[-1]):
+                humoffsets.append(found[0])
+                keys.append(found[1])
+    finally:
+        human.close()
+    mouse = _NameSortedBam(mousefilename)
+    try:
+        mouoffsets = [mouse.offset_of(key) for key in keys]
+    finally:
+        mouse.close()
+    return keys, humoffsets, mouoffsets
+
+def _run_part(args):
+    """Disambiguate one range of read names, writing to partial output files.
+    """
+    humanfilename, mousefilename, humoffset, mouoffset, end_key, outnames, disambalgo = args
+    with pysam.AlignmentFile(humanfilename, "rb") as humanfile:
+        with pysam.AlignmentFile(mousefilename, "rb") as mousefile:
+            if humoffset:
+                humanfile.seek(humoffset)
+            mousereads = mousefile
+            if mouoffset is None: # no mouse reads at or past the start of this range
+                mousereads = iter([])
+            elif mouoffset:
+                mousefile.seek(mouoffset)
+            with _open_outputs(outnames, humanfilename, mousefilename) as outfiles:
+                return _disambiguate_files(humanfile, mousereads, outfiles, disambalgo, end_key)
+
+def _run_part_process(args):
+    """Disambiguate a range in a separate Python process, returning its counts.
+
+    Running this script directly, instead of through multiprocessing, works
+    inside daemonic multicore pipeline workers, which cannot start process pools.
+    """
+    out = subprocess.check_output([sys.executable, path.abspath(__file__), "--part", json.dumps(args)])
+    return tuple(json.loads(out.decode().strip().split("\n")[-1]))
+
+@contextlib.contextmanager
+def _open_outputs(outnames, humanfilename, mousefilename):
+    """Open human unique, human ambiguous, mouse unique and mouse ambiguous output BAMs.
+    """
+    handles = []
+    try:
+        for outname, template in zip(outnames, [humanfilename, humanfilename,
+                                                mousefilename, mousefilename]):
+            with pysam.AlignmentFile(template, "rb") as template_bam:
+                handles.append(pysam.AlignmentFile(outname, "wb", template=template_bam))
+        yield handles
+    finally:
+        for handle in handles:
+            handle.close()
+
+def _run_parts(humanfilename, mousefilename, outnames, disambalgo, cores):
+    """Split read names into ranges, disambiguate each in parallel and concatenate outputs.
+
+    Each range covers whole read name groups in both files, so concatenating
+    outputs in range order gives the same reads and order as a single pass.
+    """
+    if cores > 1:
+        keys, humoffsets, mouoffsets = _split_points(humanfilename, mousefilename, cores)
+    else:
+        keys, humoffsets, mouoffsets = [], [], []
+    if len(keys) == 0:
+        return _run_part((humanfilename, mousefilename, 0, 0, None, outnames, disambalgo))
+    starts = [(0, 0)] + list(zip(humoffsets, mouoffsets))
+    ends = keys + [None]
+    parts = []
+    for i, ((humoffset, mouoffset), end_key) in enumerate(zip(starts, ends)):
+        partnames = ["%s.part%04d.bam" % (x.replace(".bam", ""), i) for x in outnames]
+        parts.append((humanfilename, mousefilename, humoffset, mouoffset, end_key, partnames,
+                      disambalgo))
+    with futures.ThreadPoolExecutor(min(cores, len(parts))) as executor:
+        counts = list(executor.map(_run_part_process, parts))
+    for j, outname in enumerate(outnames):
+        partnames = [x[5][j] for x in parts]
+        pysam.cat("--no-PG", "-o", outname, *partnames)
+        for partname in partnames:
+            os.remove(partname)
+    return tuple(sum(x[i] for x in counts) for i in range(3))
 
 #code
 def main(args):
-    numhum = nummou = numamb = 0
     #starttime = time.clock()
     # parse inputs
     humanfilename = args.A
@@ -151,6 +493,7 @@ def main(args):
     intermdir = args.intermediate_dir
     disablesort = args.no_sort
     disambalgo = args.aligner
+    cores = max(1, int(getattr(args, "cores", 1) or 1))
     supportedalgorithms = set(['tophat', 'hisat2', 'bwa', 'star'])
 
     # check existence of input BAM files
@@ -183,114 +526,23 @@ def main(args):
             pysam.sort("-n","-m","2000000000",humanfilename,humanfilenamesorted.replace(".bam",""))
         if not path.isfile(mousefilenamesorted):
             pysam.sort("-n","-m","2000000000",mousefilename,mousefilenamesorted.replace(".bam",""))
-   # read in human reads and form a dictionary
-    myHumanFile = pysam.Samfile(humanfilenamesorted, "rb" )
-    myMouseFile = pysam.Samfile(mousefilenamesorted, "rb" )
+    for filename in [humanfilenamesorted, mousefilenamesorted]:
+        with pysam.AlignmentFile(filename, "rb") as in_bam:
+            if next(in_bam, None) is None:
+                print("No reads in one or either of the input files")
+                sys.exit(2)
     if not path.isdir(outputdir):
         makedirs(outputdir)
-    myHumanUniqueFile = pysam.Samfile(path.join(outputdir, humanprefix+".disambiguatedSpeciesA.bam"), "wb", template=myHumanFile)
-    myHumanAmbiguousFile = pysam.Samfile(path.join(outputdir, humanprefix+".ambiguousSpeciesA.bam"), "wb", template=myHumanFile)
-    myMouseUniqueFile = pysam.Samfile(path.join(outputdir, mouseprefix+".disambiguatedSpeciesB.bam"), "wb", template=myMouseFile)
-    myMouseAmbiguousFile = pysam.Samfile(path.join(outputdir, mouseprefix+".ambiguousSpeciesB.bam"), "wb", template=myMouseFile)
-    summaryFile = open(path.join(outputdir,humanprefix+'_summary.txt'),'w')
-
-    #initialise
-    try:
-        nexthumread=next(myHumanFile)
-        nextmouread=next(myMouseFile)
-    except StopIteration:
-        print("No reads in one or either of the input files")
-        sys.exit(2)
+    outnames = [path.join(outputdir, humanprefix+".disambiguatedSpeciesA.bam"),
+                path.join(outputdir, humanprefix+".ambiguousSpeciesA.bam"),
+                path.join(outputdir, mouseprefix+".disambiguatedSpeciesB.bam"),
+                path.join(outputdir, mouseprefix+".ambiguousSpeciesB.bam")]
+    numhum, nummou, numamb = _run_parts(humanfilenamesorted, mousefilenamesorted, outnames,
+                                        disambalgo, cores)
 
-    EOFmouse = EOFhuman = False
-    prevHumID = '-+=RANDOMSTRING=+-'
-    prevMouID = '-+=RANDOMSTRING=+-'
-    while not EOFmouse&EOFhuman:
-        while not (nat_cmp(nexthumread.qname,nextmouread.qname) == 0):
-            # check order between current human and mouse qname (find a point where they're identical, i.e. in sync)
-            while nat_cmp(nexthumread.qname,nextmouread.qname) > 0 and not EOFmouse: # mouse is "behind" human, output to mouse disambiguous
-                myMouseUniqueFile.write(nextmouread)
-                if not nextmouread.qname == prevMouID:
-                    nummou+=1 # increment mouse counter for unique only
-                prevMouID = nextmouread.qname
-                try:
-                    nextmouread=next(myMouseFile)
-                except StopIteration:
-                    EOFmouse=True
-            while nat_cmp(nexthumread.qname,nextmouread.qname) < 0 and not EOFhuman: # human is "behind" mouse, output to human disambiguous
-                myHumanUniqueFile.write(nexthumread)
-                if not nexthumread.qname == prevHumID:
-                    numhum+=1 # increment human counter for unique only
-                prevHumID = nexthumread.qname
-                try:
-                    nexthumread=next(myHumanFile)
-                except StopIteration:
-                    EOFhuman=True
-            if EOFhuman or EOFmouse:
-                break
-        # at this point the read qnames are identical and/or we've reached EOF
-        humlist = list()
-        moulist = list()
-        if nat_cmp(nexthumread.qname,nextmouread.qname) == 0:
-            humlist.append(nexthumread)
-            nexthumread = read_next_reads(myHumanFile, humlist) # read more reads with same qname (the function modifies humlist directly)
-            if nexthumread == None:
-                EOFhuman = True
-            moulist.append(nextmouread)
-            nextmouread = read_next_reads(myMouseFile, moulist) # read more reads with same qname (the function modifies moulist directly)
-            if nextmouread == None:
-                EOFmouse = True
-
-        # perform comparison to check mouse, human or ambiguous
-        if len(moulist) > 0 and len(humlist) > 0:
-            myAmbiguousness = disambiguate(humlist, moulist, disambalgo)
-            if myAmbiguousness < 0: # mouse
-                nummou+=1 # increment mouse counter
-                for myRead in moulist:
-                    myMouseUniqueFile.write(myRead)
-            elif myAmbiguousness > 0: # human
-                numhum+=1 # increment human counter
-                for myRead in humlist:
-                    myHumanUniqueFile.write(myRead)
-            else: # ambiguous
-                numamb+=1 # increment ambiguous counter
-                for myRead in moulist:
-                    myMouseAmbiguousFile.write(myRead)
-                for myRead in humlist:
-                    myHumanAmbiguousFile.write(myRead)
-        if EOFhuman:
-            #flush the rest of the mouse reads
-            while not EOFmouse:
-                myMouseUniqueFile.write(nextmouread)
-                if not nextmouread.qname == prevMouID:
-                    nummou+=1 # increment mouse counter for unique only
-                prevMouID = nextmouread.qname
-                try:
-                    nextmouread=next(myMouseFile)
-                except StopIteration:
-                    #print("3")
-                    EOFmouse=True
-        if EOFmouse:
-            #flush the rest of the human reads
-            while not EOFhuman:
-                myHumanUniqueFile.write(nexthumread)
-                if not nexthumread.qname == prevHumID:
-                    numhum+=1 # increment human counter for unique only
-                prevHumID = nexthumread.qname
-                try:
-                    nexthumread=next(myHumanFile)
-                except StopIteration:
-                    EOFhuman=True
-
-    summaryFile.write("sample\tunique species A pairs\tunique species B pairs\tambiguous pairs\n")
-    summaryFile.write(humanprefix+"\t"+str(numhum)+"\t"+str(nummou)+"\t"+str(numamb)+"\n")
-    summaryFile.close()
-    myHumanFile.close()
-    myMouseFile.close()
-    myHumanUniqueFile.close()
-    myHumanAmbiguousFile.close()
-    myMouseUniqueFile.close()
-    myMouseAmbiguousFile.close()
+    with open(path.join(outputdir,humanprefix+'_summary.txt'),'w') as summaryFile:
+        summaryFile.write("sample\tunique species A pairs\tunique species B pairs\tambiguous pairs\n")
+        summaryFile.write(humanprefix+"\t"+str(numhum)+"\t"+str(nummou)+"\t"+str(numamb)+"\n")
 
 
 def file_exists(fname):
@@ -330,6 +582,9 @@ disambiguate.py test/human.bam test/mouse.bam
 disambiguate.py -s mysample1 test/human.bam test/mouse.bam
    """
 
+   if len(sys.argv) == 3 and sys.argv[1] == "--part":
+       print(json.dumps(_run_part(json.loads(sys.argv[2]))))
+       sys.exit(0)
    parser = ArgumentParser(description=description, formatter_class=RawTextHelpFormatter)
    parser.add_argument('A', help='Input BAM file for species A.')
    parser.add_argument('B', help='Input BAM file for species B.')
@@ -348,5 +603,8 @@ disambiguate.py -s mysample1 test/human.bam test/mouse.bam
                        choices=('tophat', 'hisat2', 'bwa', 'star'),
                        help='The aligner used to generate these reads. Some '
                        'aligners set different tags.')
+   parser.add_argument('-t', '--cores', type=int, default=1,
+                       help='Number of cores to use, disambiguating ranges of '
+                       'read names in parallel.')
    args = parser.parse_args()
    main(args)
@@ -9,12 +9,13 @@ import os
 import sys
 import resource
 import tempfile
+import threading
 
 import toolz as tz
 
 from bcbio import log, heterogeneity, hla, structural, utils
 from bcbio.cwl.inspect import initialize_watcher
-from bcbio.distributed import prun
+from bcbio.distributed import dag, prun
 from bcbio.distributed.transaction import tx_tmpdir
 from bcbio.log import logger, DEFAULT_LOG_DIR
 from bcbio.ngsalign import alignprep
@@ -129,13 +130,16 @@ def variant2pipeline(config, run_info_yaml, parallel, dirs, samples):
         with profile.report("alignment preparation", dirs):
             samples = run_parallel("prep_align_inputs", samples)
             samples = run_parallel("disambiguate_split", [samples])
+        pipelined = dag.num_workers(run_parallel)
+        steps = _alignment_steps(run_parallel)
         with profile.report("alignment", dirs):
-            samples = run_parallel("process_alignment", samples)
-            samples = disambiguate.resolve(samples, run_parallel)
-            samples = alignprep.merge_split_alignments(samples, run_parallel)
+            if pipelined:
+                samples = dag.run_samples(samples, steps, pipelined)
+            else:
+                samples = _run_steps(samples, steps[:3])
         with profile.report("callable regions", dirs):
-            samples = run_parallel("prep_samples", [samples])
-            samples = run_parallel("postprocess_alignment", samples)
+            if not pipelined:
+                samples = _run_steps(samples, steps[3:])
             samples = run_parallel("combine_sample_regions", [samples])
             samples = run_parallel("calculate_sv_bins", [samples])
             samples = run_parallel("calculate_sv_coverage", samples)
@@ -201,6 +205,28 @@ def variant2pipeline(config, run_info_yaml, parallel, dirs, samples):
     logger.info("Timing: finished")
     return samples
 
+def _alignment_steps(run_parallel):
+    """Alignment steps, run over all samples together or per-sample in a dependency graph.
+
+    Input BED cleaning in prep_samples happens after merging, matching the order of
+    non-pipelined runs. It runs for one sample at a time, avoiding races on shared files.
+    """
+    prep_lock = threading.Lock()
+
+    def prep_samples(xs):
+        with prep_lock:
+            return run_parallel("prep_samples", [xs])
+    return [("process_alignment", lambda xs: run_parallel("process_alignment", xs)),
+            ("disambiguate", lambda xs: disambiguate.resolve(xs, run_parallel)),
+            ("merge_split_alignments", lambda xs: alignprep.merge_split_alignments(xs, run_parallel)),
+            ("prep_samples", prep_samples),
+            ("postprocess_alignment", lambda xs: run_parallel("postprocess_alignment", xs))]
+
+def _run_steps(samples, steps):
+    for _, fn in steps:
+        samples = fn(samples)
+    return samples
+
 def _debug_samples(i, samples):
     print("---", i, len(samples))
     for sample in (utils.to_single_data(x) for x in samples):
@@ -8,6 +8,7 @@ import shutil
 import subprocess
 
 from bcbio import bam, utils
+from bcbio.bam import stats as bamstats
 from bcbio.distributed.transaction import file_transaction, tx_tmpdir
 from bcbio.pipeline import config_utils
 from bcbio.pipeline import datadict as dd
@@ -74,6 +75,7 @@ def merge_bam_files(bam_files, work_dir, data, out_file=None, batch=None):
                                "Check for valid merged BAM")
             do.run('{} quickcheck -v {}'.format(samtools, out_file),
                    "Check for valid merged BAM after transfer")
+            bamstats.merge_streams(bam_files, out_file)
             _finalize_merge(out_file, bam_files, data["config"])
     bam.index(out_file, data["config"])
     return out_file
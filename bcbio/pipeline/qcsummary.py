@@ -4,6 +4,8 @@ import collections
 import copy
 import csv
 import os
+import threading
+from concurrent import futures
 
 import yaml
 from datetime import datetime
@@ -18,7 +20,7 @@ from bcbio.cwl import cwlutils
 from bcbio.log import logger
 from bcbio.pipeline import config_utils, run_info
 import bcbio.pipeline.datadict as dd
-from bcbio.provenance import do
+from bcbio.provenance import do, telemetry
 from bcbio.rnaseq import gtf
 from bcbio.variation import damage, peddy, vcfutils, vcfanno
 
@@ -165,14 +167,22 @@ def _run_qc_tools(bam_file, data):
     qc_dir = utils.safe_makedir(os.path.join(data["dirs"]["work"], "qc", data["description"]))
     metrics = {}
     qc_out = utils.deepish_copy(dd.get_summary_qc(data))
+    to_run = []
     for program_name in dd.get_algorithm_qc(data):
         if not bam_file and program_name != "kraken":  # kraken doesn't need bam
             continue
         if dd.get_phenotype(data) == "germline" and program_name != "variants":
             continue
-        qc_fn = tools[program_name]
+        to_run.append(program_name)
+    if "concurrent_qc" in dd.get_tools_on(data) and len(to_run) > 1:
+        outs = _run_concurrently(to_run, tools, bam_file, data, qc_dir)
+    else:
+        outs = {}
+        for program_name in to_run:
+            outs[program_name] = tools[program_name](bam_file, data, os.path.join(qc_dir, program_name))
+    for program_name in to_run:
         cur_qc_dir = os.path.join(qc_dir, program_name)
-        out = qc_fn(bam_file, data, cur_qc_dir)
+        out = outs[program_name]
         qc_files = None
         if out and isinstance(out, dict):
             # Check for metrics output, two cases:
@@ -196,6 +206,111 @@ def _run_qc_tools(bam_file, data):
     metrics["Quality format"] = dd.get_quality_format(data).lower()
     return {"qc": qc_out, "metrics": metrics}
 
+# Cores each QC tool makes use of and its relative expected run time, for running
+# tools concurrently. Tools changing the working directory run alone afterwards.
+# Java tools also reserve their default heap, scaled by cores for qualimap, unless
+# configured in resources.
+QC_TOOL_HINTS = {"fastqc": {"cores": 2, "cost": 4, "exclusive": True},
+                 "kraken": {"cores": 4, "cost": 4, "exclusive": True},
+                 "picard": {"cores": 1, "cost": 4, "exclusive": True, "memory": "2g"},
+                 "qualimap": {"cores": 4, "cost": 8, "memory": "1g", "memory_per_core": True},
+                 "qualimap_rnaseq": {"cores": 4, "cost": 8, "memory": "2g", "memory_per_core": True,
+                                     "resources": "qualimap"},
+                 "samtools": {"cores": 2, "cost": 4},
+                 "coverage": {"cores": 2, "cost": 6},
+                 "preseq": {"cores": 1, "cost": 4},
+                 "peddy": {"cores": 2, "cost": 3},
+                 "viral": {"cores": 4, "cost": 3},
+                 "contamination": {"cores": 1, "cost": 2},
+                 "qsignature": {"cores": 1, "cost": 2},
+                 "chipqc": {"cores": 1, "cost": 2},
+                 "ataqv": {"cores": 1, "cost": 2}}
+DEFAULT_QC_HINT = {"cores": 1, "cost": 1}
+
+def _memory_to_gb(memory):
+    return config_utils.convert_to_bytes(memory) / (1024.0 * 1024.0)
+
+def _tool_memory(program_name, cores, data):
+    """Memory, in Gb, a QC tool reserves when running on the given cores.
+    """
+    hint = QC_TOOL_HINTS.get(program_name, DEFAULT_QC_HINT)
+    if "memory" not in hint:
+        return 0
+    resources = config_utils.get_resources(hint.get("resources", program_name), data["config"])
+    memory = hint["memory"]
+    for jvm_opt in resources.get("jvm_opts", []):
+        if jvm_opt.startswith("-Xmx"):
+            memory = jvm_opt[4:]
+    memory = resources.get("memory", memory)
+    if hint.get("memory_per_core"):
+        memory = config_utils.adjust_memory(memory, cores)
+    return _memory_to_gb(memory)
+
+def _sample_memory(to_run, data):
+    """Memory, in Gb, available to a sample: its cores times the configured memory per core.
+    """
+    from bcbio.distributed import resources
+    _, memory_per_core = resources.cpu_and_memory(to_run, [data])
+    return max(1, dd.get_num_cores(data)) * memory_per_core
+
+class _CoreSlots:
+    """Track cores and memory available to concurrently running tools within a sample's allocation.
+    """
+    def __init__(self, total, memory):
+        self.total = total
+        self.memory = memory
+        self._free = total
+        self._free_memory = memory
+        self._cond = threading.Condition()
+
+    def acquire(self, cores, memory=0):
+        with self._cond:
+            while self._free < cores or self._free_memory < memory:
+                self._cond.wait()
+            self._free -= cores
+            self._free_memory -= memory
+
+    def release(self, cores, memory=0):
+        with self._cond:
+            self._free += cores
+            self._free_memory += memory
+            self._cond.notify_all()
+
+def _run_concurrently(to_run, tools, bam_file, data, qc_dir):
+    """Run independent QC tools at the same time, sharing the cores and memory assigned to the sample.
+
+    Tools start in order of expected run time, each waiting for the cores it
+    can use and the memory it reserves. Each tool gets its own copy of the
+    sample since some update nested values in place. Tools that change the
+    working directory are not thread safe and run one at a time once the
+    others finish.
+    """
+    hints = {x: QC_TOOL_HINTS.get(x, DEFAULT_QC_HINT) for x in to_run}
+    slots = _CoreSlots(max(1, dd.get_num_cores(data)), _sample_memory(to_run, data))
+    def run_tool(program_name):
+        cores = min(hints[program_name]["cores"], slots.total)
+        memory = min(_tool_memory(program_name, cores, data), slots.memory)
+        slots.acquire(cores, memory)
+        try:
+            return tools[program_name](bam_file, dd.set_num_cores(utils.deepish_copy(data), cores),
+                                       os.path.join(qc_dir, program_name))
+        finally:
+            slots.release(cores, memory)
+    concurrent = sorted([x for x in to_run if not hints[x].get("exclusive")],
+                        key=lambda x: hints[x]["cost"], reverse=True)
+    out = {}
+    if concurrent:
+        logger.info("QC: running %s concurrently on %s cores and %.1fg memory"
+                    % (", ".join(concurrent), slots.total, slots.memory))
+        with futures.ThreadPoolExecutor(len(concurrent)) as executor:
+            running = [(x, executor.submit(telemetry.propagate(run_tool), x)) for x in concurrent]
+            for program_name, f in running:
+                out[program_name] = f.result()
+    for program_name in to_run:
+        if program_name not in out:
+            out[program_name] = tools[program_name](bam_file, data, os.path.join(qc_dir, program_name))
+    return out
+
 def _organize_qc_files(program, qc_dir):
     """Organize outputs from quality control runs into a base file and secondary outputs.
 
@@ -19,7 +19,7 @@ import yaml
 from bcbio import install, utils, structural
 from bcbio.bam import fastq, ref
 from bcbio.log import logger
-from bcbio.distributed import objectstore
+from bcbio.distributed import objectstore, staging
 from bcbio.illumina import flowcell
 from bcbio.pipeline import alignment, config_utils, genome
 from bcbio.pipeline import datadict as dd
@@ -932,7 +932,18 @@ def _run_info_from_yaml(dirs, run_info_yaml, config, sample_names=None,
                 config[iname] = retriever.set_cache(config[iname])
                 loaded = retriever.add_remotes(loaded, config[iname])
 
-    run_details = []
+    # Download remote inputs concurrently in the background while preparing samples
+    remotes = _remote_inputs(loaded) if all(not x for x in integrations.values()) else []
+    with staging.prefetch(remotes, os.path.join(os.getcwd(), "inputs")):
+        run_details = list(_prepare_items(loaded, dirs, config, global_config, global_vars, resources,
+                                          integration_config, fc_name, fc_date, is_cwl, integrations))
+    _check_sample_config(run_details, run_info_yaml, config)
+    return run_details
+
+def _prepare_items(loaded, dirs, config, global_config, global_vars, resources, integration_config,
+                   fc_name, fc_date, is_cwl, integrations):
+    """Normalize and add defaults to each sample loaded from the input YAML.
+    """
     for i, item in enumerate(loaded):
         item = _normalize_files(item, dirs.get("flowcell"))
         if "lane" not in item:
@@ -1018,9 +1029,18 @@ def _run_info_from_yaml(dirs, run_info_yaml, config, sample_names=None,
                 for k, v in ivals.items():
                     item[iname][k] = v
 
-        run_details.append(item)
-    _check_sample_config(run_details, run_info_yaml, config)
-    return run_details
+        yield item
+
+def _remote_inputs(loaded):
+    """Retrieve remote input files and algorithm resources for samples.
+    """
+    out = []
+    for item in loaded:
+        out.extend(staging.remote_files(item.get("files", [])))
+        out.extend(staging.remote_files(item.get("vrn_file")))
+        out.extend(staging.remote_files({k: v for k, v in item.get("algorithm", {}).items()
+                                         if k not in ALGORITHM_NOPATH_KEYS}))
+    return out
 
 def _item_is_bam(item):
     files = item.get("files", [])
@@ -17,6 +17,7 @@ from bcbio.log import logger
 from bcbio.distributed import objectstore
 from bcbio.pipeline.merge import merge_bam_files
 from bcbio.bam import callable, readstats, trim
+from bcbio.bam import stats as bamstats
 from bcbio.hla import optitype
 from bcbio.ngsalign import postalign
 from bcbio.pipeline.fastq import get_fastq_files
@@ -353,6 +354,8 @@ def delayed_bam_merge(data):
                     data[file_key + "_plus"][ext] = merged_file
                 else:
                     data[file_key] = merged_file
+                    if file_key == "work_bam":
+                        data = dd.set_align_stats(data, bamstats.stream_summary(merged_file))
         data.pop("region", None)
         data.pop("combine", None)
     return [[data]]
@@ -380,6 +383,8 @@ def _merge_align_bams(data):
             merged_file = merge_bam_files(in_files, utils.safe_makedir(os.path.dirname(out_file)),
                                           data, out_file=out_file)
             data = tz.update_in(data, key, lambda x: merged_file)
+            if key == ["work_bam"]:
+                data = dd.set_align_stats(data, bamstats.stream_summary(merged_file))
         else:
             data = tz.update_in(data, key, lambda x: None)
     if "align_bam" in data and "work_bam" in data:
@@ -19,17 +19,22 @@ except ImportError:
     biolite = None
 
 from bcbio import utils
+from bcbio.provenance import telemetry
 
-def start_cmd(cmd, descr, data):
+def start_cmd(cmd, descr, data, region=None):
     """Retain details about starting a command, returning a command identifier.
+
+    The identifier tracks resource usage of the command until it finishes.
     """
-    if data and "provenance" in data:
-        entity_id = tz.get_in(["provenance", "entity"], data)
+    if not descr:
+        descr = " ".join(str(x) for x in cmd) if isinstance(cmd, (list, tuple)) else str(cmd)
+    return telemetry.Measurement("cmd", descr, data, region)
 
 def end_cmd(cmd_id, succeeded=True):
-    """Mark a command as finished with success or failure.
+    """Mark a command as finished with success or failure, recording resource usage.
     """
-    pass
+    if cmd_id is not None:
+        cmd_id.finish(succeeded)
 
 def initialize(dirs):
     """Initialize the biolite database to load provenance information.
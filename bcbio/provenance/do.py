@@ -20,7 +20,7 @@ def run(cmd, descr=None, data=None, checks=None, region=None, log_error=True,
     if descr:
       descr = _descr_str(descr, data, region)
       logger.debug(descr)
-    cmd_id = diagnostics.start_cmd(cmd, descr or "", data)
+    cmd_id = diagnostics.start_cmd(cmd, descr or "", data, region)
     try:
         logger_cl.debug(" ".join(str(x) for x in cmd) if not isinstance(cmd, six.string_types) else cmd)
         _do_run(cmd, checks, log_stdout, env=env)
@@ -29,7 +29,7 @@ def run(cmd, descr=None, data=None, checks=None, region=None, log_error=True,
         if log_error:
             logger.exception()
         raise
-    finally:
+    else:
         diagnostics.end_cmd(cmd_id)
 
 def _descr_str(descr, data, region):
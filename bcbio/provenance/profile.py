@@ -4,9 +4,14 @@ pipeline runs.
 import contextlib
 
 from bcbio.log import logger
+from bcbio.provenance import telemetry
 
 @contextlib.contextmanager
 def report(label, dirs):
-    """Log timing information for later graphing of resource usage."""
+    """Log timing information for later graphing of resource usage.
+
+    Also records stage wall time with per-command and per-task resource usage.
+    """
     logger.info("Timing: %s" % label)
-    yield None
+    with telemetry.stage(label, dirs):
+        yield None
@@ -0,0 +1,386 @@
+"""Record resource usage of external commands and parallel tasks.
+
+Measures wall time, user and system CPU, peak memory and block I/O for every
+command run through provenance.do and every parallel task. CPU and I/O come
+from rusage deltas for child processes, and peak memory from sampling the
+resident size of the process tree in /proc. Records go to a SQLite database
+in the provenance directory of the run, tagged with stage, sample and region,
+for summarizing the most expensive steps and sizing memory in later runs.
+Tasks also record output bytes moved into place by rename or by copy, which
+identify steps writing transactional files across filesystems.
+
+Rusage and memory sampling cover the whole process, so measurements running
+concurrently in other threads, such as concurrent QC tools, are marked as
+shared and only record wall time.
+
+Records of commands are buffered by the enclosing parallel task or stage and
+written in a single transaction when it finishes, to avoid a database write on
+the shared work directory for every command.
+"""
+from __future__ import print_function
+import contextlib
+import functools
+import os
+import resource
+import socket
+import sqlite3
+import threading
+import time
+
+from bcbio.distributed import transaction
+from bcbio.log import logger
+
+SAMPLE_INTERVAL = 2.0
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS usage (
+    kind TEXT, block TEXT, stage TEXT, sample TEXT, region TEXT, label TEXT, host TEXT,
+    cores INTEGER, start REAL, wall REAL, user REAL, sys REAL, max_rss_mb REAL,
+    read_mb REAL, write_mb REAL, success INTEGER, renamed_mb REAL, copied_mb REAL, shared INTEGER)"""
+# Columns added after the initial schema, for databases from earlier runs
+_ADDED_COLUMNS = [("renamed_mb", "REAL"), ("copied_mb", "REAL"), ("shared", "INTEGER")]
+
+# Parallel block, stage, database, task measurement and record buffer for the current thread of work
+_DEFAULT_CONTEXT = {"block": None, "stage": None, "db": None, "measurement": None, "buffer": None}
+_local = threading.local()
+
+# Measurements not yet finished, to identify concurrent measurements in other threads
+_open = set()
+_open_lock = threading.Lock()
+
+def get_db(work_dir):
+    return os.path.join(work_dir, "provenance", "telemetry.db")
+
+def _db_from_data(data):
+    if isinstance(data, dict) and data.get("dirs", {}).get("work"):
+        return get_db(data["dirs"]["work"])
+    return _get_context()["db"]
+
+def _get_context():
+    return getattr(_local, "context", _DEFAULT_CONTEXT)
+
+@contextlib.contextmanager
+def _updated_context(**kwargs):
+    prev = _get_context()
+    cur = dict(prev)
+    cur.update(kwargs)
+    _local.context = cur
+    try:
+        yield cur
+    finally:
+        _local.context = prev
+
+def propagate(fn):
+    """Wrap a function to run in other threads with the stage and task of the caller.
+    """
+    context = _get_context()
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        with _updated_context(**context):
+            return fn(*args, **kwargs)
+    return run
+
+# Databases with an up to date schema, checked once per process
+_prepared = set()
+
+def _connect(db_file):
+    # Default rollback journal: WAL is not safe on shared network filesystems
+    conn = sqlite3.connect(db_file, timeout=60)
+    if db_file not in _prepared:
+        conn.execute(_SCHEMA)
+        existing = set(r[1] for r in conn.execute("PRAGMA table_info(usage)"))
+        for name, ctype in _ADDED_COLUMNS:
+            if name not in existing:
+                conn.execute("ALTER TABLE usage ADD COLUMN %s %s" % (name, ctype))
+        _prepared.add(db_file)
+    return conn
+
+def write(db_file, records):
+    """Store usage records in a single transaction, ignoring failures so telemetry never interrupts a run.
+    """
+    if isinstance(records, dict):
+        records = [records]
+    if not db_file or not records:
+        return
+    try:
+        if not os.path.exists(os.path.dirname(db_file)):
+            os.makedirs(os.path.dirname(db_file))
+        conn = _connect(db_file)
+        with conn:
+            for record in records:
+                conn.execute("INSERT INTO usage (%s) VALUES (%s)" % (", ".join(record.keys()),
+                                                                    ", ".join("?" * len(record))),
+                             list(record.values()))
+        conn.close()
+    except (sqlite3.Error, OSError) as e:
+        _prepared.discard(db_file)
+        logger.debug("Could not write resource usage to %s: %s" % (db_file, e))
+
+def _flush(records):
+    """Write buffered records, grouped by database.
+    """
+    by_db = {}
+    for db_file, record in records:
+        by_db.setdefault(db_file, []).append(record)
+    for db_file, cur in by_db.items():
+        write(db_file, cur)
+
+# ## Measurement
+
+def _rss_kb(pid):
+    try:
+        with open("/proc/%s/status" % pid) as in_handle:
+            for line in in_handle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return 0
+
+def _children(pid):
+    out = []
+    try:
+        for tid in os.listdir("/proc/%s/task" % pid):
+            with open("/proc/%s/task/%s/children" % (pid, tid)) as in_handle:
+                out.extend(int(x) for x in in_handle.read().split())
+    except (IOError, OSError, ValueError):
+        pass
+    return out
+
+def _tree_rss_kb(pid):
+    total = 0
+    to_check = [pid]
+    while to_check:
+        cur = to_check.pop()
+        total += _rss_kb(cur)
+        to_check.extend(_children(cur))
+    return total
+
+class _Sampler(threading.Thread):
+    """Track peak resident memory of child processes of this process.
+    """
+    def __init__(self, include_self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.peak_kb = 0
+        self._include_self = include_self
+        self._done = threading.Event()
+
+    def sample(self):
+        pid = os.getpid()
+        cur = sum(_tree_rss_kb(c) for c in _children(pid))
+        if self._include_self:
+            cur += _rss_kb(pid)
+        self.peak_kb = max(self.peak_kb, cur)
+
+    def run(self):
+        while not self._done.wait(SAMPLE_INTERVAL):
+            self.sample()
+
+    def stop(self):
+        self.sample()
+        self._done.set()
+
+class Measurement:
+    """Resource usage of a single command or task, from start until finish.
+    """
+    def __init__(self, kind, label, data=None, region=None, include_self=False):
+        self.kind = kind
+        self.label = label
+        self.data = data
+        self.region = region
+        self.db = _db_from_data(data)
+        self._context = _get_context()
+        self.parent = self._context["measurement"]
+        self.shared = False
+        self._finished = False
+        self._start_shared()
+        self._start = time.time()
+        self._self0 = resource.getrusage(resource.RUSAGE_SELF)
+        self._child0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._moves0 = transaction.move_stats()
+        self._sampler = _Sampler(include_self)
+        self._sampler.start()
+
+    def _ancestors(self):
+        out = set()
+        cur = self.parent
+        while cur is not None:
+            out.add(cur)
+            cur = cur.parent
+        return out
+
+    def _start_shared(self):
+        """Mark this and other open measurements as shared when they run concurrently.
+
+        Enclosing measurements, like a task around its commands, include the
+        usage of nested measurements and are not concurrent with them.
+        """
+        ancestors = self._ancestors()
+        with _open_lock:
+            for other in _open:
+                if other not in ancestors and self not in other._ancestors():
+                    other.shared = True
+                    self.shared = True
+            _open.add(self)
+
+    def finish(self, succeeded=True):
+        if self._finished:
+            return
+        self._finished = True
+        self._sampler.stop()
+        with _open_lock:
+            _open.discard(self)
+        moves1 = transaction.move_stats()
+        sample, region = _get_sample_and_region(self.data, self.region)
+        record = {"kind": self.kind, "block": self._context["block"], "stage": self._context["stage"],
+                  "sample": sample, "region": region, "label": self.label,
+                  "host": socket.gethostname(), "cores": _get_cores(self.data),
+                  "start": self._start, "wall": time.time() - self._start,
+                  "success": int(succeeded), "shared": int(self.shared),
+                  "renamed_mb": (moves1["renamed_bytes"] - self._moves0["renamed_bytes"]) / 1e6,
+                  "copied_mb": (moves1["copied_bytes"] - self._moves0["copied_bytes"]) / 1e6}
+        if not self.shared:
+            record.update(self._usage())
+        if self._context["buffer"] is not None:
+            self._context["buffer"].append((self.db, record))
+        else:
+            write(self.db, record)
+
+    def _usage(self):
+        """CPU, memory and I/O, attributable to this measurement when nothing else runs concurrently.
+        """
+        child1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        user = child1.ru_utime - self._child0.ru_utime
+        sys_time = child1.ru_stime - self._child0.ru_stime
+        blocks_in = child1.ru_inblock - self._child0.ru_inblock
+        blocks_out = child1.ru_oublock - self._child0.ru_oublock
+        if self.kind == "task":
+            self1 = resource.getrusage(resource.RUSAGE_SELF)
+            user += self1.ru_utime - self._self0.ru_utime
+            sys_time += self1.ru_stime - self._self0.ru_stime
+            blocks_in += self1.ru_inblock - self._self0.ru_inblock
+            blocks_out += self1.ru_oublock - self._self0.ru_oublock
+        max_rss_kb = self._sampler.peak_kb
+        # Child maxrss only increases when the new child is the largest seen, but is exact then
+        if child1.ru_maxrss > self._child0.ru_maxrss:
+            max_rss_kb = max(max_rss_kb, child1.ru_maxrss)
+        return {"user": user, "sys": sys_time, "max_rss_mb": max_rss_kb / 1024.0,
+                "read_mb": blocks_in * 512 / 1e6, "write_mb": blocks_out * 512 / 1e6}
+
+def _get_sample_and_region(data, region=None):
+    sample = None
+    if isinstance(data, dict):
+        sample = (data.get("rgnames") or {}).get("sample") or data.get("description")
+        region = region or data.get("region")
+    if region and not isinstance(region, str):
+        region = "%s:%s-%s" % tuple(region) if len(region) == 3 else str(region)
+    return sample, region
+
+def _get_cores(data):
+    if isinstance(data, dict):
+        return (data.get("config") or {}).get("algorithm", {}).get("num_cores")
+
+def _find_data(args):
+    for arg in args:
+        if isinstance(arg, dict) and "dirs" in arg:
+            return arg
+        elif isinstance(arg, (list, tuple)) and len(arg) > 0 and isinstance(arg[0], dict) and "dirs" in arg[0]:
+            return arg[0]
+
+def timed_task(fn, fn_name, block, *args):
+    """Run a parallel task function, recording its resource usage and tagging commands it runs.
+
+    block is the name of the prun.start section running the task, used to
+    group tasks with shared resource allocations.
+    """
+    data = _find_data(args)
+    records = []
+    with _updated_context(block=block, stage=fn_name, db=_db_from_data(data), buffer=records) as cur:
+        m = Measurement("task", fn_name, data, include_self=True)
+        cur["measurement"] = m
+        succeeded = False
+        try:
+            out = fn(*args)
+            succeeded = True
+            return out
+        finally:
+            m.finish(succeeded)
+            _flush(records)
+
+@contextlib.contextmanager
+def stage(label, dirs):
+    """Record wall time of a pipeline stage run from the main process.
+    """
+    db = get_db(dirs["work"]) if dirs and dirs.get("work") else _get_context()["db"]
+    records = []
+    with _updated_context(db=db, stage=label, buffer=records):
+        start = time.time()
+        try:
+            yield None
+        finally:
+            records.append((db, {"kind": "stage", "stage": label, "label": label,
+                                 "host": socket.gethostname(), "start": start,
+                                 "wall": time.time() - start, "success": 1}))
+            _flush(records)
+
+# ## Summary
+
+def block_memory(db_file, block):
+    """Retrieve measured peak memory per core, in Gb, for successful tasks in a parallel block.
+
+    Returns the largest per-core peak and the number of tasks measured.
+    """
+    if not db_file or not os.path.exists(db_file):
+        return None, 0
+    try:
+        conn = _connect(db_file)
+        rows = conn.execute("SELECT max_rss_mb, cores FROM usage WHERE kind = 'task' AND block = ? "
+                            "AND success = 1 AND max_rss_mb > 0", (block,)).fetchall()
+        conn.close()
+    except sqlite3.Error as e:
+        logger.debug("Could not read resource usage from %s: %s" % (db_file, e))
+        return None, 0
+    if not rows:
+        return None, 0
+    return max(rss / 1024.0 / max(1, cores or 1) for rss, cores in rows), len(rows)
+
+def summarize(db_file, top_n=10, kind="cmd"):
+    """Retrieve the top_n most expensive records by wall time for each stage.
+    """
+    conn = _connect(db_file)
+    rows = conn.execute("SELECT stage, label, sample, region, wall, user, sys, max_rss_mb, read_mb, write_mb, "
+                        "renamed_mb, copied_mb FROM usage WHERE kind = ? ORDER BY stage, wall DESC", (kind,)).fetchall()
+    conn.close()
+    out = {}
+    for row in rows:
+        cur = out.setdefault(row[0] or "", [])
+        if len(cur) < top_n:
+            cur.append(row)
+    return out
+
+def add_subparser(subparsers):
+    parser = subparsers.add_parser("telemetry",
+                                   help="Summarize recorded resource usage of commands and tasks")
+    parser.add_argument("--workdir", default=os.getcwd(),
+                        help="Directory of the bcbio run. Defaults to current working directory")
+    parser.add_argument("-n", "--top", type=int, default=10,
+                        help="Number of most expensive records to report per stage")
+    parser.add_argument("--kind", default="cmd", choices=["cmd", "task", "stage"],
+                        help="Type of records to summarize: external commands, parallel tasks or stages")
+    return parser
+
+def process(args):
+    db_file = get_db(os.path.abspath(args.workdir))
+    if not os.path.exists(db_file):
+        print("No resource usage recorded in %s" % db_file)
+        return
+    for stage_name, rows in sorted(summarize(db_file, args.top, args.kind).items()):
+        print("== %s" % (stage_name or "unknown stage"))
+        print("\t".join(["wall_s", "user_s", "sys_s", "max_rss_mb", "read_mb", "write_mb",
+                         "renamed_mb", "copied_mb", "sample", "region", "label"]))
+        for (_, label, sample, region, wall, user, sys_time, rss, read_mb, write_mb,
+             renamed_mb, copied_mb) in rows:
+            label = " ".join(str(label).split())
+            print("%.1f\t%.1f\t%.1f\t%.0f\t%.0f\t%.0f\t%.0f\t%.0f\t%s\t%s\t%s" %
+                  (wall, user or 0, sys_time or 0, rss or 0, read_mb or 0, write_mb or 0,
+                   renamed_mb or 0, copied_mb or 0, sample or "", region or "", label[:120]))
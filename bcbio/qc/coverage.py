@@ -50,26 +50,31 @@ def run(bam_file, data, out_dir):
     if mapped:
         out['Duplicates_pct'] = 100.0 * dups / mapped
 
-    if dd.get_coverage_interval(data) == "genome":
-        mapped_unique = mapped - dups
-    else:
-        mapped_unique = readstats.number_of_mapped_reads(data, bam_file, keep_dups=False)
+    # Count all targets together, with a single pass over the BAM file
+    targets = {}
+    if dd.get_coverage_interval(data) != "genome":
+        targets["mapped_unique"] = (None, None)
+    if merged_bed_file:
+        targets["ontarget"] = (merged_bed_file, target_name)
+        if dd.get_coverage_interval(data) != "genome":
+            # Skip padded calculation for WGS even if the "coverage" file is specified
+            # the padded statistic makes only sense for exomes and panels
+            padded_bed_file = bedutils.get_padded_bed_file(out_dir, merged_bed_file, 200, data)
+            targets["ontarget_padded"] = (padded_bed_file, target_name + "_padded")
+    counts = dict(zip(targets.keys(),
+                      readstats.mapped_reads_by_target(data, bam_file, list(targets.values()), keep_dups=False)))
+
+    mapped_unique = counts.get("mapped_unique", mapped - dups)
     out['Mapped_unique_reads'] = mapped_unique
 
     if merged_bed_file:
-        ontarget = readstats.number_of_mapped_reads(
-            data, bam_file, keep_dups=False, bed_file=merged_bed_file, target_name=target_name)
+        ontarget = counts["ontarget"]
         out["Ontarget_unique_reads"] = ontarget
         if mapped_unique:
             out["Ontarget_pct"] = 100.0 * ontarget / mapped_unique
             out['Offtarget_pct'] = 100.0 * (mapped_unique - ontarget) / mapped_unique
-            if dd.get_coverage_interval(data) != "genome":
-                # Skip padded calculation for WGS even if the "coverage" file is specified
-                # the padded statistic makes only sense for exomes and panels
-                padded_bed_file = bedutils.get_padded_bed_file(out_dir, merged_bed_file, 200, data)
-                ontarget_padded = readstats.number_of_mapped_reads(
-                    data, bam_file, keep_dups=False, bed_file=padded_bed_file, target_name=target_name + "_padded")
-                out["Ontarget_padded_pct"] = 100.0 * ontarget_padded / mapped_unique
+            if "ontarget_padded" in counts:
+                out["Ontarget_padded_pct"] = 100.0 * counts["ontarget_padded"] / mapped_unique
         if total_reads:
             out['Usable_pct'] = 100.0 * ontarget / total_reads
 
@@ -2,18 +2,84 @@
 count number of reads mapping to features of transcripts
 
 """
+import concurrent.futures
+import io
 import os
+import re
+import numpy as np
 import pandas as pd
-from collections import defaultdict
-import gffutils
 from bcbio.log import logger
 
-from bcbio.utils import file_exists
+from bcbio.distributed.transaction import file_transaction
+from bcbio.utils import file_exists, open_gzipsafe
+
+MAX_WORKERS = 8
+# Values column of two column count files, removed to retrieve feature identifiers
+_VALUES_RE = re.compile(br"\t[^\n]*")
+
+def _read_count_file(fname):
+    """Read feature identifiers and values of a two column count file, skipping comments.
+
+    Feature identifiers remain as raw bytes, so files can be compared to the
+    first file without parsing identifiers into strings.
+    """
+    with open(fname, "rb") as in_handle:
+        data = in_handle.read()
+    if data.startswith(b"#") or b"\n#" in data:
+        data = b"".join(l for l in data.splitlines(True) if not l.strip().startswith(b"#"))
+    if not data.endswith(b"\n"):
+        data += b"\n"
+    ids = _VALUES_RE.sub(b"", data)
+    vals = pd.read_csv(io.BytesIO(data), sep="\t", header=None, usecols=[1]).iloc[:, 0].values
+    return ids, vals
+
+def _ids_to_index(ids, fname):
+    index = pd.Index(ids.decode("utf-8").split("\n")[:-1], name="id")
+    if index.has_duplicates:
+        raise ValueError("Duplicate feature identifiers in count file %s" % fname)
+    return index
+
+def _combine_columns(files, col_names, reads):
+    """Align count columns on feature identifiers, in the order of the first file.
+
+    Keeps only values for files matching the features of the first file, the
+    common case, and aligns the remaining files by their identifiers.
+    """
+    first_ids = None
+    vals = []
+    aligned = True
+    for fname, (ids, cur_vals) in zip(files, reads):
+        if first_ids is None:
+            first_ids = ids
+            index = _ids_to_index(ids, fname)
+        if ids == first_ids:
+            vals.append(cur_vals)
+        else:
+            aligned = False
+            vals.append(pd.Series(cur_vals, index=_ids_to_index(ids, fname)))
+    if aligned:
+        out = np.empty((len(index), len(vals)), dtype=np.result_type(*vals))
+        for i, v in enumerate(vals):
+            out[:, i] = v
+        return pd.DataFrame(out, index=index, columns=col_names)
+    cols = [(v if isinstance(v, pd.Series) else pd.Series(v, index=index)).rename(n)
+            for n, v in zip(col_names, vals)]
+    df = pd.concat(cols, axis=1, join="outer", sort=False)
+    missing = df.isnull().values.sum()
+    if missing:
+        logger.warning("Count files have different features, setting %s missing values to zero." % missing)
+        df = df.fillna(0)
+        if all(np.issubdtype(c.dtype, np.integer) for c in cols):
+            df = df.astype(np.int64)
+    return df
 
 def combine_count_files(files, out_file=None, ext=".counts"):
     """
     combine a set of count files into a single combined file
     ext: remove this extension from the count files
+
+    Files read in parallel and align on feature identifiers. Also writes the
+    combined matrix to a numpy archive next to out_file for fast loading.
     """
     files = list(files)
     files = [x for x in files if file_exists(x)]
@@ -26,58 +92,66 @@ def combine_count_files(files, out_file=None, ext=".counts"):
     if file_exists(out_file):
         return out_file
     logger.info("Combining count files into %s." % out_file)
-    row_names = []
-    col_vals = defaultdict(list)
-    for i, f in enumerate(files):
-        vals = []
-        if i == 0:
-            with open(f) as in_handle:
-                for line in in_handle:
-                    if not line.strip().startswith("#"):
-                        rname, val = line.strip().split("\t")
-                        row_names.append(rname)
-                        vals.append(val)
-        else:
-            with open(f) as in_handle:
-                for line in in_handle:
-                    if not line.strip().startswith("#"):
-                        try:
-                            _, val = line.strip().split("\t")
-                        except ValueError:
-                            print(f, line)
-                            raise
-                        vals.append(val)
-        col_vals[col_names[i]] = vals
-
-    df = pd.DataFrame(col_vals, index=row_names)
-    df.to_csv(out_file, sep="\t", index_label="id")
+    with concurrent.futures.ThreadPoolExecutor(min(MAX_WORKERS, len(files))) as pool:
+        df = _combine_columns(files, col_names, pool.map(_read_count_file, files))
+    with file_transaction(out_file) as tx_out_file:
+        df.to_csv(tx_out_file, sep="\t", index_label="id")
+    with file_transaction(_npz_file(out_file)) as tx_out_file:
+        with open(tx_out_file, "wb") as out_handle:
+            np.savez(out_handle, ids=np.array(df.index, dtype=str), samples=np.array(df.columns, dtype=str),
+                     counts=df.values)
     return out_file
 
+def _npz_file(count_file):
+    return count_file + ".npz"
+
+def load_combined_count_file(count_file):
+    """Load a combined count matrix, from the numpy archive if available.
+    """
+    npz_file = _npz_file(count_file)
+    if file_exists(npz_file) and os.path.getmtime(npz_file) >= os.path.getmtime(count_file):
+        with np.load(npz_file) as npz:
+            return pd.DataFrame(npz["counts"], index=pd.Index(npz["ids"], name="id"),
+                                columns=npz["samples"])
+    return pd.read_csv(count_file, sep="\t", index_col=0, header=0)
+
+def _gene_symbols(gtf_file):
+    """Retrieve gene names for gene IDs from GTF exons, or None if genes lack IDs or names.
+    """
+    id_re = re.compile(r'gene_id "([^"]*)"')
+    name_re = re.compile(r'gene_name "([^"]*)"')
+    symbols = {}
+    with open_gzipsafe(gtf_file) as in_handle:
+        for line in in_handle:
+            parts = line.split("\t", 8)
+            if len(parts) < 9 or parts[2] != "exon":
+                continue
+            gene_id = id_re.search(parts[8])
+            gene_name = name_re.search(parts[8])
+            if not gene_id or not gene_name:
+                return None
+            symbols.setdefault(gene_id.group(1), gene_name.group(1))
+    return symbols
+
 def annotate_combined_count_file(count_file, gtf_file, out_file=None):
+    """Add gene symbols to a combined count file, from gene names in the GTF.
+    """
     if not count_file:
         return None
-    dbfn = gtf_file + ".db"
-    if not file_exists(dbfn):
-        return None
-
-    if not gffutils:
+    if not gtf_file or not file_exists(gtf_file):
         return None
 
-    db = gffutils.FeatureDB(dbfn, keep_order=True)
-
     if not out_file:
         out_dir = os.path.dirname(count_file)
         out_file = os.path.join(out_dir, "annotated_combined.counts")
 
     # if the genes don't have a gene_id or gene_name set, bail out
-    try:
-        symbol_lookup = {f['gene_id'][0]: f['gene_name'][0] for f in
-                         db.features_of_type('exon')}
-    except KeyError:
+    symbol_lookup = _gene_symbols(gtf_file)
+    if symbol_lookup is None:
         return None
 
-    df = pd.io.parsers.read_csv(count_file, sep="\t", index_col=0, header=0)
-
-    df['symbol'] = df.apply(lambda x: symbol_lookup.get(x.name, ""), axis=1)
-    df.to_csv(out_file, sep="\t", index_label="id")
+    df = load_combined_count_file(count_file)
+    df['symbol'] = df.index.map(lambda x: symbol_lookup.get(x, ""))
+    with file_transaction(out_file) as tx_out_file:
+        df.to_csv(tx_out_file, sep="\t", index_label="id")
     return out_file
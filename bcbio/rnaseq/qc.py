@@ -8,35 +8,25 @@ except ImportError:
     pd, sm = None, None
 
 from bcbio import bam
+from bcbio.bam import stats as bamstats
+from bcbio.pipeline import datadict as dd
 
-def starts_by_depth(bam_file, data, sample_size=10000000):
+def starts_by_depth(bam_file, data, sample_size=None, error=bamstats.STARTS_ERROR):
     """
     Return a set of x, y points where x is the number of reads sequenced and
     y is the number of unique start sites identified
-    If sample size < total reads in a file the file will be downsampled.
+    Uses all mapped reads, unless sample size < total reads in a file, in
+    which case the file will be downsampled. Unique starts for large files
+    are estimated with the given relative error; pass error=None for exact counts.
     """
-    binsize = (sample_size / 100) + 1
-    seen_starts = set()
-    counted = 0
-    num_reads = []
-    starts = []
-    buffer = []
-    downsampled = bam.downsample(bam_file, data, sample_size)
-    with bam.open_samfile(downsampled) as samfile:
-        for read in samfile:
-            if read.is_unmapped:
-                continue
-            counted += 1
-            buffer.append(str(read.tid) + ":" + str(read.pos))
-            if counted % binsize == 0:
-                seen_starts.update(buffer)
-                buffer = []
-                num_reads.append(counted)
-                starts.append(len(seen_starts))
-        seen_starts.update(buffer)
-        num_reads.append(counted)
-        starts.append(len(seen_starts))
-    return pd.DataFrame({"reads": num_reads, "starts": starts})
+    if sample_size:
+        in_bam = bam.downsample(bam_file, data, sample_size) or bam_file
+    else:
+        in_bam = bam_file
+        sample_size = sum(x.aligned for x in bam.idxstats(bam_file, data))
+    stats = bamstats.get(in_bam, ["starts"], starts_sample_size=sample_size, starts_error=error,
+                         work_dir=dd.get_work_dir(data))
+    return pd.DataFrame({"reads": stats["starts_reads"], "starts": stats["starts_unique"]})
 
 
 def estimate_library_complexity(df, algorithm="RNA-seq"):
@@ -4,13 +4,17 @@ Most of this either uses Valentine Svennson's umis repository or adapts
 code written from it.
 https://github.com/vals/umis
 """
+import numpy as np
 import pandas as pd
 import scipy.io
+import scipy.sparse
 import os
 import copy
 import glob
+import shutil
 import sys
 import subprocess
+import zipfile
 from itertools import repeat, islice
 from distutils.version import LooseVersion
 
@@ -43,15 +47,17 @@ class SparseMatrix(object):
         """read a sparse matrix, loading row and column name files. if
         specified, will add a prefix to the row or column names"""
 
-        self.matrix = scipy.io.mmread(filename)
-        with open(filename + ".rownames") as in_handle:
-            self.rownames = [x.strip() for x in in_handle]
-            if rowprefix:
-                self.rownames = [rowprefix + delim + x for x in self.rownames]
-        with open(filename + ".colnames") as in_handle:
-            self.colnames = [x.strip() for x in in_handle]
-            if colprefix:
-                self.colnames = [colprefix + delim + x for x in self.colnames]
+        _, shape, vals, rows, indptr = _read_mtx_csc(filename)
+        self.matrix = scipy.sparse.csc_matrix((vals, rows, indptr), shape=shape)
+        self.rownames = _read_names(filename + ".rownames", rowprefix, delim)
+        self.colnames = _read_names(filename + ".colnames", colprefix, delim)
+
+    def read_npz(self, filename):
+        """read a sparse matrix with row and column names from a binary npz file"""
+        self.matrix = scipy.sparse.load_npz(filename)
+        with np.load(filename, allow_pickle=False) as in_handle:
+            self.rownames = [str(x) for x in in_handle["rownames"]]
+            self.colnames = [str(x) for x in in_handle["colnames"]]
 
     def write(self, filename):
         """read a sparse matrix, loading row and column name files"""
@@ -440,13 +446,9 @@ def concatenate_sparse_matrices(samples, deduped=True):
                     dd.sample_data_iterator(samples) if dd.get_count_file(data)]
     if not files:
         return samples
-    counts = SparseMatrix()
-    counts.read(filename=files.pop(), colprefix=descriptions.pop())
-    for filename, description in zip(files, descriptions):
-        newcounts = SparseMatrix()
-        newcounts.read(filename=filename, colprefix=description)
-        counts.cat(newcounts)
-    counts.write(out_file)
+    # keep the historical column order: last sample first, then the rest in order
+    write_concatenated_counts(files[-1:] + files[:-1],
+                              descriptions[-1:] + descriptions[:len(files) - 1], out_file)
     newsamples = []
     if deduped:
         for data in dd.sample_data_iterator(samples):
@@ -454,6 +456,122 @@ def concatenate_sparse_matrices(samples, deduped=True):
         return newsamples
     return samples
 
+def _read_mtx_header(in_handle):
+    """Retrieve the value type and dimensions from an open MatrixMarket coordinate file.
+    """
+    banner = in_handle.readline().split()
+    if len(banner) < 5 or banner[2] != "coordinate" or banner[4] != "general":
+        raise ValueError("Expected general coordinate MatrixMarket file: %s" % " ".join(banner))
+    line = in_handle.readline()
+    while line.startswith("%"):
+        line = in_handle.readline()
+    nrows, ncols, nnz = [int(x) for x in line.split()]
+    return banner[3], nrows, ncols, nnz
+
+def _read_mtx_csc(filename):
+    """Read a MatrixMarket coordinate file as compressed sparse column components.
+
+    Uses the pandas C parser for entries and keeps duplicate entries, returning
+    the value type, shape, data, row indices and column pointers.
+    """
+    with open(filename) as in_handle:
+        field, nrows, ncols, nnz = _read_mtx_header(in_handle)
+        dtype = np.float64 if field == "real" else np.int64
+        if nnz > 0:
+            entries = pd.read_csv(in_handle, sep=r"\s+", header=None, names=["row", "col", "val"],
+                                  dtype={"row": np.int32, "col": np.int32, "val": dtype},
+                                  comment="%", float_precision="round_trip")
+            rows, cols, vals = entries["row"].values - 1, entries["col"].values - 1, entries["val"].values
+        else:
+            rows, cols, vals = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+                                np.zeros(0, dtype=dtype))
+    order = np.argsort(cols, kind="stable")
+    indptr = np.zeros(ncols + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cols, minlength=ncols), out=indptr[1:])
+    return field, (nrows, ncols), vals[order], rows[order].astype(np.int32), indptr
+
+def _read_names(filename, prefix=None, delim=":"):
+    with open(filename) as in_handle:
+        names = [x.strip() for x in in_handle]
+    if prefix:
+        names = [prefix + delim + x for x in names]
+    return names
+
+def _write_npy(zip_handle, name, values):
+    with zip_handle.open(name + ".npy", "w", force_zip64=True) as out_handle:
+        np.lib.format.write_array(out_handle, np.asarray(values), allow_pickle=False)
+
+def _copy_npy(zip_handle, name, dtype, in_file, length):
+    """Add a one dimensional array, stored as raw values in in_file, to an npz file.
+    """
+    with zip_handle.open(name + ".npy", "w", force_zip64=True) as out_handle:
+        np.lib.format.write_array_header_1_0(
+            out_handle, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                         "fortran_order": False, "shape": (length,)})
+        with open(in_file, "rb") as in_handle:
+            shutil.copyfileobj(in_handle, out_handle, 16 * 1024 * 1024)
+
+def write_concatenated_counts(files, descriptions, out_file):
+    """Concatenate per-sample MatrixMarket count files by column, one sample at a time.
+
+    Writes a combined MatrixMarket file with row and column names, plus the same
+    counts as compressed sparse columns in an npz file loadable with
+    scipy.sparse.load_npz, including rownames and colnames arrays. Only one
+    sample is in memory at a time, with combined values and row indices staged
+    on disk.
+    """
+    npz_file = os.path.splitext(out_file)[0] + ".npz"
+    headers = []
+    for fn in files:
+        with open(fn) as in_handle:
+            headers.append(_read_mtx_header(in_handle))
+    nrows = headers[0][1]
+    if any(h[1] != nrows for h in headers):
+        raise ValueError("Count matrices have different numbers of rows: %s" %
+                         ", ".join("%s: %s" % (fn, h[1]) for fn, h in zip(files, headers)))
+    field = "real" if any(h[0] == "real" for h in headers) else "integer"
+    dtype = np.float64 if field == "real" else np.int64
+    total_cols = sum(h[2] for h in headers)
+    total_nnz = sum(h[3] for h in headers)
+    out_files = [out_file, out_file + ".rownames", out_file + ".colnames", npz_file]
+    with file_transaction(out_files) as tx_out_files:
+        tx_data = tx_out_files[3] + "-data.tmp"
+        tx_indices = tx_out_files[3] + "-indices.tmp"
+        indptr = [np.zeros(1, dtype=np.int64)]
+        colnames = []
+        col_offset = nnz_offset = 0
+        with open(tx_out_files[0], "w") as out_handle, open(tx_data, "wb") as data_handle, \
+             open(tx_indices, "wb") as indices_handle:
+            out_handle.write("%%%%MatrixMarket matrix coordinate %s general\n" % field)
+            out_handle.write("%d %d %d\n" % (nrows, total_cols, total_nnz))
+            for fn, description in zip(files, descriptions):
+                _, (_, ncols), vals, rows, cur_indptr = _read_mtx_csc(fn)
+                vals = vals.astype(dtype)
+                cols = np.repeat(np.arange(ncols, dtype=np.int64), np.diff(cur_indptr))
+                entries = pd.DataFrame({"row": rows + 1, "col": cols + col_offset + 1, "val": vals})
+                entries.to_csv(out_handle, sep=" ", header=False, index=False,
+                               float_format="%.17g" if field == "real" else None)
+                data_handle.write(vals.tobytes())
+                indices_handle.write(rows.tobytes())
+                indptr.append(cur_indptr[1:] + nnz_offset)
+                colnames.extend(_read_names(fn + ".colnames", description))
+                col_offset += ncols
+                nnz_offset += len(vals)
+        rownames = _read_names(files[0] + ".rownames")
+        pd.Series(rownames).to_csv(tx_out_files[1], index=False, header=False)
+        pd.Series(colnames).to_csv(tx_out_files[2], index=False, header=False)
+        with zipfile.ZipFile(tx_out_files[3], "w", zipfile.ZIP_STORED, allowZip64=True) as zip_handle:
+            _write_npy(zip_handle, "format", np.array(b"csc"))
+            _write_npy(zip_handle, "shape", np.array([nrows, total_cols], dtype=np.int64))
+            _copy_npy(zip_handle, "data", dtype, tx_data, nnz_offset)
+            _copy_npy(zip_handle, "indices", np.int32, tx_indices, nnz_offset)
+            _write_npy(zip_handle, "indptr", np.concatenate(indptr))
+            _write_npy(zip_handle, "rownames", np.array(rownames, dtype=str))
+            _write_npy(zip_handle, "colnames", np.array(colnames, dtype=str))
+        for tmp_file in [tx_data, tx_indices]:
+            os.remove(tmp_file)
+    return out_file
+
 def concatenate_cb_histograms(samples):
     work_dir = dd.get_in_samples(samples, dd.get_work_dir)
     umi_dir = os.path.join(work_dir, "umis")
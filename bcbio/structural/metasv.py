@@ -33,8 +33,7 @@ def run(items):
     if len(methods) >= MIN_CALLERS:
         if not utils.file_exists(out_file):
             tx_work_dir = utils.safe_makedir(os.path.join(work_dir, "raw"))
-            ins_stats = shared.calc_paired_insert_stats_save(dd.get_align_bam(data),
-                                                             os.path.join(tx_work_dir, "insert-stats.yaml"))
+            ins_stats = shared.get_paired_insert_stats(data)
             cmd += ["--workdir", tx_work_dir, "--num_threads", str(dd.get_num_cores(data))]
             cmd += ["--spades", utils.which("spades.py"), "--age", utils.which("age_align")]
             cmd += ["--assembly_max_tools=1", "--assembly_pad=500"]
@@ -9,8 +9,9 @@ calling across all samples.
 import os
 import shutil
 import subprocess
-from collections import defaultdict
 
+import numpy as np
+import pandas as pd
 import pybedtools as bt
 import toolz as tz
 
@@ -238,7 +239,7 @@ def _calculate_coverage(data, work_dir, bed_file, sample_name):
 
 def _depth_to_seq2cov(input_fpath, output_fpath, sample_name):
     """Args:
-        input_fpath: output of "mosdepth":
+        input_fpath: output of "mosdepth", plain or bgzipped:
             chr22           14250   15500   name3   5.54
             chrM            100     1000    name1   916.08
 
@@ -250,51 +251,58 @@ def _depth_to_seq2cov(input_fpath, output_fpath, sample_name):
 
         sample_name:
             sample name (e.g. chr20_tumor_1)
+
+    Reads the regions once and calculates gene level coverage with cumulative
+    sums by gene. A Whole-Gene row follows the region reaching the last end of
+    its gene, summarizing the gene's regions up to that point.
     """
-    # First round: collecting gene ends
-    gene_end_by_gene = defaultdict(lambda: -1)
-    with utils.open_gzipsafe(input_fpath) as f:
-        for xs in (l.rstrip().split() for l in f if not l.startswith("#")):
-            xs = [x for x in xs if x.strip()]
-            if any(x == "." for x in xs): continue
-            end = int(xs[2])
-            gene_name = xs[3]
-            gene_end_by_gene[gene_name] = max(gene_end_by_gene[gene_name], end)
-
-    # Second round: calculating gene level coverage, and writing file for Seq2C
-    total_cov_by_gene = dict()
-    gene_start_by_gene = dict()
-    total_size_by_gene = dict()
-
-    with utils.open_gzipsafe(input_fpath) as f, open(output_fpath, 'w') as out:
-        for xs in (l.rstrip().split() for l in f if not l.startswith("#")):
-            xs = [x for x in xs if x.strip()]
-            if any(x == "." for x in xs): continue
-            chrom, start, end, gene_name = xs[:4]
-            start, end = int(start), int(end)
-            ave_depth = float(xs[-1])
-
-            if gene_name not in gene_start_by_gene:
-                gene_start_by_gene[gene_name] = start
-                total_cov_by_gene[gene_name] = 0
-                total_size_by_gene[gene_name] = 0
-            else:
-                gene_start_by_gene[gene_name] = min(start, gene_start_by_gene[gene_name])
-            total_cov_by_gene[gene_name] += ave_depth * (end - start)
-            total_size_by_gene[gene_name] += end - start
-
-            fs = [sample_name, gene_name, chrom, str(start + 1), str(end), 'Amplicon', str(end - start), str(ave_depth)]
-            out.write('\t'.join(fs) + '\n')
-
-            if end >= gene_end_by_gene[gene_name]:
-                assert end == gene_end_by_gene[gene_name], (end, gene_end_by_gene[gene_name])
-                start = gene_start_by_gene[gene_name]
-                ave_depth = total_cov_by_gene[gene_name] / total_size_by_gene[gene_name]
-                size = total_size_by_gene[gene_name]
-                fs = [sample_name, gene_name, chrom, str(start + 1), str(end), 'Whole-Gene', str(size), str(ave_depth)]
-                out.write('\t'.join(fs) + '\n')
+    try:
+        df = pd.read_csv(input_fpath, sep="\t", header=None, comment="#", na_values=["."],
+                         keep_default_na=False, dtype={0: str, 3: str})
+    except pd.errors.EmptyDataError:
+        open(output_fpath, "w").close()
+        return output_fpath
+    df = df.dropna()
+    chrom = df[0].values.astype(str)
+    gene = df[3].values.astype(str)
+    start = df[1].values.astype(np.int64)
+    end = df[2].values.astype(np.int64)
+    depth = df[df.columns[-1]].values.astype(np.float64)
+    size = end - start
+    codes = pd.factorize(gene)[0]
+    gene_start = pd.Series(start).groupby(codes, sort=False).cummin().values
+    total_size = pd.Series(size).groupby(codes, sort=False).cumsum().values
+    total_cov = _cumsum_by_group(depth * size, codes)
+    is_gene_end = end == pd.Series(end).groupby(codes, sort=False).transform("max").values
+
+    # Interleave Whole-Gene rows after the region completing each gene
+    gene_idx = np.flatnonzero(is_gene_end)
+    idx = np.concatenate([np.arange(len(df)), gene_idx])
+    is_amplicon = np.concatenate([np.ones(len(df), dtype=bool), np.zeros(len(gene_idx), dtype=bool)])
+    order = np.argsort(np.concatenate([np.arange(len(df)) * 2, gene_idx * 2 + 1]), kind="stable")
+    idx, is_amplicon = idx[order], is_amplicon[order]
+    out_start = np.where(is_amplicon, start[idx], gene_start[idx]) + 1
+    out_size = np.where(is_amplicon, size[idx], total_size[idx])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out_depth = np.where(is_amplicon, depth[idx], total_cov[idx] / total_size[idx])
+    with open(output_fpath, "w") as out:
+        out.write("".join("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%r\n" % (sample_name, g, c, s, e, t, n, d)
+                          for g, c, s, e, t, n, d in
+                          zip(gene[idx].tolist(), chrom[idx].tolist(), out_start.tolist(), end[idx].tolist(),
+                              np.where(is_amplicon, "Amplicon", "Whole-Gene").tolist(),
+                              out_size.tolist(), out_depth.tolist())))
     return output_fpath
 
+def _cumsum_by_group(vals, codes):
+    """Cumulative sums within groups, adding values in order as a running total would.
+    """
+    out = np.empty(len(vals), dtype=np.float64)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    for cur in np.split(order, bounds):
+        out[cur] = np.cumsum(vals[cur])
+    return out
+
 def _combine_coverages(items, work_dir, input_backs=None):
     """Combine coverage cnns calculated for individual inputs into single file.
 
@@ -307,7 +315,7 @@ def _combine_coverages(items, work_dir, input_backs=None):
                 for data in items:
                     cov_file = tz.get_in(["depth", "bins", "seq2c"], data)
                     with open(cov_file) as cov_f:
-                        out_f.write(cov_f.read())
+                        shutil.copyfileobj(cov_f, out_f)
                 if input_backs:
                     for input_back in input_backs:
                         with open(input_back) as in_handle:
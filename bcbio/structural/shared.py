@@ -5,7 +5,6 @@ Handles exclusion regions and preparing discordant regions.
 import collections
 import os
 
-import numpy
 import pybedtools
 import pysam
 import toolz as tz
@@ -14,6 +13,7 @@ import yaml
 from bcbio import bam, utils
 from bcbio.distributed.transaction import file_transaction
 from bcbio.bam import callable
+from bcbio.bam import stats as bamstats
 from bcbio.pipeline import datadict as dd
 from bcbio.pipeline import shared
 from bcbio.provenance import do
@@ -294,30 +294,33 @@ def outname_from_inputs(in_files):
 
 def insert_size_stats(dists):
     """Calcualtes mean/median and MAD from distances, avoiding outliers.
-
-    MAD is the Median Absolute Deviation: http://en.wikipedia.org/wiki/Median_absolute_deviation
     """
-    med = numpy.median(dists)
-    filter_dists = list(filter(lambda x: x < med + 10 * med, dists))
-    median = numpy.median(filter_dists)
-    return {"mean": float(numpy.mean(filter_dists)), "std": float(numpy.std(filter_dists)),
-            "median": float(median),
-            "mad": float(numpy.median([abs(x - median) for x in filter_dists]))}
-
-def calc_paired_insert_stats(in_bam, nsample=1000000):
+    return bamstats.insert_stats(dists)
+
+def calc_paired_insert_stats(in_bam, nsample=1000000, work_dir=None):
     """Retrieve statistics for paired end read insert distances.
     """
-    dists = []
-    n = 0
-    with pysam.Samfile(in_bam, "rb") as in_pysam:
-        for read in in_pysam:
-            if read.is_proper_pair and read.is_read1:
-                n += 1
-                dists.append(abs(read.isize))
-                if n >= nsample:
-                    break
+    if nsample <= bamstats.INSERT_READS:
+        dists = bamstats.get(in_bam, ["inserts"], work_dir=work_dir)["inserts"][:nsample]
+    else:
+        dists = []
+        n = 0
+        with pysam.Samfile(in_bam, "rb") as in_pysam:
+            for read in in_pysam:
+                if read.is_proper_pair and read.is_read1:
+                    n += 1
+                    dists.append(abs(read.isize))
+                    if n >= nsample:
+                        break
     return insert_size_stats(dists)
 
+def get_paired_insert_stats(data):
+    """Retrieve insert statistics sampled during alignment, calculating from the BAM if missing.
+    """
+    return ((dd.get_align_stats(data) or {}).get("insert_size") or
+            calc_paired_insert_stats(dd.get_align_bam(data) or dd.get_work_bam(data),
+                                     nsample=bamstats.INSERT_READS, work_dir=dd.get_work_dir(data)))
+
 def calc_paired_insert_stats_save(in_bam, stat_file, nsample=1000000):
     """Calculate paired stats, saving to a file for re-runs.
     """
@@ -7,7 +7,7 @@ import six
 import toolz as tz
 
 from bcbio import log, utils
-from bcbio.upload import shared, filesystem, galaxy, s3, irods
+from bcbio.upload import shared, filesystem, galaxy, s3, irods, transfer
 from bcbio.pipeline import run_info
 from bcbio.variation import vcfutils
 import bcbio.pipeline.datadict as dd
@@ -22,8 +22,7 @@ def project_from_sample(sample):
     upload_config = sample.get("upload")
     if upload_config:
         approach = _approaches[upload_config.get("method", "filesystem")]
-        for finfo in _get_files_project(sample, upload_config):
-            approach.update_file(finfo, None, upload_config)
+        transfer.run(_get_files_project(sample, upload_config), None, upload_config, approach, sample)
     return [[sample]]
 
 def from_sample(sample):
@@ -32,8 +31,7 @@ def from_sample(sample):
     upload_config = sample.get("upload")
     if upload_config:
         approach = _approaches[upload_config.get("method", "filesystem")]
-        for finfo in _get_files(sample):
-            approach.update_file(finfo, sample, upload_config)
+        transfer.run(_get_files(sample), sample, upload_config, approach, sample)
     return [[sample]]
 
 def get_all_upload_paths_from_sample(sample):
@@ -892,6 +890,10 @@ def _get_files_project(sample, upload_config):
                         "type": "colnames"})
             out.append({"path": count_file + ".metadata",
                         "type": "metadata"})
+            npz_file = os.path.splitext(count_file)[0] + ".npz"
+            if utils.file_exists(npz_file):
+                out.append({"path": npz_file,
+                            "type": "npz"})
             umi_file = os.path.splitext(count_file)[0] + "-dupes.mtx"
             if utils.file_exists(umi_file):
                 out.append({"path": umi_file,
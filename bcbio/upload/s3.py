@@ -44,7 +44,7 @@ def update_file(finfo, sample_info, config):
         key = bucket.get_key(keyname) if bucket else None
         modified = datetime.datetime.fromtimestamp(email.utils.mktime_tz(
             email.utils.parsedate_tz(key.last_modified))) if key else None
-        no_upload = key and modified >= finfo["mtime"]
+        no_upload = key and modified >= finfo["mtime"] and key.size == os.path.getsize(fname)
         if not no_upload:
             _upload_file_aws_cli(fname, config["bucket"], keyname, config, finfo)
 
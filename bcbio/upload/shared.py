@@ -14,4 +14,5 @@ def up_to_date(new, orig):
                 get_file_timestamp(new) >= orig["mtime"])
     else:
         return (utils.file_exists(new) and
-                get_file_timestamp(new) >= orig["mtime"])
+                get_file_timestamp(new) >= orig["mtime"] and
+                os.path.getsize(new) == os.path.getsize(orig["path"]))
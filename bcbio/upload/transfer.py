@@ -0,0 +1,118 @@
+"""Transfer final files to upload storage concurrently, journaling finished transfers.
+
+Builds the list of files to upload, removing duplicates going to the same
+destination, and transfers the largest files first using a pool of threads.
+Finished transfers go to a journal in the work directory with the size and
+modification time of the source, so restarted runs and later samples sharing
+project files skip them without checking remote storage. Remote transfers are
+journaled by their location in storage, so changing the bucket or folder
+uploads again.
+"""
+import concurrent.futures
+import os
+
+from bcbio import utils
+from bcbio.log import logger
+from bcbio.pipeline import datadict as dd
+from bcbio.upload import filesystem
+
+# Approaches safe to run with multiple concurrent transfers
+CONCURRENT_APPROACHES = set(["filesystem", "s3", "irods"])
+MAX_WORKERS = 8
+# Configuration identifying the remote location of uploads for each approach
+REMOTE_LOCATION_KEYS = {"s3": ["bucket", "region", "folder"],
+                        "irods": ["resource", "folder"],
+                        "galaxy": ["galaxy_url", "galaxy_library"]}
+
+def journal_file(sample):
+    return os.path.join(dd.get_work_dir(sample), "provenance", "upload_journal.tsv")
+
+def _source_info(fname):
+    if os.path.isdir(fname):
+        return "0", "%.0f" % os.path.getmtime(fname)
+    return str(os.path.getsize(fname)), "%.0f" % os.path.getmtime(fname)
+
+def read_journal(in_file):
+    """Retrieve finished transfers: destination to source path, size and modification time.
+    """
+    done = {}
+    if utils.file_exists(in_file):
+        with open(in_file) as in_handle:
+            for line in in_handle:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) == 4:
+                    done[parts[0]] = tuple(parts[1:])
+    return done
+
+def _record(out_file, dest, source):
+    """Append a finished transfer in a single small write, safe across processes.
+    """
+    utils.safe_makedir(os.path.dirname(out_file))
+    with open(out_file, "a") as out_handle:
+        out_handle.write("\t".join([dest, source] + list(_source_info(source))) + "\n")
+
+def _destination(finfo, sample, upload_config):
+    """Identify where a file is uploaded, for removing duplicates and journaling.
+
+    Remote approaches stage files in the upload directory, so use the remote
+    location plus the key below the staging directory.
+    """
+    dest = filesystem.get_upload_path(finfo, sample, upload_config) if "dir" in upload_config else None
+    dest = dest or finfo["path"]
+    method = upload_config.get("method", "filesystem")
+    if method in REMOTE_LOCATION_KEYS:
+        if "dir" in upload_config:
+            dest = os.path.relpath(dest, os.path.abspath(upload_config["dir"]))
+        location = [str(upload_config[k]).strip("/") for k in REMOTE_LOCATION_KEYS[method]
+                    if upload_config.get(k)]
+        dest = "%s://%s" % (method, "/".join(location + [dest.lstrip("/")]))
+    return dest
+
+def _is_done(done, dest, finfo, upload_config):
+    if dest not in done or done[dest][0] != finfo["path"]:
+        return False
+    if (upload_config.get("method", "filesystem") not in REMOTE_LOCATION_KEYS
+          and dest != finfo["path"] and not os.path.exists(dest)):
+        return False
+    return done[dest][1:] == _source_info(finfo["path"])
+
+def _size(finfo):
+    try:
+        return os.path.getsize(finfo["path"]) if not os.path.isdir(finfo["path"]) else 0
+    except OSError:
+        return 0
+
+def run(finfos, sample, upload_config, approach, data, max_workers=MAX_WORKERS):
+    """Upload files for a sample or project, skipping duplicates and journaled transfers.
+
+    sample is passed to the approach, and is None for project files. data is the
+    sample used to locate the journal in the work directory.
+    """
+    jfile = journal_file(data)
+    done = read_journal(jfile)
+    to_run = []
+    seen = set()
+    for finfo in finfos:
+        dest = _destination(finfo, sample, upload_config)
+        if dest in seen:
+            continue
+        seen.add(dest)
+        if not _is_done(done, dest, finfo, upload_config):
+            to_run.append((finfo, dest))
+    if len(finfos) > len(to_run):
+        logger.debug("Upload: skipping %s of %s files already transferred for %s" %
+                     (len(finfos) - len(to_run), len(finfos), dd.get_sample_name(sample) if sample else "project"))
+    to_run.sort(key=lambda x: _size(x[0]), reverse=True)
+    if upload_config.get("method", "filesystem") not in CONCURRENT_APPROACHES:
+        max_workers = 1
+
+    def _transfer(args):
+        finfo, dest = args
+        approach.update_file(finfo, sample, upload_config)
+        _record(jfile, dest, finfo["path"])
+    if max_workers > 1 and len(to_run) > 1:
+        with concurrent.futures.ThreadPoolExecutor(min(max_workers, len(to_run))) as pool:
+            list(pool.map(_transfer, to_run))
+    else:
+        for x in to_run:
+            _transfer(x)
@@ -513,6 +513,16 @@ def deepish_copy(org):
                     out[k] = v      # ints
     return out
 
+def shared_copy(org):
+    """Copy a dictionary, sharing nested values with the original.
+
+    Avoids deepish_copy when creating many variants of a sample, like
+    per-region tasks, that only assign top level keys. Nested values are
+    read only on the copy; code running tasks in the current process uses
+    deepish_copy before handing them off.
+    """
+    return dict(org)
+
 def safe_to_float(x):
     """Convert to float, handling None and non-float inputs.
 
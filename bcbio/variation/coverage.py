@@ -4,6 +4,7 @@ Provides estimates of coverage intervals based on callable regions
 """
 import collections
 import itertools
+import json
 import os
 import shutil
 import yaml
@@ -63,9 +64,8 @@ def assign_interval(data):
     return data
 
 def _count_offtarget(data, bam_file, bed_file, target_name):
-    mapped_unique = readstats.number_of_mapped_reads(data, bam_file, keep_dups=False)
-    ontarget = readstats.number_of_mapped_reads(
-        data, bam_file, keep_dups=False, bed_file=bed_file, target_name=target_name)
+    mapped_unique, ontarget = readstats.mapped_reads_by_target(
+        data, bam_file, [(None, None), (bed_file, target_name)], keep_dups=False)
     if mapped_unique:
         return float(mapped_unique - ontarget) / mapped_unique
     else:
@@ -135,44 +135,42 @@ def _subset_to_variant_regions(callable_file, variant_regions, data):
     return out_file
 
 def _get_cache_file(data, target_name):
-    prefix = os.path.join(
-        utils.safe_makedir(os.path.join(dd.get_work_dir(data), "align", dd.get_sample_name(data))),
-        "%s-coverage" % (dd.get_sample_name(data)))
+    """Back-compatible: YAML cache of previous versions.
+    """
+    prefix = os.path.join(dd.get_work_dir(data), "align", dd.get_sample_name(data),
+                          "%s-coverage" % (dd.get_sample_name(data)))
     cache_file = prefix + "-" + target_name + "-stats.yaml"
     return cache_file
 
 def _read_cache(cache_file, reuse_cmp_files):
     reuse_cmp_file = [fn for fn in reuse_cmp_files if fn]
-    if all(utils.file_uptodate(cache_file, fn) for fn in reuse_cmp_file):
+    if utils.file_exists(cache_file) and all(utils.file_uptodate(cache_file, fn) for fn in reuse_cmp_file):
         with open(cache_file) as in_handle:
-            return yaml.safe_load(in_handle)
+            return yaml.safe_load(in_handle) or dict()
     return dict()
 
-def _write_cache(cache, cache_file):
-    with open(cache_file, "w") as out_handle:
-        yaml.safe_dump(cache, out_handle, default_flow_style=False, allow_unicode=False)
-
 def get_average_coverage(target_name, bed_file, data, bam_file=None):
+    """Retrieve average coverage in target regions, cached with other sample statistics.
+    """
     if not bam_file:
         bam_file = dd.get_align_bam(data) or dd.get_work_bam(data)
 
-    cache_file = _get_cache_file(data, target_name)
-
-    if dd.get_disambiguate(data):
-        cache = _read_cache(cache_file, [bed_file])
-    else:
-        cache = _read_cache(cache_file, [bam_file, bed_file])
-
-    if "avg_coverage" in cache:
-        return int(cache["avg_coverage"])
+    cmp_files = [bed_file] if dd.get_disambiguate(data) else [bam_file, bed_file]
+    cache = readstats.get_cache(data)
+    key = json.dumps({"stat": "avg_coverage", "region": target_name, "sample": dd.get_sample_name(data)},
+                     separators=(",", ":"), sort_keys=True)
+    avg_cov = cache.get(key, cmp_files)
+    if avg_cov is None:
+        avg_cov = _read_cache(_get_cache_file(data, target_name), cmp_files).get("avg_coverage")
+    if avg_cov is not None:
+        return int(avg_cov)
 
     if bed_file:
         avg_cov = _average_bed_coverage(bed_file, target_name, data)
     else:
         avg_cov = _average_genome_coverage(data, bam_file)
 
-    cache["avg_coverage"] = int(avg_cov)
-    _write_cache(cache, cache_file)
+    cache.put(key, int(avg_cov))
     return int(avg_cov)
 
 def _average_genome_coverage(data, bam_file):
@@ -4,6 +4,7 @@ import os
 import collections
 import copy
 import pprint
+import time
 
 import six
 import toolz as tz
@@ -16,7 +17,7 @@ from bcbio.pipeline import datadict as dd
 from bcbio.pipeline import region as pregion
 from bcbio.pipeline import shared as pshared
 from bcbio.variation import (gatk, gatkfilter, germline, multi,
-                             ploidy, vcfutils, vfilter)
+                             ploidy, regioncost, vcfutils, vfilter)
 
 # ## Variant filtration -- shared functionality
 
@@ -201,11 +202,14 @@ def parallel_variantcall_region(samples, run_parallel):
     """
     to_process, extras = _dup_samples_by_variantcaller(samples)
     split_fn = _split_by_ready_regions(".vcf.gz", "work_bam", get_variantcaller)
+    estimator = regioncost.Estimator(to_process[0][0]) if to_process else None
     samples = _collapse_by_bam_variantcaller(
         grouped_parallel_split_combine(to_process, split_fn,
-                                       multi.group_batches, run_parallel,
+                                       multi.group_batches,
+                                       regioncost.saving_estimates(estimator, run_parallel),
                                        "variantcall_sample", "concat_variant_files",
-                                       "vrn_file", ["region", "sam_ref", "config"]))
+                                       "vrn_file", ["region", "sam_ref", "config"],
+                                       cost_fn=estimator.split_arg_cost if estimator else None))
     return extras + samples
 
 
@@ -374,7 +378,10 @@ def variantcall_sample(data, region=None, align_bams=None, out_file=None):
         if not assoc_files: assoc_files = {}
         for bam_file in align_bams:
             bam.index(bam_file, data["config"], check_timestamp=False)
-        out_file = caller_fn(align_bams, items, ref_file, assoc_files, region, out_file)
+        start = time.time()
+        vrn_file = caller_fn(align_bams, items, ref_file, assoc_files, region, out_file)
+        regioncost.record(data, region, out_file, time.time() - start)
+        out_file = vrn_file
     if region:
         data["region"] = region
     data["vrn_file"] = out_file
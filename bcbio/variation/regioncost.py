@@ -0,0 +1,157 @@
+"""Estimate run times of region based variant calling tasks.
+
+Starting the most expensive regions first avoids long running blocks, like
+high depth regions next to centromeres, dominating the end of a run. Estimates
+use reads expected in each region from BAM index statistics, scaled by the
+seconds per read observed for each caller in previous runs. Every finished
+region records its estimate and actual run time, calibrating later runs.
+
+Estimates stay out of the task arguments, which would otherwise change with
+the growing history and invalidate cached task results. The main process
+stores them by output file before starting tasks, and workers look them up.
+"""
+import collections
+import json
+import os
+
+from bcbio import bam, utils
+from bcbio.distributed.transaction import file_transaction
+from bcbio.log import logger
+from bcbio.pipeline import datadict as dd
+
+# Size at which the history rotates, keeping only the previous file
+MAX_HISTORY_BYTES = 5 * 1024 * 1024
+
+def history_file(data):
+    """Run time history: caller, chrom, start, end, expected reads, estimate and seconds.
+    """
+    return os.path.join(dd.get_work_dir(data), "provenance", "region_runtimes.tsv")
+
+def estimates_file(data):
+    return os.path.join(dd.get_work_dir(data), "provenance", "region_estimates.json")
+
+def read_history(in_file):
+    """Retrieve seconds per expected read for each caller from previous runs.
+    """
+    totals = collections.defaultdict(lambda: [0.0, 0.0])
+    for cur_file in [in_file + ".1", in_file]:
+        if utils.file_exists(cur_file):
+            with open(cur_file) as in_handle:
+                for line in in_handle:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) != 7:
+                        continue
+                    try:
+                        reads, seconds = float(parts[4]), float(parts[6])
+                    except ValueError:
+                        continue
+                    totals[parts[0]][0] += reads
+                    totals[parts[0]][1] += seconds
+    return {caller: seconds / reads for caller, (reads, seconds) in totals.items()
+            if reads > 0 and seconds > 0}
+
+class Estimator:
+    """Expected run time for variant calling tasks on a region and set of BAMs.
+
+    Index statistics are retrieved once per BAM file. Without read counts,
+    falls back to region size in base pairs.
+    """
+    def __init__(self, data):
+        self._data = data
+        self._idxstats = {}
+        self.estimates = {}
+        self._rates = read_history(history_file(data))
+        self._default_rate = (sorted(self._rates.values())[len(self._rates) // 2]
+                              if self._rates else 1.0)
+
+    def _reads_per_base(self, bam_file):
+        if bam_file not in self._idxstats:
+            try:
+                self._idxstats[bam_file] = {x.contig: float(x.aligned) / x.length
+                                            for x in bam.idxstats(bam_file, self._data)
+                                            if x.length > 0}
+            except Exception as e:
+                logger.debug("Could not retrieve index statistics for %s: %s" % (bam_file, e))
+                self._idxstats[bam_file] = {}
+        return self._idxstats[bam_file]
+
+    def expected_reads(self, region, work_bams):
+        chrom, start, end = region
+        total = 0.0
+        for bam_file in work_bams:
+            density = self._reads_per_base(bam_file).get(chrom)
+            total += (density if density is not None else 1.0) * (end - start)
+        return total
+
+    def split_arg_cost(self, args):
+        """Sort key for variantcall_sample arguments: [data, region, work_bams, out_file]
+
+        Keeps the estimate by output file, for workers to report alongside the
+        measured run time.
+        """
+        data, region, work_bams, out_file = args[:4]
+        caller = _get_caller(data)
+        reads = self.expected_reads(region, work_bams)
+        cost = reads * self._rates.get(caller, self._default_rate)
+        self.estimates[out_file] = {"reads": reads, "estimate": cost}
+        return cost
+
+    def save(self):
+        out_file = estimates_file(self._data)
+        utils.safe_makedir(os.path.dirname(out_file))
+        with file_transaction(self._data, out_file) as tx_out_file:
+            with open(tx_out_file, "w") as out_handle:
+                json.dump(self.estimates, out_handle)
+
+def saving_estimates(estimator, run_parallel):
+    """Wrap run_parallel to store estimates of sorted region tasks before they start.
+    """
+    def run(fn_name, items):
+        if fn_name == "variantcall_sample" and estimator is not None:
+            estimator.save()
+        return run_parallel(fn_name, items)
+    return run
+
+# Estimates loaded by workers, keyed by file and modification time
+_loaded = {}
+
+def _get_estimate(data, out_file):
+    in_file = estimates_file(data)
+    try:
+        key = (in_file, os.path.getmtime(in_file))
+        if key not in _loaded:
+            with open(in_file) as in_handle:
+                _loaded.clear()
+                _loaded[key] = json.load(in_handle)
+        return _loaded[key].get(out_file)
+    except (OSError, IOError, ValueError):
+        return None
+
+def _get_caller(data):
+    return data["config"]["algorithm"].get("variantcaller")
+
+def record(data, region, out_file, seconds):
+    """Log and store estimated versus actual run time for a finished region.
+
+    Lines are appended in a single small write, which is safe with multiple
+    processes writing to the same local file. The history rotates once it
+    reaches MAX_HISTORY_BYTES, so it does not grow without bound.
+    """
+    est = _get_estimate(data, out_file) if region else None
+    if not est:
+        return
+    caller = _get_caller(data)
+    chrom, start, end = region
+    logger.debug("Region timing %s %s:%s-%s: estimated %.1f, actual %.1fs" %
+                 (caller, chrom, start, end, est["estimate"], seconds))
+    out_file = history_file(data)
+    utils.safe_makedir(os.path.dirname(out_file))
+    line = "\t".join(str(x) for x in [caller, chrom, start, end, "%.1f" % est["reads"],
+                                        "%.4f" % est["estimate"], "%.2f" % seconds]) + "\n"
+    with open(out_file, "a") as out_handle:
+        out_handle.write(line)
+    try:
+        if os.path.getsize(out_file) > MAX_HISTORY_BYTES:
+            os.rename(out_file, out_file + ".1")
+    except OSError:
+        pass
@@ -13,6 +13,7 @@ import shutil
 import subprocess
 import time
 
+import numpy as np
 from pysam import VariantFile
 import six
 import toolz as tz
@@ -24,7 +25,7 @@ from bcbio.distributed.transaction import file_transaction
 from bcbio.pipeline import config_utils, shared
 from bcbio.pipeline import datadict as dd
 from bcbio.provenance import do
-from bcbio.variation import annotation, bedutils, validateplot, vcfutils, multi, naming
+from bcbio.variation import annotation, bedutils, validateplot, vcfarrays, vcfutils, multi, naming
 
 # ## Individual sample comparisons
 
@@ -690,57 +691,40 @@ def freq_summary(val_file, call_file, truth_file, target_name):
     out_file = "%s-freqs.csv" % utils.splitext_plus(val_file)[0]
     truth_freqs = _read_truth_freqs(truth_file)
     call_freqs = _read_call_freqs(call_file, target_name)
-    with VariantFile(val_file) as val_in:
-        with open(out_file, "w") as out_handle:
-            writer = csv.writer(out_handle)
-            writer.writerow(["vtype", "valclass", "freq"])
-            for rec in val_in:
-                call_type = _classify_rec(rec)
-                val_type = _get_validation_status(rec)
-                key = _get_key(rec)
-                freq = truth_freqs.get(key, call_freqs.get(key, 0.0))
-                writer.writerow([call_type, val_type, freq])
+    vals = vcfarrays.load(val_file, info=["type"])
+    with open(out_file, "w") as out_handle:
+        writer = csv.writer(out_handle)
+        writer.writerow(["vtype", "valclass", "freq"])
+        for key, call_type, val_type in zip(_get_keys(vals), _classify(vals), vals["type"].tolist()):
+            freq = truth_freqs.get(key, call_freqs.get(key, 0.0))
+            writer.writerow([call_type, val_type, freq])
     return out_file
 
-def _get_key(rec):
-    return (rec.contig, rec.pos, rec.ref, rec.alts[0])
-
-def _classify_rec(rec):
-    """Determine class of variant in the record.
-    """
-    if max([len(x) for x in rec.alleles]) == 1:
-        return "snp"
-    else:
-        return "indel"
+def _get_keys(calls):
+    return zip(calls["CHROM"].tolist(), calls["POS"].tolist(), calls["REF"].tolist(),
+               vcfarrays.first_alt(calls).tolist())
 
-def _get_validation_status(rec):
-    """Retrieve the status of the validation, supporting hap.py output
+def _classify(calls):
+    """Determine class of variant in each record.
     """
-    return rec.info["type"]
+    is_snp = (calls["REF"].str.len() == 1) & ~calls["ALT"].str.contains("[^,]{2}").eq(True)
+    return np.where(is_snp.values, "snp", "indel").tolist()
 
 def _read_call_freqs(in_file, sample_name):
     """Identify frequencies for calls in the input file.
     """
-    from bcbio.heterogeneity import bubbletree
-    out = {}
-    with VariantFile(in_file) as call_in:
-        for rec in call_in:
-            if rec.filter.keys() == ["PASS"]:
-                for name, sample in rec.samples.items():
-                    if name == sample_name:
-                        alt, depth, freq = bubbletree.sample_alt_and_depth(rec, sample)
-                        if freq is not None:
-                            out[_get_key(rec)] = freq
-    return out
+    calls = vcfarrays.load(in_file, info=["DP", "AF"], formats=["AD", "AO", "RO"], samples=[sample_name])
+    if sample_name not in calls.attrs["samples"]:
+        return {}
+    _, _, freqs = vcfarrays.alt_and_depth(calls, sample_name)
+    keep = (calls["FILTER"] == "PASS").values & ~np.isnan(freqs)
+    return dict(zip(_get_keys(calls[keep]), freqs[keep].tolist()))
 
 def _read_truth_freqs(in_file):
     """Read frequency of calls from truth VCF.
 
     Currently handles DREAM data, needs generalization for other datasets.
     """
-    out = {}
-    with VariantFile(in_file) as bcf_in:
-        for rec in bcf_in:
-            freq = float(rec.info.get("VAF", 1.0))
-            out[_get_key(rec)] = freq
-    return out
+    truth = vcfarrays.load(in_file, info=["VAF"])
+    freqs = vcfarrays.single_precision(truth["VAF"]) if "VAF" in truth else np.ones(len(truth))
+    return dict(zip(_get_keys(truth), np.where(np.isnan(freqs), 1.0, freqs).tolist()))
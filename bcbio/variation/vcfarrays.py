@@ -0,0 +1,170 @@
+"""Load VCF fields as columns for vectorized filtering and allele frequency calculations.
+
+Extracts sites with selected INFO and per-sample FORMAT fields in a single
+pass with bcftools query, parsing the tab delimited output with pandas.
+Indexed inputs query groups of contigs in parallel. Callers filter and
+calculate frequencies with array operations instead of iterating over
+records with pysam.
+"""
+import collections
+import concurrent.futures
+import csv
+import io
+import subprocess
+
+import numpy as np
+import pandas as pd
+import pysam
+import six
+
+from bcbio.pipeline import config_utils
+
+SITE_FIELDS = ["CHROM", "POS", "REF", "ALT", "QUAL", "FILTER"]
+
+# Record-like view of a site, with the attributes of pysam records used by output writers
+Site = collections.namedtuple("Site", "chrom pos start stop ref alts qual")
+
+def _indexed_contigs(in_file):
+    """Contigs in the index of a VCF, in file order, or None for unindexed inputs.
+    """
+    try:
+        with pysam.VariantFile(in_file) as bcf_in:
+            return list(bcf_in.index.keys()) if bcf_in.index is not None else None
+    except (ValueError, AttributeError):
+        return None
+
+def _is_single_number(field):
+    return field.number == 1 and field.type in ("Integer", "Float")
+
+def _query(cmd, names, dtypes):
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        df = pd.read_csv(proc.stdout, sep="\t", header=None, names=names, dtype=dtypes, na_values=["."],
+                         keep_default_na=False, quoting=csv.QUOTE_NONE)
+    except pd.errors.EmptyDataError:
+        df = pd.DataFrame(dict((k, pd.Series(dtype=dtypes[k])) for k in names))
+    proc.stdout.close()
+    if proc.wait() != 0:
+        raise subprocess.CalledProcessError(proc.returncode, " ".join(cmd))
+    return df
+
+def load(in_file, info=None, formats=None, samples=None, cores=1, config=None):
+    """Load sites, INFO and per-sample FORMAT fields of a VCF into a DataFrame.
+
+    Columns are SITE_FIELDS, followed by INFO fields and FORMAT fields named
+    sample:field. Fields missing from the header are skipped, and missing
+    values are NaN. Loaded samples are available in the attrs of the result.
+    With multiple cores, indexed inputs query groups of contigs concurrently.
+    """
+    with pysam.VariantFile(in_file) as bcf_in:
+        header = bcf_in.header
+        info = [k for k in info or [] if k in header.info]
+        formats = [k for k in formats or [] if k in header.formats]
+        samples = [s for s in header.samples if samples is None or s in samples]
+        flags = [k for k in info if header.info[k].type == "Flag"]
+        numeric = set([k for k in info if _is_single_number(header.info[k])] +
+                      ["%s:%s" % (s, f) for s in samples for f in formats if _is_single_number(header.formats[f])])
+    sample_cols = ["%s:%s" % (s, f) for s in samples for f in formats]
+    names = SITE_FIELDS + info + sample_cols
+    dtypes = dict((k, np.float64 if k in numeric else str) for k in names)
+    dtypes.update({"POS": np.int64, "QUAL": np.float64})
+    query = "\t".join(["%" + x for x in SITE_FIELDS] + ["%INFO/" + k for k in info])
+    if sample_cols:
+        query += "[\t%s]" % "\t".join("%" + f for f in formats)
+    cmd = [config_utils.get_program("bcftools", config or {}), "query", "-f", query + "\n"]
+    if sample_cols:
+        cmd += ["-s", ",".join(samples)]
+    contigs = _indexed_contigs(in_file) if cores > 1 else None
+    if contigs and len(contigs) > 1 and not any(":" in c for c in contigs):
+        groups = [list(x) for x in np.array_split(contigs, min(cores, len(contigs)))]
+        with concurrent.futures.ThreadPoolExecutor(len(groups)) as pool:
+            dfs = list(pool.map(lambda g: _query(cmd + ["-r", ",".join(g), in_file], names, dtypes), groups))
+        df = pd.concat(dfs, ignore_index=True)
+        rank = dict((c, i) for i, c in enumerate(contigs))
+        df = df.iloc[np.argsort(df["CHROM"].map(rank).values, kind="stable")].reset_index(drop=True)
+    else:
+        df = _query(cmd + [in_file], names, dtypes)
+    df["QUAL"] = single_precision(df["QUAL"])
+    for k in flags:
+        df[k] = df[k].notnull()
+    df.attrs["samples"] = samples
+    return df
+
+def single_precision(col):
+    """Float values of a column, rounded to the single precision values pysam provides.
+    """
+    return pd.to_numeric(col, errors="coerce").values.astype(np.float32).astype(np.float64)
+
+def values(col):
+    """Numeric values of a column of comma separated lists, as a 2D array with NaN for missing values.
+    """
+    if pd.api.types.is_numeric_dtype(col):
+        return np.asarray(col, dtype=np.float64).reshape(-1, 1)
+    col = pd.Series(col, dtype=object).fillna("").tolist()
+    if len(col) == 0:
+        return np.empty((0, 1))
+    width = max(x.count(",") for x in col) + 1
+    parts = pd.read_csv(io.StringIO("\n".join(col) + "\n"), header=None, names=list(range(width)),
+                        na_values=[".", ""], keep_default_na=False, skip_blank_lines=False, quoting=csv.QUOTE_NONE)
+    return np.column_stack([(parts[c] if pd.api.types.is_numeric_dtype(parts[c])
+                             else pd.to_numeric(parts[c], errors="coerce")).values.astype(np.float64)
+                            for c in parts.columns])
+
+def first_alt(df):
+    return df["ALT"].str.split(",", n=1).str[0]
+
+def is_biallelic_snp(df):
+    return ((df["REF"].str.len() == 1) & (df["ALT"].str.len() == 1)).values
+
+def passes_filters(df, allowed=("PASS",)):
+    """Identify records without filters, or with only the allowed filters.
+    """
+    allowed = set(allowed)
+    ok = dict((f, all(x in allowed for x in f.split(";"))) for f in df["FILTER"].dropna().unique())
+    return ~df["FILTER"].map(ok).eq(False).values
+
+def alt_and_depth(df, sample):
+    """Flexibly get ALT allele and depth counts and frequencies, handling FreeBayes, MuTect and other cases.
+
+    Vectorized version of heterogeneity.bubbletree.sample_alt_and_depth, using
+    sample AD, then AO and RO, and finally INFO DP and AF. Returns float arrays
+    of alt counts, depths and frequencies, with NaN for missing values.
+    """
+    n = len(df)
+    alt, depth, freq = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+    todo = np.ones(n, dtype=bool)
+    if "%s:AD" % sample in df:
+        counts = values(df["%s:AD" % sample])
+        cur = todo & ~np.isnan(counts[:, 0])
+        alt[cur] = np.nansum(counts[cur, 1:], axis=1)
+        depth[cur] = np.nansum(counts[cur], axis=1)
+        todo &= ~cur
+    if "%s:AO" % sample in df and "%s:RO" % sample in df:
+        alts = values(df["%s:AO" % sample])
+        refs = values(df["%s:RO" % sample])[:, 0]
+        cur = todo & ~np.isnan(alts[:, 0]) & ~np.isnan(refs)
+        alt[cur] = np.nansum(alts[cur], axis=1)
+        depth[cur] = alt[cur] + refs[cur]
+        todo &= ~cur
+    with np.errstate(divide="ignore", invalid="ignore"):
+        freq = np.where(depth > 0, alt / depth, np.nan)
+    alt[~(depth > 0)] = np.nan
+    depth[~(depth > 0)] = np.nan
+    if "DP" in df and "AF" in df:
+        dp = values(df["DP"])[:, 0]
+        af = values(df["AF"])[:, 0].astype(np.float32).astype(np.float64)
+        cur = todo & ~np.isnan(dp) & ~np.isnan(af)
+        depth[cur] = dp[cur]
+        freq[cur] = af[cur]
+    return alt, depth, freq
+
+def sites(df, idx=None):
+    """Record-like sites for rows of a loaded DataFrame.
+    """
+    if idx is not None:
+        df = df.iloc[idx]
+    qual = [None if np.isnan(q) else q for q in df["QUAL"].tolist()]
+    for chrom, pos, ref, alt, q in zip(df["CHROM"].tolist(), df["POS"].tolist(), df["REF"].tolist(),
+                                       df["ALT"].tolist(), qual):
+        alts = tuple(alt.split(",")) if isinstance(alt, six.string_types) else None
+        yield Site(chrom, pos, pos - 1, pos - 1 + len(ref), ref, alts, q)
@@ -9,6 +9,7 @@ from contextlib import closing
 from collections import Counter
 import pandas as pd
 import math
+import numpy as np
 
 import pysam
 import scipy.stats as stats
@@ -130,60 +131,169 @@ def parallel_calling(data, run_parallel):
                     sample[0]["hmc_split"].append(chunck[0]["hmc_file"])
     #  run_parallel("cpg_stats", data)
 
-def _sync_pos(handle, tag):
-    for line in handle:
-        cols = line.strip().split("\t")
-        info = cols[4:]
-        if cols[3] != "CG":
-            continue
-        pos = int(cols[1])
-        ratio = [int(float(cols[5])), int(cols[6])]
-        if tag <= pos:
-            return [handle, {"pos": pos, "counts": ratio, "info": info, "ratio": float(cols[4])}]
-    return [None, None]
+# Rows of methylation ratio files read at a time
+CHUNK_SIZE = 250000
+# Minimum effective CT counts in both mC and hmC inputs
+MIN_DEPTH = 9
+
+def _read_cg(in_file, chunksize=CHUNK_SIZE):
+    """Read CG rows of a methratio output in blocks, keeping fields as text for output.
+    """
+    reader = pd.read_csv(in_file, sep="\t", header=None, dtype=str, keep_default_na=False,
+                         chunksize=chunksize)
+    for df in reader:
+        df = df[df[3] == "CG"]
+        if len(df) > 0:
+            df = df.assign(pos=df[1].astype(np.int64), depth=df[5].astype(np.float64),
+                           c=df[6].astype(np.int64))
+            yield df
+
+def _aligned_blocks(mc_file, hmc_file, chunksize=CHUNK_SIZE):
+    """Pair blocks of mC rows with the hmC rows covering the same positions.
+
+    Both inputs are sorted by position within a single chromosome, so hmC
+    rows past the end of the current mC block carry over to the next.
+    """
+    hmc_iter = _read_cg(hmc_file, chunksize)
+    hmc_buf = None
+    hmc_done = False
+    for mc in _read_cg(mc_file, chunksize):
+        last = mc["pos"].iloc[-1]
+        while not hmc_done and (hmc_buf is None or hmc_buf["pos"].iloc[-1] < last):
+            try:
+                cur = next(hmc_iter)
+            except StopIteration:
+                hmc_done = True
+                break
+            hmc_buf = cur if hmc_buf is None else pd.concat([hmc_buf, cur])
+        if hmc_buf is None:
+            break
+        in_block = hmc_buf["pos"].values <= last
+        yield mc, hmc_buf[in_block]
+        hmc_buf = hmc_buf[~in_block]
+        if len(hmc_buf) == 0:
+            if hmc_done:
+                break
+            hmc_buf = None
+
+def _binary_search(f, d, lo, hi):
+    """Vectorized binary search for i between lo and hi such that f(i) <= d < f(i + 1).
+
+    Follows the search scipy uses to find the opposite tail of two-sided tests.
+    """
+    lo, hi = lo.copy(), hi.copy()
+    out = np.zeros(len(lo), dtype=np.int64)
+    found = np.zeros(len(lo), dtype=bool)
+    active = lo < hi
+    while active.any():
+        mid = lo + (hi - lo) // 2
+        midval = f(mid)
+        lower = active & (midval < d)
+        higher = active & (midval > d)
+        equal = active & ~lower & ~higher
+        lo[lower] = mid[lower] + 1
+        hi[higher] = mid[higher] - 1
+        out[equal] = mid[equal]
+        found |= equal
+        active = (lo < hi) & ~found
+    out[~found] = np.where(f(lo) <= d, lo, lo - 1)[~found]
+    return out
+
+def _unique_tables(tables):
+    """Distinct tables and the index of each input table, hashing tables packed into integers.
+    """
+    radix = int(tables.max()) + 1 if len(tables) > 0 else 1
+    if radix ** 4 >= 1 << 63:
+        uniq, inverse = np.unique(tables, axis=0, return_inverse=True)
+        return uniq, inverse.ravel()
+    keys = ((tables[:, 0] * radix + tables[:, 1]) * radix + tables[:, 2]) * radix + tables[:, 3]
+    inverse, uniq_keys = pd.factorize(keys)
+    uniq = np.column_stack([uniq_keys // radix ** 3, uniq_keys // radix ** 2 % radix,
+                            uniq_keys // radix % radix, uniq_keys % radix])
+    return uniq, inverse
+
+def fisher_exact_pvalues(tables):
+    """Two-sided Fisher exact test p-values for an array of 2x2 tables, as rows of [a, b, c, d].
+
+    Matches scipy.stats.fisher_exact for [[a, b], [c, d]], calculating each
+    distinct table once.
+    """
+    tables, inverse = _unique_tables(np.asarray(tables, dtype=np.int64).reshape(-1, 4))
+    a, b, c, d = tables.T
+    n1, n2, n = a + b, c + d, a + c
+    total = n1 + n2
+    pvalues = np.ones(len(tables))
+    pmf = lambda x, i: stats.hypergeom.pmf(x, total[i], n1[i], n[i])
+    i = np.flatnonzero((n1 > 0) & (n2 > 0) & (n > 0) & (b + d > 0))
+    mode = ((n[i] + 1) * (n1[i] + 1)) // (total[i] + 2)
+    pexact = pmf(a[i], i)
+    pmode = pmf(mode, i)
+    epsilon = 1e-14
+    gamma = 1 + epsilon
+    keep = np.abs(pexact - pmode) / np.maximum(pexact, pmode) > epsilon
+    i, mode, pexact = i[keep], mode[keep], pexact[keep]
+    # Observed in the lower tail, add the matching upper tail
+    is_lower = a[i] < mode
+    li, lmode, lexact = i[is_lower], mode[is_lower], pexact[is_lower]
+    pvalues[li] = stats.hypergeom.cdf(a[li], total[li], n1[li], n[li])
+    other = pmf(n[li], li) <= lexact * gamma
+    li, lmode, lexact = li[other], lmode[other], lexact[other]
+    guess = _binary_search(lambda x: -pmf(x, li), -lexact * gamma, lmode, n[li])
+    pvalues[li] += stats.hypergeom.sf(guess, total[li], n1[li], n[li])
+    # Observed in the upper tail, add the matching lower tail
+    ui, umode, uexact = i[~is_lower], mode[~is_lower], pexact[~is_lower]
+    pvalues[ui] = stats.hypergeom.sf(a[ui] - 1, total[ui], n1[ui], n[ui])
+    other = pmf(np.zeros(len(ui), dtype=np.int64), ui) <= uexact * gamma
+    ui, umode, uexact = ui[other], umode[other], uexact[other]
+    guess = _binary_search(lambda x: pmf(x, ui), uexact * gamma, np.zeros(len(ui), dtype=np.int64), umode)
+    pvalues[ui] += stats.hypergeom.cdf(guess, total[ui], n1[ui], n[ui])
+    return np.minimum(pvalues, 1.0)[inverse]
 
 def _call_hmc(mc, hmc):
-    n1, n2 = mc[0] - mc[1], mc[1]
-    n1 = max(0, n1)
-    m1, m2 = hmc[0] - hmc[1], hmc[1]
-    m1 = max(0, m1)
-    oddsratio, pvalue = stats.fisher_exact([[n1, n2], [m1, m2]])
-    return pvalue
+    """Fisher exact test p-values comparing methylated and unmethylated counts in mC and hmC.
+    """
+    tables = np.column_stack([np.maximum(0, mc["depth"].values.astype(np.int64) - mc["c"].values),
+                              mc["c"].values,
+                              np.maximum(0, hmc["depth"].values.astype(np.int64) - hmc["c"].values),
+                              hmc["c"].values])
+    return fisher_exact_pvalues(tables)
+
+def _hmc_lines(mc, hmc):
+    """Join mC and hmC blocks on position, producing output for sites with enough depth in both.
+    """
+    mc = mc[mc["depth"].values >= MIN_DEPTH]
+    hmc = hmc.drop_duplicates("pos")
+    hmc = hmc[hmc["depth"].values >= MIN_DEPTH]
+    if len(mc) == 0 or len(hmc) == 0:
+        return []
+    ipos = np.minimum(np.searchsorted(hmc["pos"].values, mc["pos"].values), len(hmc) - 1)
+    found = hmc["pos"].values[ipos] == mc["pos"].values
+    if not found.any():
+        return []
+    mc = mc[found]
+    hmc = hmc.iloc[ipos[found]]
+    pvalues = _call_hmc(mc, hmc)
+    mc_cols = [c for c in mc.columns if isinstance(c, int)]
+    hmc_cols = [c for c in hmc.columns if isinstance(c, int) and c >= 4]
+    cols = [mc[c].tolist() for c in mc_cols] + [hmc[c].tolist() for c in hmc_cols]
+    return ["%s\t%r\n" % ("\t".join(xs), p) for xs, p in zip(zip(*cols), pvalues.tolist())]
 
 def cpg_postprocessing(data):
+    """Call hydroxymethylation comparing mC and hmC counts at CpGs present in both inputs.
+    """
     mC = data["cpg_file"]
     if not "control" in data:
         return [[data]]
     hmC = data["control"]
     out_file = append_stem(mC, "_hmC")
-    pos = 0
-    pos_hmC = 0
     data["hmc_file"] = out_file
     if file_exists(out_file):
         return [[data]]
     logger.debug("processing %s versus %s" % (mC, hmC))
     with file_transaction(out_file) as out_tx:
         with open(out_tx, "w") as out_handle:
-            with open(mC) as mC_h:
-                with open(hmC) as hmC_h:
-                    for line in mC_h:
-                        cols = line.strip().split("\t")
-                        if cols[3] != "CG":
-                            continue
-                        pos = int(cols[1])
-                        counts = [int(float(cols[5])), int(cols[6])]
-                        if pos < pos_hmC:
-                            continue
-                        elif pos > pos_hmC:
-                            hmC_h, hmC = _sync_pos(hmC_h, pos)
-                            if not hmC_h:
-                                break
-                            pos_hmC = hmC["pos"]
-                        if counts[0] < 9 or hmC["counts"][0] < 9:
-                            continue
-                        if pos == hmC["pos"]:
-                            pvalue = _call_hmc(counts, hmC["counts"])
-                            print >>out_handle, "%s\t%s\t%s" % (line.strip(), "\t".join(hmC["info"]), pvalue)
+            for mc, hmc in _aligned_blocks(mC, hmC):
+                out_handle.writelines(_hmc_lines(mc, hmc))
     return [[data]]
 
 def hmc_stats(sample):
@@ -36,10 +36,10 @@ prepend_bcbiopath()
   
 from bcbio import install, utils, workflow
 from bcbio.illumina import machine
-from bcbio.distributed import runfn, clargs
+from bcbio.distributed import runfn, clargs, taskcache
 from bcbio.pipeline.main import run_main
 from bcbio.graph import graph
-from bcbio.provenance import programs
+from bcbio.provenance import programs, telemetry
 from bcbio.pipeline import version
 
 def main(**kwargs):
@@ -53,6 +53,8 @@ def parse_cl_args(in_args):
     sub_cmds = {"upgrade": install.add_subparser,
                 "runfn": runfn.add_subparser,
                 "graph": graph.add_subparser,
+                "taskcache": taskcache.add_subparser,
+                "telemetry": telemetry.add_subparser,
                 "version": programs.add_subparser,
                 "sequencer": machine.add_subparser}
     description = "Community developed high throughput sequencing analysis."
@@ -102,6 +104,16 @@ def parse_cl_args(in_args):
                             help=("Number of retries of failed tasks during "
                                   "distributed processing. Default 0 "
                                   "(no retries)"))
+        parser.add_argument("--pipelined", default=False, action="store_true",
+                            help=("Let samples start later steps while others are "
+                                  "still processing. Local multicore runs only"))
+        parser.add_argument("--task-cache", dest="task_cache", default=False, action="store_true",
+                            help=("Reuse results of parallel steps with unchanged inputs "
+                                  "from previous runs"))
+        parser.add_argument("--measured-memory", dest="measured_memory", default=False,
+                            action="store_true",
+                            help=("Schedule memory using peak usage measured in previous "
+                                  "runs instead of configured program memory"))
         parser.add_argument("-p", "--tag",
                             help="Tag name to label jobs on the cluster",
                             default="")
@@ -230,6 +242,10 @@ if __name__ == "__main__":
         runfn.process(kwargs["args"])
     elif "graph" in kwargs and kwargs["graph"]:
         graph.bootstrap(kwargs["args"])
+    elif "taskcache" in kwargs and kwargs["taskcache"]:
+        taskcache.process(kwargs["args"])
+    elif "telemetry" in kwargs and kwargs["telemetry"]:
+        telemetry.process(kwargs["args"])
     elif "version" in kwargs and kwargs["version"]:
         programs.write_versions({"work": kwargs["args"].workdir})
     elif "sequencer" in kwargs and kwargs["sequencer"]:
@@ -0,0 +1,65 @@
+import os
+import shutil
+
+import pybedtools
+import pysam
+import pytest
+
+from bcbio.bam import callable
+
+BAM = os.path.join(os.path.dirname(__file__), "..", "..", "data", "fusion", "input",
+                   "Test1.nsorted.human.sorted.bam")
+
+
+@pytest.fixture
+def indexed_bam(tmpdir):
+    bam_file = str(tmpdir.join("test.bam"))
+    shutil.copy(BAM, bam_file)
+    pysam.index(bam_file)
+    return bam_file
+
+
+def test_bam_index_depth(indexed_bam):
+    offsets = callable._bai_window_offsets(indexed_bam + ".bai")
+    assert len(offsets) == 2
+    assert all(xs == sorted(xs) for xs in offsets)
+    by_chrom = callable._bam_index_depth(indexed_bam)
+    assert list(by_chrom.keys()) == ["chrM", "chr22"]
+    for chrom, xs in zip(by_chrom.keys(), offsets):
+        assert len(by_chrom[chrom]) == len(xs)
+    assert [x[:2] for x in by_chrom["chrM"]] == [(0, 16384), (16384, 32768)]
+    assert sum(w for xs in by_chrom.values() for _, _, w in xs) > 0
+
+
+def test_depth_profile_normalizes_samples():
+    profile = callable.DepthProfile()
+    assert profile.add_sample({"chr1": [(0, 100, 3e6), (100, 200, 1e6)]})
+    assert profile.add_sample({"chr1": [(0, 200, 8.0)]})
+    assert not profile.add_sample({"chr1": [(0, 200, 0)]})
+    assert profile.total() == pytest.approx(2.0)
+    assert profile.size("chr1", 0, 100) == pytest.approx(0.75 + 0.5)
+    assert profile.size("chr1", 150, 200) == pytest.approx(0.125 + 0.25)
+
+
+def test_depth_profile_mixed_sources(indexed_bam, tmpdir):
+    regions_file = tmpdir.join("regions.bed")
+    regions_file.write("chrM\t0\t1000\t5000.0\n")
+    items = [{"work_bam": indexed_bam},
+             {"work_bam": "sample.cram", "depth": {"variant_regions": {"regions": str(regions_file)}}}]
+    profile = callable.get_depth_profile(items)
+    assert profile.total() == pytest.approx(2.0)
+    assert profile.size("chrM", 0, 1000) >= 1.0
+    assert callable.get_depth_profile(items + [{"work_bam": "other.cram"}]) is None
+
+
+def test_picker_splits_by_depth():
+    ref_regions = pybedtools.BedTool("chr1\t0\t1000000\n", from_string=True)
+    config = {"algorithm": {"nomap_split_targets": 10}}
+    profile = callable.DepthProfile()
+    profile.add_sample({"chr1": [(0, 100000, 90.0), (100000, 1000000, 10.0)]})
+    block = pybedtools.Interval("chr1", 30000, 30500)
+    by_bp = callable.NBlockRegionPicker(ref_regions, config, 250)
+    assert not by_bp.include_block(block)
+    by_depth = callable.NBlockRegionPicker(ref_regions, config, 250, profile)
+    assert by_depth.include_block(block)
+    assert not by_depth.include_block(pybedtools.Interval("chr1", 31000, 31500))
@@ -0,0 +1,33 @@
+import os
+
+from bcbio.bam import readstats
+
+
+def test_stats_cache_imports_text_cache(tmpdir):
+    tmpdir.join("mapped_stats.txt").write('{"region":"","sample":"S1"}\t42\n')
+    cache = readstats.StatsCache(str(tmpdir.join("mapped_stats.db")))
+    assert cache.get('{"region":"","sample":"S1"}') == 42
+    cache.put_many({"a": 1, "b": 2.5})
+    assert cache.get_many(["a", "b", "c"]) == {"a": 1, "b": 2.5}
+
+
+def test_stats_cache_skips_outdated(tmpdir):
+    in_file = tmpdir.join("regions.bed")
+    in_file.write("chr1\t0\t10\n")
+    cache = readstats.StatsCache(str(tmpdir.join("mapped_stats.db")))
+    cache.put("avg", 10)
+    assert cache.get("avg", [str(in_file)]) == 10
+    os.utime(str(in_file), (2e9, 2e9))
+    assert cache.get("avg", [str(in_file)]) is None
+
+
+def test_stats_cache_read_only(mocker, tmpdir):
+    db_file = str(tmpdir.join("mapped_stats.db"))
+    readstats.StatsCache(db_file).put("avg", 10)
+    os.chmod(db_file, 0o444)
+    mocker.patch("bcbio.bam.readstats.os.access", return_value=False)
+    cache = readstats.StatsCache(db_file)
+    assert cache.get("avg") == 10
+    cache.put("avg", 20)
+    assert cache.get("avg") == 10
+    assert sorted(os.listdir(str(tmpdir))) == ["mapped_stats.db"]
@@ -0,0 +1,143 @@
+import io
+import os
+
+import numpy as np
+import pysam
+
+from bcbio.bam import stats
+
+
+class TestUniqueStarts(object):
+
+    def test_sketch_within_error_bound(self):
+        values = np.random.RandomState(1).randint(0, 1 << 40, 200000)
+        sketch = stats.UniqueSketch(0.01)
+        sketch.add(values)
+        expected = len(np.unique(values))
+        assert abs(sketch.count() - expected) < 0.05 * expected
+
+    def test_curve_exact_below_limit(self):
+        starts = [0, 1, 1, 2, 3, 3, 3, 4, 5, 5]
+        curve = stats.StartsCurve(200, exact_limit=1000)
+        for x in starts:
+            curve.add(x)
+        reads, unique = curve.finish()
+        assert reads.tolist() == [2, 4, 6, 8, 10, 10]
+        assert unique.tolist() == [2, 3, 4, 5, 6, 6]
+
+    def test_curve_bins_non_round_size(self):
+        curve = stats.StartsCurve(57123)
+        for x in range(57123):
+            curve.add(x)
+        reads, unique = curve.finish()
+        assert len(reads) == 100
+        assert reads[0] == 572 and reads[-1] == 57123
+        assert unique.tolist() == reads.tolist()
+
+    def test_curve_switches_to_sketch(self):
+        starts = np.random.RandomState(2).randint(0, 50000, 100000).tolist()
+        exact = stats.StartsCurve(100000, None)
+        sketched = stats.StartsCurve(100000, 0.01, exact_limit=20000)
+        for x in starts:
+            exact.add(x)
+            sketched.add(x)
+        exact_reads, exact_unique = exact.finish()
+        sketch_reads, sketch_unique = sketched.finish()
+        assert exact_reads.tolist() == sketch_reads.tolist()
+        assert np.all(np.abs(sketch_unique - exact_unique) < 0.05 * exact_unique)
+
+
+class TestStreamSample(object):
+
+    def _sam(self, n):
+        lines = [b"@HD\tVN:1.6"]
+        for i in range(n):
+            flag, tlen = (99, 300 + i % 50) if i % 2 == 0 else (147, -(300 + (i - 1) % 50))
+            lines.append(b"r%d\t%d\tchr1\t%d\t60\t50M\t=\t1\t%d\t%s\t*" % (i, flag, i, tlen, b"A" * 50))
+        return b"\n".join(lines) + b"\n"
+
+    def test_passes_through_and_samples(self, tmpdir):
+        data = self._sam(20000)
+        bam_file = str(tmpdir.join("test.bam"))
+        out = io.BytesIO()
+        stats.sample_stream(stats.stream_file(bam_file), io.BytesIO(data), out, size=1000)
+        assert out.getvalue() == data
+        tmpdir.join("test.bam").write("bam")
+        assert stats._from_stream(bam_file) is None
+        summary = stats.stream_summary(bam_file)
+        assert summary["read_length"] == 50
+        assert 315 <= summary["insert_size"]["median"] <= 335
+        assert stats.get(bam_file, ["inserts"])["inserts"].max() < 350
+
+    def test_merges_weighted_by_records(self, tmpdir):
+        in_bams = [str(tmpdir.join("%s.bam" % x)) for x in ["a", "b"]]
+        for in_bam, n in zip(in_bams, [30000, 10000]):
+            stats.sample_stream(stats.stream_file(in_bam), io.BytesIO(self._sam(n)), io.BytesIO(), size=1000)
+            with open(in_bam, "w") as out_handle:
+                out_handle.write("bam")
+            assert stats.bind_stream(in_bam)
+        out_bam = str(tmpdir.join("merged.bam"))
+        stats.merge_streams(in_bams, out_bam, size=1000)
+        with np.load(stats.stream_file(out_bam)) as in_handle:
+            assert int(in_handle["stream_n"][0]) == 40000
+            assert len(in_handle["stream_flags"]) == 1000
+
+    def test_rejects_replaced_bam(self, tmpdir):
+        bam_file = str(tmpdir.join("test.bam"))
+        stats.sample_stream(stats.stream_file(bam_file), io.BytesIO(self._sam(2000)), io.BytesIO(), size=1000)
+        tmpdir.join("test.bam").write("bam")
+        assert stats.stream_summary(bam_file)["read_length"] == 50
+        tmpdir.join("test.bam").write("realigned bam")
+        assert not stats.bind_stream(bam_file)
+        assert stats.stream_summary(bam_file) is None
+        assert stats._from_stream(bam_file) is None
+
+
+class TestCalculate(object):
+
+    def _bam(self, tmpdir, n, paired):
+        header = {"HD": {"VN": "1.6", "SO": "coordinate"}, "SQ": [{"SN": "chr1", "LN": 100000}]}
+        bam_file = str(tmpdir.join("reads.bam"))
+        with pysam.AlignmentFile(bam_file, "wb", header=header) as out_handle:
+            for i in range(n):
+                read = pysam.AlignedSegment()
+                read.query_name = "r%d" % i
+                read.flag = 99 if paired else 0
+                read.reference_id = 0
+                read.reference_start = i
+                read.mapping_quality = 60
+                read.cigartuples = [(0, 50)]
+                read.query_sequence = "A" * 50
+                read.template_length = 300 if paired else 0
+                out_handle.write(read)
+        return bam_file
+
+    def test_single_end_inserts_bounded(self, tmpdir, monkeypatch):
+        bam_file = self._bam(tmpdir, 6000, paired=False)
+        monkeypatch.setattr(stats, "INSERT_SCAN_READS", 100)
+        seen = []
+        orig = stats.pysam.AlignmentFile
+
+        class CountingFile(orig):
+            def __next__(self):
+                read = orig.__next__(self)
+                seen.append(read)
+                return read
+        monkeypatch.setattr(stats.pysam, "AlignmentFile", CountingFile)
+        work_dir = str(tmpdir.join("work"))
+        out = stats.get(bam_file, ["lengths"], work_dir=work_dir)
+        assert len(out["lengths"]) == stats.LENGTH_READS and "inserts" not in out
+        assert len(seen) == stats.FRAGMENT_READS + 1
+        del seen[:]
+        assert len(stats.get(bam_file, ["inserts"], work_dir=work_dir)["inserts"]) == 0
+        assert len(seen) == 100
+
+    def test_cache_in_work_dir(self, tmpdir):
+        bam_file = self._bam(tmpdir.mkdir("input"), 200, paired=True)
+        work_dir = str(tmpdir.join("work"))
+        out = stats.get(bam_file, ["inserts"], work_dir=work_dir)
+        assert out["inserts"].tolist() == [300] * 200
+        assert os.listdir(os.path.dirname(bam_file)) == ["reads.bam"]
+        assert os.path.exists(stats.cache_file(bam_file, work_dir))
+        assert stats._sections(stats.get(bam_file, ["lengths"], work_dir=work_dir)) == \
+            set(["inserts", "lengths", "fragments"])
@@ -0,0 +1,55 @@
+import pytest
+
+from bcbio.distributed import dag
+
+
+def _const(value):
+    def run(*args):
+        return value
+    return run
+
+
+class TestRun(object):
+
+    def test_passes_dependency_results_in_order(self):
+        tasks = [dag.Task("a", _const(1)),
+                 dag.Task("b", _const(2)),
+                 dag.Task("c", lambda a, b: a * 10 + b, ["a", "b"])]
+        assert dag.run(tasks, 2)["c"] == 12
+
+    def test_rejects_cycles(self):
+        tasks = [dag.Task("a", _const(1), ["b"]),
+                 dag.Task("b", _const(1), ["a"])]
+        with pytest.raises(ValueError):
+            dag.run(tasks, 2)
+
+    def test_reraises_failures_without_running_dependents(self):
+        ran = []
+
+        def fail():
+            raise RuntimeError("failed")
+
+        tasks = [dag.Task("a", fail),
+                 dag.Task("b", lambda x: ran.append(x), ["a"])]
+        with pytest.raises(RuntimeError):
+            dag.run(tasks, 2)
+        assert ran == []
+
+    def test_critical_path_prioritizes_long_chains(self):
+        tasks = [dag.Task("short", _const(1), cost=1),
+                 dag.Task("long1", _const(1), cost=5),
+                 dag.Task("long2", _const(1), ["long1"], cost=5)]
+        ordered, children = dag._toposort(tasks)
+        rank = dag._critical_path(ordered, children)
+        assert rank["long1"] == 10
+        assert rank["short"] == 1
+
+
+class TestRunSamples(object):
+
+    def test_keeps_sample_items_together(self):
+        samples = [[{"rgnames": {"sample": "s1"}}], [{"rgnames": {"sample": "s2"}}],
+                   [{"rgnames": {"sample": "s1"}}]]
+        steps = [("count", lambda xs: [[dict(xs[0][0], n=len(xs))]])]
+        out = dag.run_samples(samples, steps, 2)
+        assert sorted((x[0]["rgnames"]["sample"], x[0]["n"]) for x in out) == [("s1", 2), ("s2", 1)]
@@ -0,0 +1,77 @@
+import os
+import zlib
+
+import pytest
+
+from bcbio.distributed import ipython
+from bcbio.pipeline import config_utils
+
+
+class FakeZstd(object):
+    """zlib backed stand in for zstandard compressors.
+    """
+    class ZstdCompressor(object):
+        def compress(self, blob):
+            return zlib.compress(blob)
+
+    class ZstdDecompressor(object):
+        def decompress(self, blob):
+            return zlib.decompress(blob)
+
+
+def _data(name, algorithm):
+    return {"description": name,
+            "config": {"algorithm": algorithm, "resources": {"gatk": {"jvm_opts": ["-Xmx4g"]}}},
+            "reference": {"fasta": {"base": "/ref/hg38.fa"}}}
+
+
+@pytest.fixture
+def store(tmpdir):
+    ipython._shared_cache.clear()
+    return ipython.ArgStore(str(tmpdir.join("args")))
+
+
+def test_round_trip_shares_values_once(store):
+    algorithm = {"aligner": "bwa", "variantcaller": "gatk-haplotype"}
+    items = [[_data("s1", algorithm), "chr%s" % i] for i in range(5)]
+    packed = ipython.zip_args(items, store)
+    assert all(isinstance(x, bytes) for x in packed)
+    assert len(os.listdir(store.store_dir)) == 3
+    assert [ipython.unzip_args([x])[0] for x in packed] == items
+    assert items[0][0]["config"]["algorithm"] is algorithm
+
+
+def test_cores_added_after_sharing(store):
+    algorithm = {"aligner": "bwa"}
+    items = ipython.share_args([[_data("s%s" % i, algorithm)] for i in range(3)], store)
+    items = [config_utils.add_cores_to_config(x, 4, {"type": "ipython"}) for x in items]
+    out = [ipython.unzip_args([x])[0] for x in ipython.zip_args(items, store)]
+    assert len(os.listdir(store.store_dir)) == 3
+    assert [x[0]["config"]["algorithm"] for x in out] == [{"aligner": "bwa", "num_cores": 4}] * 3
+    assert out[0][0]["config"]["parallel"] == {"type": "ipython"}
+
+
+def test_compression(store, monkeypatch):
+    monkeypatch.setattr(ipython, "zstandard", FakeZstd)
+    monkeypatch.setattr(ipython, "COMPRESS_MIN_BYTES", 1000)
+    items = [[_data("s1", {"aligner": "bwa"}), "x" * 2000], [_data("s2", {"aligner": "bwa"})]]
+    packed = ipython.zip_args(items, store)
+    assert packed[0].startswith(ipython._ARGS_MAGIC + b"z")
+    assert packed[1].startswith(ipython._ARGS_MAGIC + b"p")
+    assert ipython.unzip_args(packed) == items
+
+
+def test_pass_through(store):
+    items = [[_data("s1", {"aligner": "bwa"})], ["plain", 1]]
+    assert ipython.zip_args(items) is items
+    assert ipython.unzip_args(items) == items
+    assert ipython.unzip_args([[b"bytes"], None]) == [[b"bytes"], None]
+
+
+def test_cleanup(tmpdir):
+    dirs = {"work": str(tmpdir)}
+    store = ipython.ArgStore(ipython.get_store_dir(dirs, {}))
+    ipython.zip_args([[_data("s1", {"aligner": "bwa"})]], store)
+    assert os.path.exists(store.store_dir)
+    ipython.cleanup(dirs, {})
+    assert not os.path.exists(store.store_dir)
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from bcbio.distributed import multi, prun
+from bcbio.provenance import system
+
+
+def add_pid(data):
+    data = dict(data, pids=data.get("pids", []) + [os.getpid()])
+    return [[data]]
+
+
+class _FakeJoblib:
+    """Serial stand in for joblib, used when running a single job.
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def Parallel(self, num_jobs, **kwargs):
+        self.calls += 1
+        return lambda jobs: [fn(*args) for fn, args in jobs]
+
+    def delayed(self, fn):
+        return lambda *args: (fn, args)
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    out = []
+
+    class TrackedPool(multi.WorkerPool):
+        def __init__(self):
+            super(TrackedPool, self).__init__()
+            self.events = []
+            out.append(self)
+
+        def close(self):
+            self.events.append("close")
+            super(TrackedPool, self).close()
+
+        def terminate(self):
+            self.events.append("terminate")
+            super(TrackedPool, self).terminate()
+    monkeypatch.setattr(multi, "WorkerPool", TrackedPool)
+    monkeypatch.setattr(system, "get_info", lambda *args: {"cores": 2, "memory": 8.0})
+    return out
+
+
+def _items(n):
+    return [[{"description": "s%s" % i, "config": {"algorithm": {}, "resources": {}}}] for i in range(n)]
+
+
+def _parallel(cores):
+    return {"type": "local", "cores": cores}
+
+
+def test_pool_reused_across_calls(pools, tmpdir):
+    config = {"algorithm": {}, "resources": {}}
+    with prun.start(_parallel(2), _items(2), config, {"work": str(tmpdir)}) as run_parallel:
+        first = run_parallel(add_pid, _items(2))
+        pool = pools[0]._pool
+        second = run_parallel(add_pid, first)
+        assert pools[0]._pool is pool
+    assert len(pools) == 1
+    assert pools[0].events[-1] == "close"
+    assert "terminate" not in pools[0].events
+    assert pools[0]._pool is None
+    assert [x[0]["description"] for x in second] == ["s0", "s1"]
+    pool_pids = set(p for x in second for p in x[0]["pids"])
+    assert os.getpid() not in pool_pids
+    assert len(pool_pids) <= 2
+
+
+def test_pool_terminated_on_error(pools, tmpdir):
+    config = {"algorithm": {}, "resources": {}}
+    with pytest.raises(ValueError):
+        with prun.start(_parallel(2), _items(2), config, {"work": str(tmpdir)}) as run_parallel:
+            run_parallel(add_pid, _items(2))
+            raise ValueError("failed step")
+    assert pools[0].events[-1] == "terminate"
+    assert pools[0]._pool is None
+
+
+def test_single_core_skips_pool(pools, tmpdir, monkeypatch):
+    fake_joblib = _FakeJoblib()
+    monkeypatch.setattr(multi, "joblib", fake_joblib)
+    config = {"algorithm": {}, "resources": {}}
+    with prun.start(_parallel(1), _items(2), config, {"work": str(tmpdir)}) as run_parallel:
+        out = run_parallel(add_pid, _items(2))
+        assert pools[0]._pool is None
+    assert fake_joblib.calls == 1
+    assert [x[0]["pids"] for x in out] == [[os.getpid()], [os.getpid()]]
@@ -0,0 +1,26 @@
+import pytest
+
+from bcbio.distributed import resources
+
+
+def _calculate(prog_resources, measured):
+    config = {"algorithm": {}, "resources": prog_resources}
+    parallel = {"type": "local", "cores": 8, "progs": list(prog_resources), "block": "test"}
+    return resources.calculate(parallel, [{"config": config}] * 8, {}, config, measured=measured)
+
+
+def test_measured_memory_margin_and_minimum():
+    assert resources._measured_memory_per_core((2.0, 10), 4.0, "test") == pytest.approx(2.5)
+    assert resources._measured_memory_per_core((0.1, 10), 4.0, "test") == resources.MEASURED_MEMORY_MIN
+    assert resources._measured_memory_per_core((2.0, 10), 4.0, "test", 3.5) == 3.5
+
+
+def test_measured_memory_without_history():
+    assert resources._measured_memory_per_core((None, 0), 3.0, "test") == 3.0
+    assert _calculate({"samtools": {"memory": "3g"}}, (None, 0))["mem"] == "3.00"
+
+
+def test_measured_memory_keeps_jvm_heap():
+    assert _calculate({"samtools": {"memory": "3g"}}, (1.0, 10))["mem"] == "1.25"
+    jvm = {"samtools": {"memory": "3g"}, "picard": {"jvm_opts": ["-Xms750m", "-Xmx2g"]}}
+    assert _calculate(jvm, (1.0, 10))["mem"] == "2.00"
@@ -0,0 +1,101 @@
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+
+from bcbio.distributed import objectstore, staging
+
+
+class FakeClient(object):
+
+    def __init__(self, data, etag=None, encryption=None):
+        self.data = data
+        self.etag = etag or hashlib.md5(data).hexdigest()
+        self.encryption = encryption or {}
+        self.ranges = []
+
+    def head_object(self, Bucket, Key):
+        return dict({"ContentLength": len(self.data), "ETag": '"%s"' % self.etag}, **self.encryption)
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = [int(x) for x in Range.split("=")[1].split("-")]
+        self.ranges.append(start)
+        return {"Body": io.BytesIO(self.data[start:end + 1])}
+
+
+DATA = os.urandom(10000)
+
+
+class TestRangedDownload(object):
+
+    def test_downloads_parts(self, tmpdir):
+        client = FakeClient(DATA)
+        out_file = str(tmpdir.join("reads.bam"))
+        staging.ranged_download(staging.S3Source(client, "b", "k"), out_file, part_size=1024)
+        with open(out_file, "rb") as in_handle:
+            assert in_handle.read() == DATA
+        assert len(client.ranges) == 10
+        assert not os.path.exists(out_file + ".parts")
+
+    def test_resumes_finished_parts(self, tmpdir):
+        out_file = str(tmpdir.join("reads.bam"))
+        with open(out_file + ".partial", "wb") as out_handle:
+            out_handle.write(DATA[:2048] + b"\0" * (len(DATA) - 2048))
+        with open(out_file + ".parts", "w") as out_handle:
+            out_handle.write("0\n1\n")
+        client = FakeClient(DATA)
+        staging.ranged_download(staging.S3Source(client, "b", "k"), out_file, part_size=1024)
+        with open(out_file, "rb") as in_handle:
+            assert in_handle.read() == DATA
+        assert sorted(client.ranges) == [i * 1024 for i in range(2, 10)]
+
+    def test_checksum_mismatch(self, tmpdir):
+        client = FakeClient(DATA, etag="0" * 32)
+        out_file = str(tmpdir.join("reads.bam"))
+        with pytest.raises(staging.DownloadError):
+            staging.ranged_download(staging.S3Source(client, "b", "k"), out_file, part_size=1024)
+        assert not os.path.exists(out_file)
+        assert not os.path.exists(out_file + ".partial")
+
+    @pytest.mark.parametrize("encryption", [{"ServerSideEncryption": "aws:kms"},
+                                            {"SSECustomerAlgorithm": "AES256"}])
+    def test_encrypted_checks_size_only(self, tmpdir, encryption):
+        client = FakeClient(DATA, etag="0" * 32, encryption=encryption)
+        out_file = str(tmpdir.join("reads.bam"))
+        staging.ranged_download(staging.S3Source(client, "b", "k"), out_file, part_size=1024)
+        with open(out_file, "rb") as in_handle:
+            assert in_handle.read() == DATA
+        with open(out_file, "wb") as out_handle:
+            out_handle.write(DATA[:-1])
+        with pytest.raises(staging.DownloadError):
+            staging._check_download(staging.S3Source(client, "b", "k"), out_file)
+
+
+def test_download_waits_for_staged_files(mocker, tmpdir):
+    input_dir = str(tmpdir)
+    fnames = ["s3://bucket/sample_%s.fq.gz" % i for i in range(4)]
+    direct = mocker.patch("bcbio.distributed.objectstore.download_direct",
+                          side_effect=lambda f, d, dl_dir=None: os.path.join(d, os.path.basename(f)))
+    with staging.prefetch(fnames, input_dir, max_workers=2):
+        assert objectstore.download(fnames[0], input_dir) == os.path.join(input_dir, "sample_0.fq.gz")
+    assert direct.call_count == 4
+    assert objectstore._stager is None
+
+
+def test_error_cancels_pending_downloads(mocker, tmpdir):
+    input_dir = str(tmpdir)
+    fnames = ["s3://bucket/sample_%s.fq.gz" % i for i in range(4)]
+    release = threading.Event()
+
+    def _slow_download(f, d, dl_dir=None):
+        release.wait(5)
+        return os.path.join(d, os.path.basename(f))
+    direct = mocker.patch("bcbio.distributed.objectstore.download_direct", side_effect=_slow_download)
+    with pytest.raises(ValueError):
+        with staging.prefetch(fnames, input_dir, max_workers=1):
+            raise ValueError("bad sample")
+    release.set()
+    assert direct.call_count <= 1
+    assert objectstore._stager is None
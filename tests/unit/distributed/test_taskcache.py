@@ -0,0 +1,103 @@
+import argparse
+import os
+import time
+
+from bcbio.distributed import taskcache
+
+
+def _items(work_dir, num_cores=1):
+    in_file = os.path.join(work_dir, "in.bam")
+    return [[{"description": "s1", "work_bam": in_file,
+              "config": {"algorithm": {"num_cores": num_cores},
+                         "parallel": {"cores": num_cores}}}]]
+
+
+def _runner(calls):
+    def run_items(items):
+        calls.extend(items)
+        out = []
+        for args in items:
+            data = dict(args[0])
+            out_file = data["work_bam"].replace(".bam", "-out.txt")
+            with open(out_file, "w") as out_handle:
+                out_handle.write("out")
+            data["out_file"] = out_file
+            out.append([data])
+        return out
+    return run_items
+
+
+def test_task_key_stable(tmpdir):
+    work_dir = str(tmpdir)
+    in_file = os.path.join(work_dir, "in.bam")
+    with open(in_file, "w") as out_handle:
+        out_handle.write("bam")
+    key = taskcache.task_key("fn", _items(work_dir))
+    assert key == taskcache.task_key("fn", _items(work_dir))
+    assert key == taskcache.task_key("fn", _items(work_dir, num_cores=16))
+    assert key != taskcache.task_key("other_fn", _items(work_dir))
+    assert key != taskcache.task_key("fn", _items(work_dir), versions="bwa,0.7.17")
+    with open(in_file, "w") as out_handle:
+        out_handle.write("changed bam")
+    assert key != taskcache.task_key("fn", _items(work_dir))
+
+
+def test_run_reuses_and_invalidates(tmpdir):
+    work_dir = str(tmpdir)
+    with open(os.path.join(work_dir, "in.bam"), "w") as out_handle:
+        out_handle.write("bam")
+    cache_dir = taskcache.get_cache_dir(work_dir)
+    calls = []
+    first = taskcache.run(cache_dir, "fn", _items(work_dir), _runner(calls))
+    second = taskcache.run(cache_dir, "fn", _items(work_dir, num_cores=8), _runner(calls))
+    assert len(calls) == 1
+    assert first == second
+    assert taskcache._outputs_exist(first)
+    os.remove(first[0][0]["out_file"])
+    assert not taskcache._outputs_exist(first)
+    taskcache.run(cache_dir, "fn", _items(work_dir), _runner(calls))
+    assert len(calls) == 2
+    assert taskcache.run(None, "fn", _items(work_dir), _runner(calls))
+    assert len(calls) == 3
+
+
+def _fill_cache(cache_dir):
+    now = time.time()
+    for fn_name, i, age_days in [("fn1", 0, 0), ("fn1", 1, 10), ("fn2", 0, 20)]:
+        cache_file = taskcache._cache_file(cache_dir, fn_name, "key%s" % i)
+        taskcache._put(cache_file, [{"i": i, "data": "x" * 1000}])
+        os.utime(cache_file, (now - age_days * 86400, now - age_days * 86400))
+
+
+def _cached(cache_dir):
+    return sorted(os.path.join(os.path.basename(r), f) for r, _, fs in os.walk(cache_dir) for f in fs)
+
+
+def test_evict(tmpdir):
+    cache_dir = str(tmpdir.join("cache"))
+    assert taskcache.evict(cache_dir) == 0
+    _fill_cache(cache_dir)
+    assert taskcache.evict(cache_dir, max_age_days=5) == 2
+    assert _cached(cache_dir) == ["fn1/key0.pkl"]
+    _fill_cache(cache_dir)
+    assert taskcache.evict(cache_dir, max_size_gb=1500 / (1024.0 ** 3)) == 2
+    assert _cached(cache_dir) == ["fn1/key0.pkl"]
+    _fill_cache(cache_dir)
+    assert taskcache.evict(cache_dir, "fn1") == 2
+    assert _cached(cache_dir) == ["fn2/key0.pkl"]
+    assert taskcache.evict(cache_dir) == 1
+    assert not os.path.exists(cache_dir)
+
+
+def test_cli(tmpdir, capsys):
+    work_dir = str(tmpdir)
+    cache_dir = taskcache.get_cache_dir(work_dir)
+    _fill_cache(cache_dir)
+    parser = argparse.ArgumentParser()
+    taskcache.add_subparser(parser.add_subparsers())
+    args = parser.parse_args(["taskcache", "--workdir", work_dir, "--fn", "fn2"])
+    taskcache.process(args)
+    assert "Removed 1 cached task results" in capsys.readouterr().out
+    assert _cached(cache_dir) == ["fn1/key0.pkl", "fn1/key1.pkl"]
+    taskcache.process(parser.parse_args(["taskcache", "--workdir", work_dir, "--max-age", "5"]))
+    assert _cached(cache_dir) == ["fn1/key0.pkl"]
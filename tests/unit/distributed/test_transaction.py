@@ -1,3 +1,5 @@
+import errno
+
 import pytest
 import mock
 
@@ -235,3 +237,71 @@ class TestFileTransaction(object):
         with file_transaction(CONFIG, '/some/path'):
             pass
         assert not transaction.shutil.move.called
+
+    def test_renames_on_same_filesystem(self, tmpdir):
+        original = str(tmpdir.join('out.txt'))
+        before = transaction.move_stats()
+        config = {'resources': {'tmp': {'dir': str(tmpdir.join('tx'))}}}
+        with file_transaction(config, original) as tmp_path:
+            with open(tmp_path, 'w') as out_handle:
+                out_handle.write('x' * 10)
+        after = transaction.move_stats()
+        assert open(original).read() == 'x' * 10
+        assert not tmpdir.join('out.txt.bcbiotmp').exists()
+        assert after['renamed_bytes'] - before['renamed_bytes'] == 10
+        assert after['copied_bytes'] == before['copied_bytes']
+
+
+class TestCrossDevice:
+
+    @pytest.fixture
+    def other_cwd(self, tmpdir, monkeypatch):
+        """Place the working directory on a different device than outputs in tmpdir/out.
+        """
+        out_dir = tmpdir.join('out')
+        out_dir.ensure(dir=True)
+        real_device = transaction._device
+        cwd = str(tmpdir.join('cwd'))
+
+        def device(path):
+            dev = real_device(path)
+            return dev + 1 if path.startswith(cwd) else dev
+        monkeypatch.setattr(transaction, '_device', device)
+        monkeypatch.setattr(transaction.os, 'getcwd', lambda: cwd)
+        return out_dir
+
+    def test_transaction_dir_removed(self, other_cwd):
+        original = str(other_cwd.join('out.txt'))
+        before = transaction.move_stats()
+        with file_transaction(original) as tmp_path:
+            assert tmp_path.startswith(str(other_cwd.join(transaction.DEFAULT_TMP)))
+            with open(tmp_path, 'w') as out_handle:
+                out_handle.write('x' * 10)
+        assert open(original).read() == 'x' * 10
+        assert transaction.move_stats()['renamed_files'] == before['renamed_files'] + 1
+        assert other_cwd.listdir() == [other_cwd.join('out.txt')]
+
+    def test_transaction_dir_kept_while_in_use(self, other_cwd):
+        with file_transaction(str(other_cwd.join('a.txt'))) as tmp_a:
+            with file_transaction(str(other_cwd.join('b.txt'))) as tmp_b:
+                open(tmp_b, 'w').close()
+            assert other_cwd.join(transaction.DEFAULT_TMP).exists()
+            open(tmp_a, 'w').close()
+        assert not other_cwd.join(transaction.DEFAULT_TMP).exists()
+
+    def test_copy_file_range_exdev_fallback(self, tmpdir, monkeypatch):
+        tx_file = str(tmpdir.join('tx.txt'))
+        final_file = str(tmpdir.join('final.txt'))
+        with open(tx_file, 'w') as out_handle:
+            out_handle.write('x' * 10)
+
+        def exdev(*args):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        monkeypatch.setattr(transaction, '_device', lambda path: -1)
+        monkeypatch.setattr(transaction.os, 'copy_file_range', exdev, raising=False)
+        before = transaction.move_stats()
+        _move_file_with_sizecheck(tx_file, final_file)
+        assert open(final_file).read() == 'x' * 10
+        assert not tmpdir.join('tx.txt').exists()
+        assert not tmpdir.join('final.txt.bcbiotmp').exists()
+        assert transaction.move_stats()['copied_files'] == before['copied_files'] + 1
@@ -0,0 +1,110 @@
+import datetime
+import gzip
+import os
+
+import pandas as pd
+import pytest
+
+from bcbio.graph import collectl
+
+
+RAW = """# SubSys: b Options: z Interval: 10 NumCPUs: 4 NumBud: 0 Flags: ix
+# Kernel: 3.10.0 Memory: 16318712 kB Swap: 0 kB
+>>> 1400000000.000 <<<
+cpu 1 1 1 1 1 1 1 1 0 0
+MemTotal: 1 kB
+MemFree: 1 kB
+Buffers: 1 kB
+Cached: 1 kB
+>>> 1500000000.001 <<<
+cpu 100 1 20 500 3 0 2 0 0 0
+disk 8 0 sda 10 1 200 30 5 2 80 40 0 50 70
+Net   eth0: 1000 10 0 0 0 0 0 0 2000 20 0 0 0 0 0 0
+Net   lo:500 5 0 0 0 0 0 0 500 5 0 0 0 0 0 0
+MemTotal:       16318712 kB
+MemFree:         1000000 kB
+Buffers:           20000 kB
+Cached:           300000 kB
+>>> 1500000010.002 <<<
+cpu 110 1 25 590 3 0 2 0 0 0
+disk 8 0 sda 12 1 240 33 6 2 96 44 0 55 77
+disk 8 16 sdb 1 0 8 1 0 0 0 0 0 1 1
+Net   eth0: 1500 15 0 0 0 0 0 0 2600 26 0 0 0 0 0 0
+MemTotal:       16318712 kB
+MemFree:          900000 kB
+Buffers:           20000 kB
+Cached:           310000 kB
+>>> 1500000020.000 <<<
+"""
+
+
+def _expected():
+    """Columns from the previous dictionary based parser for RAW.
+    """
+    tstamps = [1500000000, 1500000010]
+    cols = {"cpu_user": [100, 110], "cpu_nice": [1, 1], "cpu_sys": [20, 25], "cpu_idle": [500, 590],
+            "cpu_wait": [3, 3], "cpu_irq": [0, 0], "cpu_soft": [2, 2], "cpu_steal": [0, 0],
+            "mem_total": [16318712, 16318712], "mem_free": [1000000, 900000],
+            "mem_buffers": [20000, 20000], "mem_cached": [300000, 310000]}
+    for node, vals in [("sda", [[10, 1, 200, 30, 5, 2, 80, 40, 0, 50, 70],
+                                [12, 1, 240, 33, 6, 2, 96, 44, 0, 55, 77]]),
+                       ("sdb", [[0] * 11, [1, 0, 8, 1, 0, 0, 0, 0, 0, 1, 1]])]:
+        for i, field in enumerate(collectl.DISK_FIELDS):
+            cols["%s_%s" % (node, field)] = [v[i] for v in vals]
+    for iface, vals in [("eth0", [[1000, 10, 2000, 20], [1500, 15, 2600, 26]]),
+                        ("lo", [[500, 5, 500, 5], [0, 0, 0, 0]])]:
+        for field in collectl.NET_FIELDS:
+            cols["%s_%s" % (iface, field)] = [0, 0]
+        for field, i in [("rbyte", 0), ("rpkt", 1), ("tbyte", 2), ("tpkt", 3)]:
+            cols["%s_%s" % (iface, field)] = [v[i] for v in vals]
+    df = pd.DataFrame(cols, index=pd.to_datetime(tstamps, unit="s", utc=True), dtype=float)
+    df.index.name = "tstamp"
+    return df
+
+
+@pytest.fixture
+def raw_file(tmpdir):
+    """Gzipped collectl raw file still being written, without the gzip trailer.
+    """
+    fname = str(tmpdir.join("host-20170714-000000.raw.gz"))
+    with gzip.open(fname, "wb") as out_handle:
+        out_handle.write(RAW.encode())
+    with open(fname, "rb") as in_handle:
+        data = in_handle.read()
+    with open(fname, "wb") as out_handle:
+        out_handle.write(data[:-8])
+    return fname
+
+
+def _load(raw_file, cache_dir=None):
+    start = datetime.datetime(2017, 7, 14, 2, 40)
+    end = datetime.datetime(2017, 7, 14, 2, 42)
+    return collectl.load_collectl(os.path.join(os.path.dirname(raw_file), "*.raw.gz"),
+                                  start, end, cache_dir)
+
+
+def test_matches_previous_parse(raw_file):
+    df, hardware = _load(raw_file)
+    assert hardware == {"num_cpus": 4, "memory": 16}
+    pd.testing.assert_frame_equal(df, _expected(), check_like=True, check_freq=False)
+
+
+def test_parse_chunks(raw_file):
+    chunks = list(collectl.iter_chunks(raw_file, 1500000000, 1500000100, chunk_size=1))
+    assert [len(x["tstamp"]) if x is not None else None for _, x in chunks] == [1, 1, None]
+    cols = collectl._concat_chunks([x for _, x in chunks])
+    assert list(cols["sdb_num_reads"]) == [0, 1]
+
+
+def test_npz_cache(raw_file, tmpdir):
+    cache_dir = str(tmpdir.join("cache"))
+    df, hardware = _load(raw_file, cache_dir)
+    cache_files = os.listdir(cache_dir)
+    assert len(cache_files) == 1
+    cached_df, cached_hardware = _load(raw_file, cache_dir)
+    assert cached_hardware == hardware
+    pd.testing.assert_frame_equal(cached_df, df, check_like=True, check_freq=False)
+    # cache is keyed on the raw file, so changes are parsed again
+    os.utime(raw_file, (1, 1))
+    _load(raw_file, cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
@@ -0,0 +1,40 @@
+import datetime
+import io
+
+import pytest
+
+from bcbio.heterogeneity import loh
+
+
+EDN = r'''{:name #{"TP53"}, :support {:variants ["a \"b\"" "c\nd"] :drugs (1 -2.5 3M)}
+ :ns #:civic{:id 7} :flags [nil true false \a] ; comment
+ :skip #_ [1 2] #uuid "f81d4fae-7dec-11d0-a765-00a0c91e6bf6"}'''
+
+
+def test_edn_loads():
+    v = loh.edn_loads(EDN)
+    assert v["name"] == set(["TP53"])
+    assert v["support"]["variants"] == ['a "b"', "c\nd"]
+    assert v["support"]["drugs"][:2] == [1, -2.5]
+    assert v["ns"] == {"civic/id": 7}
+    assert v["flags"] == [None, True, False, "a"]
+    assert str(v["skip"]) == "f81d4fae-7dec-11d0-a765-00a0c91e6bf6" and "id" not in v
+
+
+@pytest.mark.parametrize("blocksize", [1, 5, 1024])
+def test_edn_iter_streams_forms(blocksize):
+    forms = list(loh.edn_iter(io.StringIO(EDN + " [1 2]\n:done ; end"), blocksize=blocksize))
+    assert forms == [loh.edn_loads(EDN), [1, 2], "done"]
+
+
+@pytest.mark.parametrize("edn", ["[1 2", "{:a 1]", '"abc', "{:a}"])
+def test_edn_invalid(edn):
+    with pytest.raises(ValueError):
+        loh.edn_loads(edn)
+
+
+def test_edn_inst():
+    utc = datetime.timezone.utc
+    v = loh.edn_loads('[#inst "1985-04-12T23:20:50.52Z" #inst "2019-01-02T03:04:05-08:00"]')
+    assert v[0] == datetime.datetime(1985, 4, 12, 23, 20, 50, 520000, tzinfo=utc)
+    assert v[1] == datetime.datetime(2019, 1, 2, 11, 4, 5, tzinfo=utc)
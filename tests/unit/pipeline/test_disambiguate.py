@@ -0,0 +1,82 @@
+import gzip
+import importlib
+import os
+import random
+
+import pysam
+import pytest
+
+# the package exports a run function shadowing the module
+run = importlib.import_module("bcbio.pipeline.disambiguate.run")
+
+OUT_NAMES = ["hum_unique.bam", "hum_ambiguous.bam", "mou_unique.bam", "mou_ambiguous.bam"]
+
+
+def _write_bam(out_file, names, algorithm, rand):
+    header = {"HD": {"VN": "1.6", "SO": "queryname"}, "SQ": [{"SN": "chr1", "LN": 1000000}]}
+    with pysam.AlignmentFile(out_file, "wb", header=header) as out_handle:
+        for name in names:
+            for flag in [99, 147]:
+                read = pysam.AlignedSegment()
+                read.query_name = name
+                read.flag = flag
+                read.reference_id = 0
+                read.reference_start = rand.randint(0, 900000)
+                read.mapping_quality = 60
+                read.cigartuples = [(0, 100)]
+                read.query_sequence = "".join(rand.choice("ACGT") for _ in range(100))
+                read.query_qualities = pysam.qualitystring_to_array("I" * 100)
+                read.next_reference_id = 0
+                read.next_reference_start = read.reference_start
+                if algorithm == "tophat":
+                    read.set_tags([("XO", rand.randint(0, 1)), ("NM", rand.randint(0, 3)), ("NH", 1)])
+                else:
+                    read.set_tags([("AS", rand.randint(90, 100)), ("NM", rand.randint(0, 3))])
+                out_handle.write(read)
+    return out_file
+
+
+def _inputs(tmpdir, algorithm):
+    rand = random.Random(42)
+    names = ["read%d" % i for i in range(3000)]
+    human = [x for x in names if rand.random() < 0.9]
+    mouse = [x for x in names if rand.random() < 0.7]
+    return (_write_bam(str(tmpdir.join("human.bam")), human, algorithm, rand),
+            _write_bam(str(tmpdir.join("mouse.bam")), mouse, algorithm, rand))
+
+
+def _uncompressed(in_file):
+    with gzip.open(in_file) as in_handle:
+        return in_handle.read()
+
+
+@pytest.mark.parametrize("algorithm", ["tophat", "bwa"])
+def test_parts_match_single_pass(tmpdir, algorithm):
+    human, mouse = _inputs(tmpdir, algorithm)
+    keys, humoffsets, mouoffsets = run._split_points(human, mouse, 4)
+    assert len(keys) == 3 and keys == sorted(keys)
+    outs = {}
+    for cores in [1, 4]:
+        out_dir = tmpdir.mkdir("cores%s" % cores)
+        outnames = [str(out_dir.join(x)) for x in OUT_NAMES]
+        counts = run._run_parts(human, mouse, outnames, algorithm, cores)
+        outs[cores] = (counts, [_uncompressed(x) for x in outnames])
+        assert sorted(os.listdir(str(out_dir))) == sorted(OUT_NAMES)
+    assert outs[1] == outs[4]
+    assert all(outs[1][0])
+
+
+def test_split_offsets_start_read_groups(tmpdir):
+    human, mouse = _inputs(tmpdir, "bwa")
+    keys, humoffsets, mouoffsets = run._split_points(human, mouse, 4)
+    for fname, offsets in [(human, humoffsets), (mouse, mouoffsets)]:
+        with pysam.AlignmentFile(fname, "rb") as in_bam:
+            names = []
+            for read in in_bam:
+                if not names or names[-1] != read.query_name:
+                    names.append(read.query_name)
+        with pysam.AlignmentFile(fname, "rb") as in_bam:
+            for key, offset in zip(keys, offsets):
+                in_bam.seek(offset)
+                name = next(in_bam).query_name
+                assert name == min((x for x in names if run._natural_key(x) >= key), key=run._natural_key)
@@ -0,0 +1,45 @@
+import copy
+
+from bcbio import utils
+from bcbio.distributed import dag
+from bcbio.pipeline import main
+
+
+def _fake_run_parallel(fn_name, items):
+    out = []
+    for args in items:
+        datas = [utils.to_single_data(x) for x in args] if fn_name == "prep_samples" else [args[0]]
+        for data in datas:
+            data = copy.deepcopy(data)
+            data["steps"] = data.get("steps", []) + [fn_name]
+            if fn_name == "prep_samples":
+                data["config"]["algorithm"]["variant_regions"] = "cleaned-%s" % data["steps"]
+            elif fn_name == "delayed_bam_merge":
+                data.pop("combine")
+            out.append([data])
+    return out
+
+
+def _samples(work_dir):
+    out = []
+    for name, parts in [("s1", ["0-100", "100-200"]), ("s2", [None])]:
+        for part in parts:
+            data = {"description": name, "rgnames": {"sample": name, "lane": name},
+                    "dirs": {"work": work_dir}, "work_bam": "%s-%s.bam" % (name, part),
+                    "config": {"algorithm": {"variant_regions": "regions.bed"}}}
+            if part:
+                data["align_split"] = part
+                data["combine"] = {"work_bam": {"out": "%s.bam" % name, "extras": []}}
+            out.append([data])
+    return out
+
+
+def test_pipelined_alignment_matches_sequential(tmpdir):
+    steps = main._alignment_steps(_fake_run_parallel)
+    sequential = main._run_steps(_samples(str(tmpdir)), steps)
+    pipelined = dag.run_samples(_samples(str(tmpdir)), steps, 2)
+    by_name = lambda xs: sorted(xs, key=lambda x: x[0]["description"])
+    assert by_name(pipelined) == by_name(sequential)
+    assert [x[0]["steps"] for x in by_name(sequential)] == \
+        [["process_alignment", "delayed_bam_merge", "prep_samples", "postprocess_alignment"],
+         ["process_alignment", "prep_samples", "postprocess_alignment"]]
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from bcbio.pipeline import qcsummary
+
+
+def _data(resources=None):
+    return {"description": "s1",
+            "config": {"algorithm": {"num_cores": 4, "qc": ["samtools", "coverage"]},
+                       "resources": resources or {}}}
+
+
+def test_concurrent_tools_get_own_data(tmpdir):
+    data = _data()
+
+    def mutating_tool(bam_file, data, out_dir):
+        data["config"]["algorithm"]["qc"].append(out_dir)
+        data["config"]["resources"]["seen"] = out_dir
+        time.sleep(0.05)
+        return {"metrics": {out_dir: list(data["config"]["algorithm"]["qc"])}}
+    tools = {"samtools": mutating_tool, "coverage": mutating_tool}
+    out = qcsummary._run_concurrently(["samtools", "coverage"], tools, "in.bam", data, str(tmpdir))
+    assert data == _data()
+    for name in ["samtools", "coverage"]:
+        out_dir = str(tmpdir.join(name))
+        assert out[name]["metrics"][out_dir] == ["samtools", "coverage", out_dir]
+
+
+def test_tool_memory():
+    assert qcsummary._tool_memory("samtools", 2, _data()) == 0
+    assert qcsummary._tool_memory("picard", 1, _data()) == 2
+    assert qcsummary._tool_memory("picard", 1, _data({"picard": {"jvm_opts": ["-Xms750m", "-Xmx3g"]}})) == 3
+    assert qcsummary._tool_memory("qualimap", 4, _data()) == 4
+    assert qcsummary._tool_memory("qualimap_rnaseq", 1, _data({"qualimap": {"memory": "512m"}})) == 0.5
+
+
+def test_concurrent_tools_share_memory(tmpdir):
+    # 4 cores at the 1g default: room for every tool's cores but only one Java heap at a time
+    data = _data()
+    running = []
+    overlaps = []
+    lock = threading.Lock()
+
+    def java_tool(bam_file, data, out_dir):
+        with lock:
+            running.append(out_dir)
+            overlaps.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(out_dir)
+    hints = {"javaA": {"cores": 1, "cost": 2, "memory": "3g"},
+             "javaB": {"cores": 1, "cost": 1, "memory": "2g"}}
+    qcsummary.QC_TOOL_HINTS.update(hints)
+    try:
+        assert qcsummary._sample_memory(list(hints), data) == 4
+        qcsummary._run_concurrently(list(hints), {x: java_tool for x in hints}, "in.bam", data,
+                                    str(tmpdir))
+    finally:
+        for x in hints:
+            qcsummary.QC_TOOL_HINTS.pop(x)
+    assert overlaps == [1, 1]
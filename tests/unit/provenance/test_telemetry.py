@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import threading
+from concurrent import futures
+
+import pytest
+
+from bcbio.provenance import telemetry
+
+
+@pytest.fixture(autouse=True)
+def move_stats(monkeypatch):
+    monkeypatch.setattr(telemetry.transaction, "move_stats", lambda: {"renamed_bytes": 0, "copied_bytes": 0})
+
+
+def _rows(work_dir, query):
+    conn = sqlite3.connect(telemetry.get_db(work_dir))
+    out = conn.execute(query).fetchall()
+    conn.close()
+    return out
+
+
+def test_stages_by_thread(tmpdir):
+    work_dir = str(tmpdir)
+    barrier = threading.Barrier(2)
+
+    def run(label):
+        with telemetry.stage(label, {"work": work_dir}):
+            barrier.wait()
+            m = telemetry.Measurement("cmd", "cmd-%s" % label)
+            barrier.wait()
+            m.finish()
+    with futures.ThreadPoolExecutor(2) as executor:
+        list(executor.map(run, ["a", "b"]))
+    rows = _rows(work_dir, "SELECT label, stage, shared, user FROM usage WHERE kind = 'cmd' ORDER BY label")
+    assert rows == [("cmd-a", "a", 1, None), ("cmd-b", "b", 1, None)]
+
+
+def test_nested_and_propagated(tmpdir):
+    work_dir = str(tmpdir)
+
+    def task(data):
+        telemetry.Measurement("cmd", "nested").finish()
+        with futures.ThreadPoolExecutor(1) as executor:
+            executor.submit(telemetry.propagate(lambda: telemetry.Measurement("cmd", "thread").finish())).result()
+    telemetry.timed_task(task, "task", "block", {"dirs": {"work": work_dir}})
+    rows = _rows(work_dir, "SELECT kind, label, block, stage, shared FROM usage ORDER BY label")
+    assert rows == [("cmd", "nested", "block", "task", 0), ("task", "task", "block", "task", 0),
+                    ("cmd", "thread", "block", "task", 0)]
+    assert _rows(work_dir, "PRAGMA journal_mode") == [("delete",)]
+
+
+def test_shared_only_while_concurrent(tmpdir):
+    work_dir = str(tmpdir)
+    started, release = threading.Event(), threading.Event()
+
+    def concurrent():
+        m = telemetry.Measurement("cmd", "concurrent")
+        started.set()
+        release.wait(5)
+        m.finish()
+
+    def task(data):
+        telemetry.Measurement("cmd", "before").finish()
+        thread = threading.Thread(target=telemetry.propagate(concurrent))
+        thread.start()
+        started.wait(5)
+        telemetry.Measurement("cmd", "during").finish()
+        release.set()
+        thread.join()
+        telemetry.Measurement("cmd", "after").finish()
+        assert not os.path.exists(telemetry.get_db(work_dir))
+    telemetry.timed_task(task, "task", "block", {"dirs": {"work": work_dir}})
+    rows = _rows(work_dir, "SELECT label, shared FROM usage WHERE kind = 'cmd' ORDER BY label")
+    assert rows == [("after", 0), ("before", 0), ("concurrent", 1), ("during", 1)]
+
+
+def test_block_memory_and_summarize(tmpdir):
+    db_file = telemetry.get_db(str(tmpdir))
+    assert telemetry.block_memory(db_file, "align") == (None, 0)
+    base = {"kind": "task", "block": "align", "stage": "process_alignment", "success": 1}
+    telemetry.write(db_file, [dict(base, label="a", max_rss_mb=8192, cores=4, wall=10),
+                              dict(base, label="b", max_rss_mb=3072, cores=1, wall=30),
+                              dict(base, label="failed", max_rss_mb=65536, cores=1, success=0),
+                              dict(base, label="other", block="qc", max_rss_mb=65536, cores=1),
+                              dict(base, label="c", cores=2, wall=20)])
+    assert telemetry.block_memory(db_file, "align") == (3.0, 2)
+    summary = telemetry.summarize(db_file, top_n=2, kind="task")
+    assert [row[1] for row in summary["process_alignment"]] == ["b", "c"]
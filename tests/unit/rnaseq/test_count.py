@@ -0,0 +1,28 @@
+from bcbio.rnaseq import count
+
+
+def _write(tmpdir, name, content):
+    fname = tmpdir.join(name)
+    fname.write(content)
+    return str(fname)
+
+
+def test_combine_aligns_features(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    files = [_write(tmpdir, "a.counts", "# featureCounts\ng1\t5\ng2\t0\n"),
+             _write(tmpdir, "b.counts", "g2\t4\ng1\t2\ng3\t9\n")]
+    out_file = count.combine_count_files(files, str(tmpdir.join("combined.counts")))
+    with open(out_file) as in_handle:
+        assert in_handle.read() == "id\ta\tb\ng1\t5\t2\ng2\t0\t4\ng3\t0\t9\n"
+    df = count.load_combined_count_file(out_file)
+    assert df.loc["g3"].tolist() == [0, 9]
+
+
+def test_annotate_from_gtf(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    count_file = _write(tmpdir, "combined.counts", "id\ta\ng1\t5\ng2\t1\n")
+    gtf_file = _write(tmpdir, "genes.gtf",
+                      '1\tsrc\texon\t1\t10\t.\t+\t.\tgene_id "g1"; gene_name "ABC";\n')
+    out_file = count.annotate_combined_count_file(count_file, gtf_file)
+    with open(out_file) as in_handle:
+        assert in_handle.read() == "id\ta\tsymbol\ng1\t5\tABC\ng2\t1\t\n"
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import scipy.io
+import scipy.sparse
+
+from bcbio.rnaseq import umi
+
+
+def _write_counts(tmpdir, name, matrix, rownames, colnames):
+    fname = str(tmpdir.join(name))
+    with open(fname, "wb") as out_handle:
+        scipy.io.mmwrite(out_handle, scipy.sparse.coo_matrix(matrix))
+    tmpdir.join(name + ".rownames").write("".join("%s\n" % x for x in rownames))
+    tmpdir.join(name + ".colnames").write("".join("%s\n" % x for x in colnames))
+    return fname
+
+
+@pytest.mark.parametrize("dtype", [np.int64, np.float64])
+def test_concatenated_counts_match_scipy(tmpdir, monkeypatch, dtype):
+    monkeypatch.chdir(str(tmpdir))
+    genes = ["g1", "g2", "g3", "g4"]
+    # different populated rows per sample, empty columns and an empty sample
+    matrices = [np.array([[1, 0, 0], [0, 0, 2], [0, 0, 0], [3, 0, 0]], dtype=dtype),
+                np.array([[0, 0], [0, 0], [0, 0], [0, 0]], dtype=dtype),
+                np.array([[0], [5], [7], [0]], dtype=dtype)]
+    if dtype == np.float64:
+        matrices[2] = matrices[2] / 3.0
+    files = [_write_counts(tmpdir, "s%s.mtx" % i, m, genes, ["c%s" % j for j in range(m.shape[1])])
+             for i, m in enumerate(matrices)]
+    out_file = umi.write_concatenated_counts(files, ["s0", "s1", "s2"], str(tmpdir.join("tagcounts.mtx")))
+    expected = scipy.sparse.hstack([scipy.io.mmread(f) for f in files]).toarray()
+
+    sm = umi.SparseMatrix()
+    sm.read(out_file)
+    assert np.array_equal(sm.matrix.toarray(), expected)
+    assert np.array_equal(scipy.io.mmread(out_file).toarray(), expected)
+    assert sm.rownames == genes
+    assert sm.colnames == ["s0:c0", "s0:c1", "s0:c2", "s1:c0", "s1:c1", "s2:c0"]
+
+    npz = umi.SparseMatrix()
+    npz.read_npz(str(tmpdir.join("tagcounts.npz")))
+    assert np.array_equal(npz.matrix.toarray(), expected)
+    assert npz.rownames == sm.rownames
+    assert npz.colnames == sm.colnames
+
+
+def test_concatenated_counts_need_same_rows(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    files = [_write_counts(tmpdir, "s0.mtx", np.array([[1], [2]]), ["g1", "g2"], ["c0"]),
+             _write_counts(tmpdir, "s1.mtx", np.array([[1], [2], [3]]), ["g1", "g2", "g3"], ["c0"])]
+    with pytest.raises(ValueError):
+        scipy.sparse.hstack([scipy.io.mmread(f) for f in files])
+    with pytest.raises(ValueError, match="different numbers of rows"):
+        umi.write_concatenated_counts(files, ["s0", "s1"], str(tmpdir.join("tagcounts.mtx")))
@@ -0,0 +1,38 @@
+import os
+
+import pysam
+
+from bcbio.bam import stats
+from bcbio.structural import shared
+
+
+def _paired_bam(bam_file, n):
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"}, "SQ": [{"SN": "chr1", "LN": 100000}]}
+    with pysam.AlignmentFile(bam_file, "wb", header=header) as out_handle:
+        for i in range(n):
+            read = pysam.AlignedSegment()
+            read.query_name = "r%d" % i
+            read.flag = 99
+            read.reference_id = 0
+            read.reference_start = i
+            read.mapping_quality = 60
+            read.cigartuples = [(0, 50)]
+            read.query_sequence = "A" * 50
+            read.template_length = 300
+            out_handle.write(read)
+    return bam_file
+
+
+def test_paired_insert_stats_prefers_stored(tmpdir):
+    data = {"align_bam": str(tmpdir.join("missing.bam")),
+            "align_stats": {"insert_size": {"mean": 250.0, "std": 10.0}}}
+    assert shared.get_paired_insert_stats(data) == {"mean": 250.0, "std": 10.0}
+
+
+def test_paired_insert_stats_from_bam(tmpdir):
+    bam_file = _paired_bam(str(tmpdir.join("reads.bam")), 200)
+    work_dir = str(tmpdir.join("work"))
+    data = {"align_bam": bam_file, "dirs": {"work": work_dir}}
+    ins_stats = shared.get_paired_insert_stats(data)
+    assert ins_stats["mean"] == 300.0 and ins_stats["std"] == 0.0
+    assert os.path.exists(stats.cache_file(bam_file, work_dir))
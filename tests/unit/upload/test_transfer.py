@@ -0,0 +1,73 @@
+import os
+import shutil
+
+from bcbio.upload import filesystem, transfer
+
+
+class _Approach:
+    """Record uploaded files, copying them to the upload directory like the filesystem approach.
+    """
+    def __init__(self):
+        self.uploaded = []
+
+    def update_file(self, finfo, sample, upload_config):
+        self.uploaded.append(finfo["path"])
+        dest = filesystem.get_upload_path(finfo, sample, upload_config)
+        if not os.path.exists(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        shutil.copy(finfo["path"], dest)
+
+
+def _setup(tmpdir):
+    data = {"dirs": {"work": str(tmpdir.join("work"))}, "description": "s1"}
+    finfos = []
+    for name in ["a.bam", "b.vcf"]:
+        tmpdir.join(name).write(name * 10)
+        finfos.append({"path": str(tmpdir.join(name)), "sample": "s1"})
+    return data, finfos
+
+
+def test_skip_on_restart_and_dedup(tmpdir):
+    data, finfos = _setup(tmpdir)
+    upload_config = {"dir": str(tmpdir.join("final"))}
+    approach = _Approach()
+    # the same file listed twice goes to the same destination once
+    transfer.run(finfos + [dict(finfos[0])], data, upload_config, approach, data)
+    assert sorted(approach.uploaded) == sorted(x["path"] for x in finfos)
+    transfer.run(finfos, data, upload_config, approach, data)
+    assert len(approach.uploaded) == 2
+    os.remove(filesystem.get_upload_path(finfos[1], data, upload_config))
+    transfer.run(finfos, data, upload_config, approach, data)
+    assert approach.uploaded[2:] == [finfos[1]["path"]]
+
+
+def test_recopy_on_source_change(tmpdir):
+    data, finfos = _setup(tmpdir)
+    upload_config = {"dir": str(tmpdir.join("final"))}
+    approach = _Approach()
+    transfer.run(finfos, data, upload_config, approach, data)
+    with open(finfos[0]["path"], "a") as out_handle:
+        out_handle.write("more")
+    mtime = os.path.getmtime(finfos[1]["path"])
+    os.utime(finfos[1]["path"], (mtime + 100, mtime + 100))
+    transfer.run(finfos, data, upload_config, approach, data)
+    assert sorted(approach.uploaded[2:]) == sorted(x["path"] for x in finfos)
+    transfer.run(finfos, data, upload_config, approach, data)
+    assert len(approach.uploaded) == 4
+
+
+def test_remote_journal_keyed_on_location(tmpdir):
+    data, finfos = _setup(tmpdir)
+    upload_config = {"method": "s3", "dir": str(tmpdir.join("final")), "bucket": "bucket1",
+                     "folder": "project"}
+    approach = _Approach()
+    transfer.run(finfos, data, upload_config, approach, data)
+    journal = transfer.read_journal(transfer.journal_file(data))
+    assert sorted(journal) == ["s3://bucket1/project/s1/a.bam", "s3://bucket1/project/s1/b.vcf"]
+    # staged copies are not needed to skip remote transfers
+    shutil.rmtree(upload_config["dir"])
+    transfer.run(finfos, data, upload_config, approach, data)
+    assert len(approach.uploaded) == 2
+    for changed in [{"bucket": "bucket2"}, {"folder": "other"}]:
+        transfer.run(finfos, data, dict(upload_config, **changed), approach, data)
+    assert len(approach.uploaded) == 6
@@ -0,0 +1,42 @@
+import copy
+
+from bcbio.variation import multi
+
+
+def _samples():
+    out = []
+    for name, batch in [("s1", ["b1", "b2"]), ("s2", "b1"), ("s3", "b2")]:
+        out.append([{"description": name, "region": ("chr1", 0, 100),
+                     "region_bams": ["%s-chr1.bam" % name], "vrn_file": "%s.vcf.gz" % name,
+                     "work_bam": "%s.bam" % name, "metadata": {"batch": batch, "phenotype": "normal"},
+                     "config": {"algorithm": {"variantcaller": "gatk", "jointcaller": None,
+                                              "variant_regions": "regions.bed"}}}])
+    return out
+
+
+def test_group_batches_leaves_items_unmodified():
+    samples = _samples()
+    orig = copy.deepcopy(samples)
+    batches = multi.group_batches(samples)
+    assert samples == orig
+    by_group = {x["group"][0]: x for x in batches}
+    assert sorted(by_group) == ["b1", "b2"]
+    for name, batch_data in by_group.items():
+        assert batch_data["metadata"]["batch"] == name
+        assert len(batch_data["region_bams"]) == 2
+        for data in multi.get_orig_items(batch_data):
+            assert data["metadata"]["batch"] in (name, ["b1", "b2"])
+            assert "group_orig" not in data
+    assert samples == orig
+
+
+def test_group_batches_joint_leaves_items_unmodified():
+    samples = _samples()
+    for x in samples:
+        x[0]["config"]["algorithm"]["jointcaller"] = "gatk-haplotype-joint"
+    orig = copy.deepcopy(samples)
+    batches = multi.group_batches_joint(samples)
+    assert samples == orig
+    for batch_data in batches:
+        assert len(batch_data["vrn_files"]) == 2
+        assert batch_data["variant_regions"] == ["regions.bed"]
@@ -0,0 +1,65 @@
+import os
+
+from bcbio.variation import regioncost
+
+
+def _data(work_dir, caller="gatk-haplotype"):
+    return {"dirs": {"work": work_dir}, "config": {"algorithm": {"variantcaller": caller}}}
+
+
+def test_read_history(tmpdir):
+    in_file = str(tmpdir.join("region_runtimes.tsv"))
+    with open(in_file + ".1", "w") as out_handle:
+        out_handle.write("gatk-haplotype\tchr1\t0\t100\t1000.0\t1.0\t20.00\n")
+    with open(in_file, "w") as out_handle:
+        out_handle.write("gatk-haplotype\tchr2\t0\t100\t3000.0\t1.0\t20.00\n")
+        out_handle.write("vardict\tchr1\t0\t100\t100.0\t1.0\t50.00\n")
+        out_handle.write("vardict\tchr1\t0\t100\tbad\t1.0\t50.00\n")
+        out_handle.write("truncated\tchr1\n")
+        out_handle.write("freebayes\tchr1\t0\t100\t0.0\t1.0\t5.00\n")
+    assert regioncost.read_history(in_file) == {"gatk-haplotype": 0.01, "vardict": 0.5}
+
+
+def test_estimate_ordering(tmpdir, mocker):
+    data = _data(str(tmpdir))
+    mocker.patch("bcbio.variation.regioncost.bam.idxstats",
+                 side_effect=lambda bam_file, data: [mocker.Mock(contig="chr1", length=1000, aligned=10000),
+                                                     mocker.Mock(contig="chr2", length=1000, aligned=100)])
+    estimator = regioncost.Estimator(data)
+    args = [[data, ("chr1", 0, 100), ["a.bam"], "chr1_0.vcf.gz"],
+            [data, ("chr2", 0, 1000), ["a.bam"], "chr2_0.vcf.gz"],
+            [data, ("chr3", 0, 300), ["a.bam", "b.bam"], "chr3_0.vcf.gz"]]
+    args.sort(key=estimator.split_arg_cost, reverse=True)
+    assert [x[3] for x in args] == ["chr1_0.vcf.gz", "chr3_0.vcf.gz", "chr2_0.vcf.gz"]
+    assert estimator.estimates["chr1_0.vcf.gz"] == {"reads": 1000.0, "estimate": 1000.0}
+    assert all("region_estimate" not in x[0] for x in args)
+
+
+def test_record_saved_estimates(tmpdir, mocker):
+    data = _data(str(tmpdir))
+    mocker.patch("bcbio.variation.regioncost.bam.idxstats", return_value=[])
+    estimator = regioncost.Estimator(data)
+    estimator.split_arg_cost([data, ("chr1", 0, 100), ["a.bam"], "chr1_0.vcf.gz"])
+    run_parallel = mocker.Mock()
+    regioncost.saving_estimates(estimator, run_parallel)("variantcall_sample", [])
+    regioncost.record(data, ("chr1", 0, 100), "chr1_0.vcf.gz", 5.0)
+    regioncost.record(data, ("chr1", 100, 200), "unknown.vcf.gz", 5.0)
+    with open(regioncost.history_file(data)) as in_handle:
+        assert in_handle.read() == "gatk-haplotype\tchr1\t0\t100\t100.0\t100.0000\t5.00\n"
+    assert regioncost.Estimator(data)._rates == {"gatk-haplotype": 0.05}
+
+
+def test_record_rotates_history(tmpdir, mocker):
+    data = _data(str(tmpdir))
+    mocker.patch("bcbio.variation.regioncost.bam.idxstats", return_value=[])
+    mocker.patch("bcbio.variation.regioncost.MAX_HISTORY_BYTES", 100)
+    estimator = regioncost.Estimator(data)
+    for i in range(4):
+        estimator.split_arg_cost([data, ("chr1", i * 100, (i + 1) * 100), ["a.bam"], "%s.vcf.gz" % i])
+    estimator.save()
+    for i in range(4):
+        regioncost.record(data, ("chr1", i * 100, (i + 1) * 100), "%s.vcf.gz" % i, 1.0)
+    history = regioncost.history_file(data)
+    assert os.path.getsize(history + ".1") <= 200
+    assert not os.path.exists(history + ".2")
+    assert "gatk-haplotype" in regioncost.read_history(history)
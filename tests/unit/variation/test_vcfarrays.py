@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from bcbio.variation import vcfarrays
+
+
+def _calls():
+    return pd.DataFrame({"CHROM": ["1", "1", "1", "2", "2"], "POS": [10, 20, 30, 5, 8],
+                         "REF": ["A", "C", "GT", "T", "A"], "ALT": ["G", "A,T", "G", "C", "C"],
+                         "FILTER": ["PASS", "REJECT", "LowQ;PASS", np.nan, "PASS"],
+                         "DP": [30.0, 40.0, np.nan, 50.0, 20.0], "AF": ["0.25", "0.1,0.2", ".", "0.5", np.nan],
+                         "t:AD": ["10,5", "3,2,1", np.nan, np.nan, "0,0"],
+                         "t:AO": [np.nan, np.nan, "4", np.nan, np.nan], "t:RO": [np.nan, np.nan, 6.0, np.nan, np.nan]})
+
+
+def test_values():
+    vals = vcfarrays.values(pd.Series(["1,2", np.nan, "3", ".", "4,.,5"]))
+    np.testing.assert_array_equal(vals, [[1, 2, np.nan], [np.nan] * 3, [3, np.nan, np.nan],
+                                         [np.nan] * 3, [4, np.nan, 5]])
+
+
+def test_filters_and_snps():
+    calls = _calls()
+    assert vcfarrays.passes_filters(calls).tolist() == [True, False, False, True, True]
+    assert vcfarrays.passes_filters(calls, ["PASS", "REJECT"]).tolist() == [True, True, False, True, True]
+    assert vcfarrays.is_biallelic_snp(calls).tolist() == [True, False, False, True, True]
+    assert vcfarrays.first_alt(calls).tolist() == ["G", "A", "G", "C", "C"]
+
+
+def test_alt_and_depth():
+    alt, depth, freq = vcfarrays.alt_and_depth(_calls(), "t")
+    np.testing.assert_array_equal(alt, [5, 3, 4, np.nan, np.nan])
+    np.testing.assert_array_equal(depth, [15, 6, 10, 50, np.nan])
+    np.testing.assert_allclose(freq, [5 / 15.0, 0.5, 0.4, 0.5, np.nan])
+
+
+def test_sites():
+    sites = list(vcfarrays.sites(_calls().assign(QUAL=[1.5, np.nan, 3.0, 4.0, 5.0]), [1, 2]))
+    assert sites[0] == vcfarrays.Site("1", 20, 19, 20, "C", ("A", "T"), None)
+    assert (sites[1].start, sites[1].stop, sites[1].qual) == (29, 31, 3.0)
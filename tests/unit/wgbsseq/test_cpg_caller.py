@@ -0,0 +1,33 @@
+import numpy as np
+import scipy.stats
+
+from bcbio.wgbsseq import cpg_caller
+
+
+def test_fisher_matches_scipy():
+    tables = np.random.RandomState(1).randint(0, 40, (2000, 4))
+    tables[:20, :2] = 0
+    expected = [scipy.stats.fisher_exact([[a, b], [c, d]])[1] for a, b, c, d in tables]
+    assert np.allclose(cpg_caller.fisher_exact_pvalues(tables), expected, rtol=1e-12, atol=0)
+
+
+def test_postprocessing_joins_cpgs(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    header = "chr\tpos\tstrand\tcontext\tratio\teff_CT_count\tC_count\n"
+    mc_file = tmpdir.join("mc.txt")
+    mc_file.write(header + "chr1\t5\t+\tCG\t0.5\t20.00\t10\n"
+                  "chr1\t8\t+\tCHH\t0.5\t20.00\t10\n"
+                  "chr1\t12\t+\tCG\t0.1\t30.00\t3\n"
+                  "chr1\t20\t+\tCG\t0.9\t8.00\t7\n")
+    hmc_file = tmpdir.join("hmc.txt")
+    hmc_file.write(header + "chr1\t3\t+\tCG\t0.2\t10.00\t2\n"
+                   "chr1\t12\t+\tCG\t0.8\t25.00\t20\n"
+                   "chr1\t20\t+\tCG\t0.5\t30.00\t15\n")
+    data = {"cpg_file": str(mc_file), "control": str(hmc_file)}
+    out = cpg_caller.cpg_postprocessing(data)[0][0]
+    with open(out["hmc_file"]) as in_handle:
+        lines = in_handle.readlines()
+    assert len(lines) == 1
+    assert lines[0].startswith("chr1\t12\t+\tCG\t0.1\t30.00\t3\t0.8\t25.00\t20\t")
+    pvalue = float(lines[0].split("\t")[-1])
+    assert pvalue == scipy.stats.fisher_exact([[27, 3], [5, 20]])[1]